@@ -20,6 +20,7 @@ import os
 import os.path
 from argparse import ArgumentParser,FileType
 import re
+from functools import partial
 
 from wrairlib.util import write_fastaqual_to_fastq
 from roche.newbler import ProjectDirectory
@@ -33,9 +34,6 @@ contig_compiled_match = re.compile( contig_pattern )
 sample_pattern = '^(.*?.\d+)\s+(.*?,\s+\d+..\d+\s+length=\d+\s+numreads=\d+)'
 sample_compiled_match = re.compile( sample_pattern )
 
-# Global sample name
-# Has to be global for rename_seqid to work
-samplename = None
 formatter = Formatter( )
 
 def fq_from_projdir( projdir ):
@@ -47,9 +45,18 @@ def fq_from_projdir( projdir ):
 
     return open( os.path.join( path, '454AllContigs.fna' ) ), open( os.path.join( path, '454AllContigs.qual' ) )
 
-def rename_seqid( seqtitle ):
-    global contig_compiled_match
-    
+def sample_name( gsproj ):
+    '''
+        Sample name of a gsMapper project directory(ProjectDirectory instance)
+    '''
+    gsdirformatter = formatter.GsProject
+    return gsdirformatter.directory_format.parse_input_name( gsproj.basepath )['samplename']
+
+def rename_seqid( seqtitle, samplename ):
+    '''
+        title2ids that renames contigNNNNN to <samplename>.N
+        Use partial( rename_seqid, samplename=... ) to get a title2ids for a sample
+    '''
     # Perform the replacement
     replaced = contig_compiled_match.sub( r'%s.\1 ' % samplename, seqtitle )
 
@@ -67,27 +74,29 @@ def rename_seqid( seqtitle ):
     id, desc = m.groups()
     return id, ' ', desc
     
-def to_allsample( gsproj, outputfile ):
+def to_allsample( gsproj, outputfile, samplename = None ):
     '''
         gsproj is a ProjectDirectory Instance
+        samplename is what contigs are renamed to[Default: sample_name( gsproj )]
     '''
-    global samplename, formatter
+    if samplename is None:
+        samplename = sample_name( gsproj )
 
     # Get filehandles for 454Allcontigs.* files
     fastah, qualh = fq_from_projdir( gsproj )
 
-    # Set the global variable for samplename for title2id to work
-    gsdirformatter = formatter.GsProject
-    samplename = gsdirformatter.directory_format.parse_input_name( gsproj.basepath )['samplename']
-
     # Write the records
-    records = write_fastaqual_to_fastq( fastah, qualh, outputfile, title2ids=rename_seqid )
+    try:
+        records = write_fastaqual_to_fastq( fastah, qualh, outputfile, title2ids=partial( rename_seqid, samplename=samplename ) )
+    finally:
+        fastah.close()
+        qualh.close()
 
     # Return # records written
     return records
 
 def main( args ):
-    to_allsample( Projectdirectory( args.projdir ), args.output )
+    to_allsample( ProjectDirectory( args.projdir ), args.output )
 
 def get_args( ):
     parser = ArgumentParser( )
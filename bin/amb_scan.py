@@ -6,6 +6,7 @@ from argparse import ArgumentParser
 import os
 import os.path
 import sys
+import re
 import pprint
 
 # Any bases found not in this string will be counted as ambiguous
@@ -14,53 +15,135 @@ DNABASES = 'ATGC'
 def main():
     args = parse_args()
 
-    if not os.path.exists( args.bam ):
-        print "{} does not exist".format( args.bam )
-        sys.exit( -1 )
-
-    start = int( args.rstart )
-    end = int( args.rend )
-    if start >= end:
-        print "{} is not larger than {}".format( end, start )
-        sys.exit( -1 )
-
-    # Open the sam
-    bam = pysam.Samfile( args.bam )
-    # Get the reference
-    ref = bam.references[0]
-    # This will hold each read's statistics
-    # 'read': {'ambiguities': 0}
+    for bam in args.bam:
+        if not os.path.exists( bam ):
+            print "{} does not exist".format( bam )
+            sys.exit( -1 )
+
+    regions = [parse_region( region ) for region in args.regions]
+    for ref, start, end in regions:
+        if start >= end:
+            print "{} is not larger than {}".format( end, start )
+            sys.exit( -1 )
+
+    # Original single bam and region output is just read,ambiguities
+    single = len( args.bam ) == 1 and len( regions ) == 1
+    for bampath in args.bam:
+        # Open the sam
+        bam = pysam.Samfile( bampath )
+        for ref, start, end in regions:
+            reads = region_ambiguities( bam, ref, start, end )
+            if single:
+                print_csv( reads )
+            else:
+                print_csv( reads, [bampath, format_region( ref, start, end )] )
+        bam.close()
+
+def region_ambiguities( bam, ref, start, end ):
+    '''
+        count_ambiguities for a region of ref or of every reference in bam when ref is None
+        Reads that are on more than one reference get the sum of their ambiguities
+    '''
+    if ref is not None:
+        return count_ambiguities( bam, ref, start, end )
     reads = {}
-    # Iterate over every read in the alignment(Iterate down)
-    for read in bam.fetch( ):
-        # Iterate over all of the bases(Iterate right)
-        # Enumerate so each base is indexed(Zero indexed, be warned)
-        # read.pos is the position of first base in alignment(aka read.seq[1] is actually pos read.pos in the alignment)
-        for i, base in enumerate( read.seq, read.pos ):
-            # Only interested in the bases between start and end(Don't forget these are 0 indexed)
-            if i in range( start+1, end ):
-                if base.lower() not in DNABASES.lower():
-                    # Make sure the read name is in stats dictionary
-                    if read.qname not in reads:
-                        # Initialize stats for this read
-                        reads[read.qname] = {'ambiguities': 1}
-                    else:
-                        reads[read.qname]['ambiguities'] += 1
-
-    print_csv( reads )
-
-def print_csv( read_stats ):
-    for read_name, stats in sorted( read_stats.items() ):
-        print "{},{}".format(read_name,stats['ambiguities'])
-        
+    for ref in bam.references:
+        for read_name, ambiguities in count_ambiguities( bam, ref, start, end ).items():
+            reads[read_name] = reads.get( read_name, 0 ) + ambiguities
+    return reads
+
+def aligned_pairs( read ):
+    '''
+        [(read index, reference position),...] of a read like pysam gives them
+        Either is None for inserted, soft clipped or deleted bases
+    '''
+    if hasattr( read, 'get_aligned_pairs' ):
+        return read.get_aligned_pairs()
+    return read.aligned_pairs
+
+def count_ambiguities( bam, ref, start, end ):
+    '''
+        Count the bases that are not in DNABASES for each read in the region
+        Only reads overlapping the region are fetched from the bam index
+
+        Bases are placed on the reference position they are aligned to and only
+        positions start < i < end are counted(Zero indexed, be warned)
+        Inserted and soft clipped bases are not on the reference so they are never counted
+
+        @param bam - Opened pysam.Samfile with an index
+        @param ref - Reference name the region is on
+        @param start - Region start
+        @param end - Region end
+
+        @returns dictionary keyed by read name with the amount of ambiguous bases in the region
+            Reads without any ambiguous bases are left out
+    '''
+    reads = {}
+    for read in bam.fetch( ref, start + 1, end ):
+        seq = read.seq
+        if not seq:
+            continue
+        if read.cigar == [(0, len( seq ))]:
+            # Every base is aligned one after the other so the read can just be sliced
+            first = max( start + 1, read.pos ) - read.pos
+            last = min( end, read.pos + len( seq ) ) - read.pos
+            bases = seq[first:last]
+        else:
+            bases = ''.join( [seq[i] for i, pos in aligned_pairs( read )
+                if i is not None and pos is not None and start < pos < end] )
+        # Whatever is left after removing the normal bases is ambiguous
+        ambiguities = len( bases.upper().translate( None, DNABASES ) )
+        if ambiguities:
+            reads[read.qname] = reads.get( read.qname, 0 ) + ambiguities
+    return reads
+
+def parse_region( region ):
+    '''
+        Parse [ref:]start-end into (ref, start, end)
+        ref is None if it is not given which means every reference
+
+        >>> parse_region( 'chr1:10-20' ), parse_region( '5-100' )
+        (('chr1', 10, 20), (None, 5, 100))
+    '''
+    m = re.match( '^(?:(?P<ref>.+):)?(?P<start>\d+)-(?P<end>\d+)$', region )
+    if not m:
+        raise ValueError( "{} is not a valid region. Use [ref:]start-end".format(region) )
+    return m.group( 'ref' ), int( m.group( 'start' ) ), int( m.group( 'end' ) )
+
+def format_region( ref, start, end ):
+    '''
+        Inverse of parse_region
+
+        >>> format_region( 'chr1', 10, 20 ), format_region( None, 5, 100 )
+        ('chr1:10-20', '5-100')
+    '''
+    if ref is None:
+        return "{}-{}".format( start, end )
+    return "{}:{}-{}".format( ref, start, end )
+
+def print_csv( read_stats, prefix = [] ):
+    for read_name, ambiguities in sorted( read_stats.items() ):
+        print ",".join( prefix + [read_name, str(ambiguities)] )
+
 def parse_args():
-    parser = ArgumentParser()
+    parser = ArgumentParser( description='Count ambiguous bases of every read in regions of bam files. '\
+        'Use either bam rstart rend or -r for each region and any amount of bam files' )
 
-    parser.add_argument( dest='bam', help='Bamfile path' )
-    parser.add_argument( dest='rstart', help='Region start' )
-    parser.add_argument( dest='rend', help='Region end' )
+    parser.add_argument( dest='bam', nargs='+', help='Bamfile path(s) followed by Region start and Region end '\
+        'if -r is not used' )
+    parser.add_argument( '-r', '--region', dest='regions', action='append', default=[],
+        help='Region to scan as [ref:]start-end. Without ref the region is scanned on every reference. '\
+        'Can be given many times' )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    # bam rstart rend like before
+    if not args.regions:
+        if len( args.bam ) < 3:
+            parser.error( "Need Region start and Region end or -r" )
+        rstart, rend = args.bam[-2:]
+        args.bam = args.bam[:-2]
+        args.regions = ["{}-{}".format(rstart,rend)]
+    return args
 
 if __name__ == '__main__':
     main()
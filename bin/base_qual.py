@@ -1,84 +1,85 @@
 #!/usr/bin/env python
 
 import sys
+import os
+import os.path
 from argparse import ArgumentParser
-from Bio import SeqIO
+
+from wrairlib.qualstats import profile_file, profile_run, sample_for_file
 
 def main( ):
     args = parse_args()
 
-    print_csv( parse_file( args.inputfile ) )
+    histogram = bool( args.quantiles )
+    # Single file keeps the original behavior of printing to STDOUT
+    if len( args.inputfile ) == 1 and os.path.isfile( args.inputfile[0] ) and not args.outdir:
+        print_csv( profile_file( args.inputfile[0], histogram, progress=report_progress ), args.quantiles )
+        return
 
-def print_csv( stats ):
-    '''
-        Prints the stats in a csv format to STDOUT for easy graphing
+    per_file, per_sample, run = profile_run( args.inputfile, args.cpus, histogram )
+    if not args.outdir:
+        print_csv( run, args.quantiles )
+        return
+    write_profiles( args.outdir, per_file, per_sample, run, args.quantiles )
 
-        @param stats - Output from parse_file
+def write_profiles( outdir, per_file, per_sample, run, quantiles = () ):
     '''
-    # Print stat headers
-    stat_headers = ['Pos','Min','Sum','Avg','Max','Depth']
-    print ",".join( stat_headers )
+        Write a csv for every file, every sample and the entire run
 
-    # Loop through stats
-    for pos, stat in enumerate( stats, start=1 ):
-        print "{},{}".format( pos, ','.join( [str(x) for x in stat] ) )
-
-def parse_file( filename ):
+        <outdir>/files/<sample>/<read file>.csv
+        <outdir>/samples/<sample>.csv
+        <outdir>/run.csv
     '''
-        Parses the file into statistics about each base seen
-
-        @param filename - File path to parse(.qual file)
-        @return List of [(min, sum, avg, max, depth),...] for each base position.
+    for path, stats in per_file.items():
+        sampledir = os.path.join( outdir, 'files', sample_for_file( path ) )
+        if not os.path.isdir( sampledir ):
+            os.makedirs( sampledir )
+        with open( os.path.join( sampledir, os.path.basename( path ) + '.csv' ), 'w' ) as fh:
+            print_csv( stats, quantiles, fh )
+    samplesdir = os.path.join( outdir, 'samples' )
+    if not os.path.isdir( samplesdir ):
+        os.makedirs( samplesdir )
+    for sample, stats in per_sample.items():
+        with open( os.path.join( samplesdir, sample + '.csv' ), 'w' ) as fh:
+            print_csv( stats, quantiles, fh )
+    with open( os.path.join( outdir, 'run.csv' ), 'w' ) as fh:
+        print_csv( run, quantiles, fh )
+
+def report_progress( records_read ):
+    ''' Let the user know how many records of a single file have been parsed '''
+    sys.stderr.write( "{} records parsed\n".format( records_read ) )
+
+def print_csv( stats, quantiles = (), out = sys.stdout ):
     '''
-    stats = []
-    records_read = 0
-    for record in SeqIO.parse( filename, 'qual' ):
-        parse_read( record, stats )
-        records_read += 1
-        if records_read % 1000 == 0:
-            sys.stderr.write( "{} records parsed\n".format( records_read ) )
-
-    return stats
+        Prints the stats in a csv format to STDOUT for easy graphing
 
-def parse_read( seq_record, running_stats ):
+        @param stats - wrairlib.qualstats.QualityStats to print
+        @param quantiles - Percentiles to add as columns after Depth
+        @param out - File handle to print to instead of STDOUT
     '''
-        Updates stats list with seq_records's information
-
-        @param seq_record - Bio.seq record which should be a 454 qual record
-        @param running_stats - List of [(min, sum, avg, max, depth),...] stats where each 
-            index relates to a base position
+    # Print stat headers
+    stat_headers = ['Pos','Min','Sum','Avg','Max','Depth'] + ['Q{}'.format(q) for q in quantiles]
+    print >>out, ",".join( stat_headers )
 
-        >>> from Bio.SeqRecord import SeqRecord
-        >>> from Bio.Seq import UnknownSeq
-        >>> sr = SeqRecord( UnknownSeq( 3 ) )
-        >>> sr.letter_annotations = {'phred_quality': [35, 40, 1]}
-        >>> rs = []
-        >>> parse_read( sr, rs )
-        >>> assert rs == [(35,35,35.0,35,1),(40,40,40.0,40,1),(1,1,1.0,1,1)], rs
-        >>> sr2 = SeqRecord( UnknownSeq( 4 ) )
-        >>> sr2.letter_annotations = {'phred_quality': [35, 40, 2, 2]}
-        >>> parse_read( sr2, rs )
-        >>> assert rs == [(35,70,35.0,35,2),(40,80,40.0,40,2),(1,3,1.5,2,2),(2,2,2.0,2,1)], rs
-    '''
-    # Quality scores as a list
-    quals = seq_record.letter_annotations['phred_quality']
-    for i in range( len( quals ) ):
-        # Check to see if we have seen this position yet
-        if not len( running_stats ) > i or not isinstance( running_stats[i], tuple ):
-            running_stats.append( (100,0,0,0,0) )
-        minq, sumq, avgq, maxq, depth = running_stats[i]
-        minq = min( quals[i], minq )
-        sumq += quals[i]
-        maxq = max( quals[i], maxq )
-        depth = depth + 1
-        avgq = sumq * 1.0 / depth
-        running_stats[i] = (minq, sumq, avgq, maxq, depth)
+    rows = stats.stats()
+    columns = [stats.quantiles( q ).tolist() for q in quantiles]
+    # Loop through stats
+    for pos, stat in enumerate( rows, start=1 ):
+        stat = list( stat ) + [col[pos-1] for col in columns]
+        print >>out, "{},{}".format( pos, ','.join( [str(x) for x in stat] ) )
 
 def parse_args( ):
-    parser = ArgumentParser( description='Parse a .qual file into statistics about'\
+    parser = ArgumentParser( description='Parse .qual, .fastq or .sff files into statistics about '\
         'each base' )
 
-    parser.add_argument( dest='inputfile', help='The qual file to parse' )
+    parser.add_argument( dest='inputfile', nargs='+', help='The qual/fastq/sff file to parse or many '\
+        'qual/fastq/sff files and directories(such as ReadsBySample) to profile together' )
+    parser.add_argument( '-j', '--cpus', dest='cpus', type=int, default=1,
+        help='How many files to profile at once[Default: 1]' )
+    parser.add_argument( '-o', '--outdir', dest='outdir', default=None,
+        help='Write a csv for every file(files/), every sample(samples/) and the entire run(run.csv) into this directory' )
+    parser.add_argument( '-q', '--quantiles', dest='quantiles', type=int, nargs='+', default=[],
+        help='Percentiles of the quality at each position to add as columns(Example: -q 25 50 75)' )
 
     return parser.parse_args()
 
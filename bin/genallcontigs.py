@@ -5,8 +5,10 @@ import sys
 import os
 import os.path
 import re
+import time
+import multiprocessing
 
-from allcontig_to_allsample import to_allsample
+from allcontig_to_allsample import to_allsample, sample_name
 
 from roche.newbler import ProjectDirectory
 
@@ -45,25 +47,63 @@ def get_gsproj( maindir ):
     return gsproj
 
 def contig_to_sample( gsproj, outputdir ):
+    '''
+        Write the 454AllContigs.* of a gsMapper project as <outputdir>/<project>.fastq
+        The fastq is written to a temporary file that is renamed when it is complete so
+        a failed or interrupted project never leaves a partial fastq behind
+
+        Returns (outfile, records written, seconds it took)
+    '''
+    start = time.time()
     logger.info( "Processing %s" % gsproj.path )
     outfile = os.path.join( outputdir, "%s.fastq" % os.path.basename( gsproj.basepath ) )
-    with open( outfile, 'w' ) as ofh:
-        records_written = to_allsample( gsproj, ofh )
+    tmpfile = os.path.join( outputdir, ".%s.%d.tmp" % (os.path.basename( outfile ), os.getpid()) )
+    try:
+        with open( tmpfile, 'w' ) as ofh:
+            records_written = to_allsample( gsproj, ofh, sample_name( gsproj ) )
+        os.rename( tmpfile, outfile )
+    finally:
+        if os.path.exists( tmpfile ):
+            os.unlink( tmpfile )
     logger.info( "%d sequences written to %s" % (records_written, outfile) )
+    return outfile, records_written, time.time() - start
+
+def _contig_to_sample( args ):
+    ''' contig_to_sample for a pool worker which only gets the project's top directory '''
+    basepath, outputdir = args
+    return contig_to_sample( ProjectDirectory( basepath ), outputdir )
+
+def print_summary( results, out = sys.stdout ):
+    ''' Records written and seconds taken for every project '''
+    out.write( "%-50s %10s %10s\n" % ('Project', 'Records', 'Seconds') )
+    for outfile, records, seconds in results:
+        out.write( "%-50s %10d %10.2f\n" % (os.path.basename( outfile )[:-len( '.fastq' )], records, seconds) )
 
 def main( args ):
     setup_logger( args.loglevel )
+    start = time.time()
     # Ensure directory exists and gets default value
     outdir = get_output_dir( args.maindir, args.outdir )
     logger.info( "Generating %s" % outdir )
-    for gsproj in get_gsproj( args.maindir ):
-        contig_to_sample( gsproj, outdir )
+    gsprojs = get_gsproj( args.maindir )
+    if args.jobs > 1 and len( gsprojs ) > 1:
+        pool = multiprocessing.Pool( min( args.jobs, len( gsprojs ) ) )
+        try:
+            results = pool.map( _contig_to_sample, [(gsproj.basepath, outdir) for gsproj in gsprojs] )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [contig_to_sample( gsproj, outdir ) for gsproj in gsprojs]
+    print_summary( results )
+    print "%d records from %d projects in %.2f seconds" % (sum( [r[1] for r in results] ), len( results ), time.time() - start)
 
 def get_args( ):
     parser = ArgumentParser()
 
     parser.add_argument( '-d', dest='maindir', required=True, help='Top directory containing multiple gs project directories' )
     parser.add_argument( '-o', '--out-dir', dest='outdir', default=None, help='Ouput directory[Default: FastaContigs inside of directory specified with -d option' )
+    parser.add_argument( '-j', '--jobs', dest='jobs', type=int, default=1, help='How many projects to convert at the same time[Default: 1]' )
     parser.add_argument( '-l', '--log-level', dest='loglevel', default='INFO', choices=('DEBUG','INFO'), help='What logging level to use[Default: INFO]')
 
     args = parser.parse_args()
@@ -5,14 +5,14 @@ import os.path
 import sys
 from argparse import ArgumentParser, FileType
 
-from Bio import SeqIO
-
 from roche.newbler.projectdir import ProjectDirectory
 
 from wrairanalysis.refstatusxls import *
+from wrairlib.util import get_idents_from_references
 
-def ref_idents( reffile ):
-    return [seq.id for seq in SeqIO.parse( reffile, 'fasta' )]
+def ref_idents( reffiles ):
+    ''' All identifiers in the reference files in the order they are given '''
+    return [ident for idents in get_idents_from_references( reffiles ).values() for ident in idents]
 
 def get_gsdirs( path ):
     ''' Return all gs dirs in a path '''
@@ -32,6 +32,11 @@ def get_gsdirs( path ):
     return sgsds
 
 def make_workbook( projdir, output, reference = None ):
+    # Reference files are only read once for all the projects
+    idents = None
+    if reference:
+        idents = ref_idents( reference )
+
     # The parent workbook
     wb = start_workbook()
 
@@ -42,8 +47,8 @@ def make_workbook( projdir, output, reference = None ):
         # Setup a new project in the worksheet
         ws.set_new_project( pd )
         # If reference was specified then make sheet with only that reference
-        if reference:
-            ws.make_sheet( ref_idents( reference ) )
+        if idents is not None:
+            ws.make_sheet( idents )
         else:
             ws.make_sheet()
 
@@ -58,7 +63,8 @@ def get_args( ):
     parser = ArgumentParser()
 
     parser.add_argument( '-d', dest='projdir', required=True, help='A directory mapSamples.py was run in' )
-    parser.add_argument( '-r', '--reference', dest='reference', help='Reference file to only include in output' )
+    parser.add_argument( '-r', '--reference', dest='reference', action='append', help='Reference file to only include in output. '\
+        'Can be given many times' )
     parser.add_argument( '-o', dest='output', default='AllRefStatus.xls', help='Output file name[Default: ./AllRefStatus.xls]' )
 
     args = parser.parse_args()
@@ -4,14 +4,15 @@ import os
 import os.path
 import sys
 from argparse import ArgumentParser
-from Bio import SeqIO
 from glob import glob
 
+from wrairlib import sff as sffio
+
 def main( ):
     args = parse_args()
 
     if os.path.isdir( args.input ):
-        sffs = glob.glob( args.input + '/*.sff' )
+        sffs = glob( args.input + '/*.sff' )
     elif os.path.exists( args.input ):
         sffs = [args.input]
     else:
@@ -21,7 +22,8 @@ def main( ):
     for sff in sffs:
         bn, ext = os.path.splitext( sff )
         outname = bn + '.fastq'
-        SeqIO.write( SeqIO.parse( sff, 'sff' ), outname, 'fastq' )
+        with open( outname, 'w' ) as fh:
+            sffio.write_fastq( sffio.iter_records( sff ), fh )
 
 def parse_args( ):
     parser = ArgumentParser( description='Convert sff file to fastq' )
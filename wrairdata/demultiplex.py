@@ -6,6 +6,8 @@ import re
 
 from util import *
 from wrairlib.settings import setup_logger
+from wrairlib import sff
+from wrairlib.barcode import BarcodeIndex, AMBIGUOUS
 
 logger = setup_logger( name=__name__ )
 
@@ -31,6 +33,120 @@ class ReadList( object ):
                 reads[read['barcode']] = read['numreads']
         return reads
 
+class MidParse( object ):
+    ''' Read a MidParse.conf file used by sfffile -mcf '''
+    @classmethod
+    def parse( self, fh_fp ):
+        '''
+            Returns dictionary keyed by each group name with a value of another dictionary
+                keyed by mid name with a value of (sequence, mismatches allowed, 3' sequence)
+                3' sequence is None when it is not given
+
+            >>> mp = MidParse.parse( StringIO( 'MID\\n{\\nmid = "RL1", "ACACGACGACT", 1, "AGTCGTGGTGT";\\nmid = "IX001", "CTAAGGTAAC", 0;\\n}\\n' ) )
+            >>> sorted( mp['MID'].items() )
+            [('IX001', ('CTAAGGTAAC', 0, None)), ('RL1', ('ACACGACGACT', 1, 'AGTCGTGGTGT'))]
+        '''
+        fh = ReadList._open( fh_fp )
+        cpat = re.compile( r'^mid\s*=\s*"(?P<name>[^"]+)"\s*,\s*"(?P<sequence>[^"]*)"\s*,\s*(?P<mismatches>\d+)\s*(?:,\s*"(?P<threeprime>[^"]*)"\s*)?;' )
+        groups = {}
+        group = None
+        last = None
+        for line in fh:
+            line = line.strip()
+            # Skip blank and comment lines
+            if not line or line.startswith( '#' ):
+                continue
+            if line == '{':
+                group = last
+                groups[group] = {}
+            elif line == '}':
+                group = None
+            elif group is not None:
+                m = cpat.match( line )
+                if not m:
+                    raise ValueError( "Unparsable MidParse line: '%s'" % line )
+                mid = m.groupdict()
+                groups[group][mid['name']] = (mid['sequence'], int( mid['mismatches'] ), mid['threeprime'])
+            last = line
+        return groups
+
+def mid_index( midparse, midlist ):
+    '''
+        Returns a BarcodeIndex of every mid in midlist using the mismatches allowed
+        for each in midparse. Indels count as mismatches like they do for sfffile
+        The values are the group name joined with the mid name(MIDRL1) which is what
+        sfffile names its output
+
+        midparse - Output of MidParse.parse
+        midlist - List of mid names inside of midparse
+    '''
+    index = BarcodeIndex( indels=True )
+    for midname in midlist:
+        for group, mids in sorted( midparse.items() ):
+            if midname in mids:
+                sequence, mismatches, threeprime = mids[midname]
+                index.add( group + midname, sequence, mismatches )
+                break
+        else:
+            raise ValueError( "{} is not in the MidParse file".format(midname) )
+    return index
+
+def demultiplex_sff_native( sfffile, midparsefile, midlist, outputdir, trim = True ):
+    '''
+        In process replacement for demultiplex_sff that does not need sfffile
+
+        sfffile - Actual sfffile to demultiplex
+        midparsefile - Config file mapping barcodes to barcode sequences
+        midlist - List of midkey names inside of midparsefile to extract
+        outputdir - Directory to write 454Reads.<group><mid>.sff files into
+        trim - Move each read's left quality clip past its mid
+
+        Returns dictionary keyed by group + mid name with the number of reads written for each
+    '''
+    sfffile = abspath_or_error( sfffile )
+    midparsefile = abspath_or_error( midparsefile )
+    if not midlist:
+        raise ValueError( "Midlist given to demultiplex_sff_native is empty" )
+    outputdir = os.path.abspath( outputdir )
+    if not os.path.isdir( outputdir ):
+        os.mkdir( outputdir )
+
+    index = mid_index( MidParse.parse( midparsefile ), midlist )
+    # Longest part of a read a mid could match
+    maxlen = index.lengths[-1]
+    # Every mid is reported even if no reads matched it
+    counts = dict( [(value, 0) for distance, value in index.table.values() if distance == 0] )
+    ambiguous = 0
+    writers = {}
+    try:
+        with open( sfffile, 'rb' ) as fh:
+            header = sff.SffHeader.read( fh )
+            keylen = len( header.key_sequence )
+            for read in sff.iter_raw_reads( fh, header ):
+                mid, length = index.match_prefix( read.subsequence( keylen, keylen + maxlen ).lower() )
+                if mid is None:
+                    continue
+                elif mid == AMBIGUOUS:
+                    ambiguous += 1
+                    continue
+                data = read.data
+                if trim and read.clip_qual_left < keylen + length:
+                    data = sff.set_clip_qual_left( data, keylen + length )
+                if mid not in writers:
+                    path = os.path.join( outputdir, '454Reads.{}.sff'.format( mid ) )
+                    writers[mid] = sff.SffRawWriter( open( path, 'wb' ), header )
+                writers[mid].write( data )
+                counts[mid] += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+            writer.handle.close()
+
+    logger.info( "{} reads in {} matched more than one mid".format( ambiguous, sfffile ) )
+    for mid, count in sorted( counts.items() ):
+        logger.info( "{}: {} reads written".format( mid, count ) )
+    return counts
+
 def demultiplex( sffdir, outputdir, runfile, midparsefile, sfffilecmd ):
     '''
         Given a sffdir path
@@ -45,6 +161,8 @@ def demultiplex( sffdir, outputdir, runfile, midparsefile, sfffilecmd ):
         Returns dictionary keyed by each sfffile's name with a value of another dictionary
             that is keyed by the barcode outputted by the command with value of how many reads were written
             for that barcode
+
+        If sfffilecmd is None the sff files are demultiplexed in process with demultiplex_sff_native
     '''
     # ensures sffdir is abspath
     sffdir = abspath_or_error( sffdir )
@@ -76,6 +194,7 @@ def demultiplex( sffdir, outputdir, runfile, midparsefile, sfffilecmd ):
 
     # Loop through every region's sff files
     sffprocesses = []
+    results = {}
     for region, sffpath in sff_files.items():
         # Make region output directory if it doesn't exist
         region_dir = os.path.join( outputdir, str( region ) ) 
@@ -90,13 +209,15 @@ def demultiplex( sffdir, outputdir, runfile, midparsefile, sfffilecmd ):
         midlist = rf[region].keys()
 
         # Demultiplex the sff file into that directory
+        if sfffilecmd is None:
+            results[os.path.basename(sffpath)] = demultiplex_sff_native( sffpath, midparsefile, midlist, region_dir )
+            continue
         p = demultiplex_sff( sff_files[region], midparsefile, midlist, sfffilecmd, os.path.join( outputdir, str( region ) ) )
         # Keep track of our opened process and what sff file it is demultiplexing
         sffprocesses.append( (p,sff_files[region]) )
 
     # Should wait for both processes to finish
     failed = False
-    results = {}
     for p, sfffile in sffprocesses:
         stdout, stderr = p.communicate()
         logger.info( stdout )
@@ -0,0 +1,75 @@
+import os
+import os.path
+
+from nose.tools import eq_, ok_, raises
+from Bio import SeqIO
+
+import common
+import fixtures
+
+from .. import demultiplex
+
+from wrairlib.runfiletitanium import RunFile
+
+def expected_counts( sffname ):
+    ''' Read counts from the sfffile -s fixture for sffname as integers '''
+    lst = fixtures.demultiplex_reads_lst()[sffname.replace( '.sff', '.lst' )]
+    return {mid: int( count ) for mid, count in demultiplex.ReadList.parse( lst ).items()}
+
+class TestMidParse( object ):
+    def test_parses_fixture( self ):
+        mp = demultiplex.MidParse.parse( fixtures.MIDPARSE )
+        ok_( fixtures.MIDPREFIX in mp )
+        eq_( ('ACACGACGACT', 1, 'AGTCGTGGTGT'), mp[fixtures.MIDPREFIX]['RL1'] )
+
+    @raises( ValueError )
+    def test_mid_missing( self ):
+        mp = demultiplex.MidParse.parse( fixtures.MIDPARSE )
+        demultiplex.mid_index( mp, ['RL1', 'RL999'] )
+
+class TestDemultiplexSffNative( common.BaseClass ):
+    sffs = fixtures.multiplex_sffs()
+    rf = RunFile( fixtures.RUNFILE_PATH )
+
+    def region( self, sffn ):
+        return int( sffn.replace( '.sff', '' )[-2:] )
+
+    def test_matches_sfffile( self ):
+        ''' Same read counts as sfffile '''
+        for sffn, sffp in self.sffs.items():
+            counts = demultiplex.demultiplex_sff_native( sffp, fixtures.MIDPARSE, self.rf[self.region( sffn )].keys(), self.tempdir )
+            eq_( expected_counts( sffn ), counts )
+
+    def test_output_files( self ):
+        ''' Every written file is a valid sff with as many reads as counted '''
+        sffn, sffp = sorted( self.sffs.items() )[0]
+        counts = demultiplex.demultiplex_sff_native( sffp, fixtures.MIDPARSE, self.rf[self.region( sffn )].keys(), 'outputdir' )
+        for mid, count in counts.items():
+            path = os.path.join( 'outputdir', '454Reads.{}.sff'.format( mid ) )
+            if not count:
+                ok_( not os.path.exists( path ) )
+                continue
+            reads = list( SeqIO.parse( path, 'sff' ) )
+            eq_( count, len( reads ) )
+            # Mid is trimmed off by the left quality clip
+            for read in reads:
+                ok_( read.annotations['clip_qual_left'] > 4 )
+
+    @raises( ValueError )
+    def test_emptymidlist( self ):
+        sffn, sffp = self.sffs.items()[0]
+        demultiplex.demultiplex_sff_native( sffp, fixtures.MIDPARSE, [], self.tempdir )
+
+class TestDemultiplexNative( common.BaseClass ):
+    rf = RunFile( fixtures.RUNFILE_PATH )
+
+    def test_demultiplex( self ):
+        ''' sfffilecmd of None demultiplexes in process '''
+        outdir = os.path.join( self.tempdir, 'test' )
+        results = demultiplex.demultiplex( fixtures.FIXTURE_PATH, outdir, self.rf, fixtures.MIDPARSE, None )
+        eq_( {sffn: expected_counts( sffn ) for sffn in fixtures.multiplex_sffs()}, results )
+        expected_dirs = [str(self.rf_region( n )) for n in fixtures.multiplex_sffs()]
+        common.ere( expected_dirs, os.listdir( outdir ) )
+
+    def rf_region( self, sffn ):
+        return int( os.path.splitext( sffn )[0][-2:] )
@@ -0,0 +1,177 @@
+### Barcode lookup tables that tolerate sequencing errors
+from itertools import combinations, product
+
+# Bases a read can have in place of a barcode base
+# n is included so no-calls count as a mismatch instead of never matching
+BASES = 'acgtn'
+
+# Most mismatches a barcode can have before the neighborhoods get too large
+MAX_MISMATCHES = 2
+
+# Value looked up for sequences that are equally close to more than one barcode
+AMBIGUOUS = '<ambiguous>'
+
+def hamming_distance( seq1, seq2 ):
+    """
+        Number of positions that differ between two sequences of the same length
+        Sequences of different lengths are never within any distance
+
+        >>> hamming_distance( 'acgt', 'acct' )
+        1
+        >>> hamming_distance( 'acgt', 'acg' ) is None
+        True
+    """
+    if len( seq1 ) != len( seq2 ):
+        return None
+    return sum( [1 for a, b in zip( seq1, seq2 ) if a != b] )
+
+def hamming_neighbors( sequence, distance, alphabet = BASES ):
+    """
+        Returns {neighbor: distance} for every sequence within distance substitutions of sequence
+        sequence is included with a distance of 0
+
+        >>> n = hamming_neighbors( 'ac', 1, 'acgt' )
+        >>> sorted( n.items() )
+        [('aa', 1), ('ac', 0), ('ag', 1), ('at', 1), ('cc', 1), ('gc', 1), ('tc', 1)]
+        >>> len( hamming_neighbors( 'acgtacgtac', 2, 'acgt' ) )
+        436
+    """
+    neighbors = {sequence: 0}
+    for d in range( 1, distance + 1 ):
+        for positions in combinations( range( len( sequence ) ), d ):
+            # Every base at each position other than the original base
+            choices = [[b for b in alphabet if b != sequence[p]] for p in positions]
+            for bases in product( *choices ):
+                neighbor = list( sequence )
+                for p, b in zip( positions, bases ):
+                    neighbor[p] = b
+                neighbors.setdefault( ''.join( neighbor ), d )
+    return neighbors
+
+def edit_neighbors( sequence, distance, alphabet = BASES ):
+    """
+        Returns {neighbor: distance} for every sequence within distance
+        substitutions, insertions or deletions of sequence
+        sequence is included with a distance of 0
+
+        >>> n = edit_neighbors( 'ac', 1, 'acgt' )
+        >>> sorted( [k for k, v in n.items() if len( k ) != 2] )
+        ['a', 'aac', 'aca', 'acc', 'acg', 'act', 'agc', 'atc', 'c', 'cac', 'gac', 'tac']
+    """
+    neighbors = {sequence: 0}
+    last = [sequence]
+    for d in range( 1, distance + 1 ):
+        found = []
+        for seq in last:
+            edits = []
+            for i in range( len( seq ) ):
+                # Deletion
+                edits.append( seq[:i] + seq[i+1:] )
+                # Substitution
+                edits += [seq[:i] + b + seq[i+1:] for b in alphabet if b != seq[i]]
+            for i in range( len( seq ) + 1 ):
+                # Insertion
+                edits += [seq[:i] + b + seq[i:] for b in alphabet]
+            for edit in edits:
+                if edit not in neighbors:
+                    neighbors[edit] = d
+                    found.append( edit )
+        last = found
+    return neighbors
+
+class BarcodeIndex( object ):
+    """
+        Maps every sequence within the allowed mismatches of a barcode to that
+        barcode so a read is classified with a single dictionary lookup
+
+        Sequences closest to a single barcode belong to that barcode.
+        Sequences equally close to more than one barcode are AMBIGUOUS
+
+        >>> index = BarcodeIndex( [('b1', 'AAAA', 1), ('b2', 'AATT', 1)] )
+        >>> index.get( 'aaaa' ), index.get( 'aaat' ), index.get( 'aatt' ), index.get( 'cccc' )
+        ('b1', '<ambiguous>', 'b2', None)
+        >>> index.get( 'aaac' )
+        'b1'
+    """
+    def __init__( self, barcodes = (), indels = False ):
+        """
+            barcodes - Iterable of (value, sequence, mismatches)
+            indels - Count insertions and deletions as mismatches(edit distance)
+                instead of only substitutions(Hamming distance)
+        """
+        self.indels = indels
+        # neighbor sequence -> (distance, value)
+        self.table = {}
+        # Sorted lengths of all the neighbor sequences
+        self.lengths = []
+        for value, sequence, mismatches in barcodes:
+            self.add( value, sequence, mismatches )
+
+    def add( self, value, sequence, mismatches = 0 ):
+        """
+            Add every sequence within mismatches of sequence as value
+        """
+        mismatches = int( mismatches )
+        if mismatches < 0 or mismatches > MAX_MISMATCHES:
+            raise ValueError( "%s mismatches for %s is not between 0 and %s" % (mismatches, value, MAX_MISMATCHES) )
+        sequence = sequence.lower()
+        existing = self.table.get( sequence )
+        if existing is not None and existing[0] == 0 and existing[1] != value:
+            raise ValueError( "%s and %s have the same barcode sequence %s" % (existing[1], value, sequence) )
+        if self.indels:
+            neighbors = edit_neighbors( sequence, mismatches )
+        else:
+            neighbors = hamming_neighbors( sequence, mismatches )
+        lengths = set( self.lengths )
+        for neighbor, distance in neighbors.iteritems():
+            self._add( neighbor, distance, value )
+            lengths.add( len( neighbor ) )
+        self.lengths = sorted( lengths )
+
+    def _add( self, neighbor, distance, value ):
+        existing = self.table.get( neighbor )
+        if existing is None or distance < existing[0]:
+            self.table[neighbor] = (distance, value)
+        elif distance == existing[0] and existing[1] != value:
+            self.table[neighbor] = (distance, AMBIGUOUS)
+
+    def get( self, sequence, default = None ):
+        """
+            Value of the barcode sequence is closest to, AMBIGUOUS or default if there is none
+            sequence should already be lowercase
+        """
+        hit = self.table.get( sequence )
+        if hit is None:
+            return default
+        return hit[1]
+
+    def match_prefix( self, sequence ):
+        """
+            Find the barcode that the start of sequence is closest to
+            Every prefix length a barcode neighbor can have is looked up once
+            sequence should already be lowercase
+
+            Returns (value, prefix length) or (None, None) if nothing matched
+            value is AMBIGUOUS if more than one barcode is equally close
+
+            >>> index = BarcodeIndex( [('b1', 'ACGTAC', 1), ('b2', 'TTTTTT', 1)], indels=True )
+            >>> index.match_prefix( 'acgtacgggg' ), index.match_prefix( 'acgacgggg' ), index.match_prefix( 'gggggg' )
+            (('b1', 6), ('b1', 5), (None, None))
+        """
+        best = None
+        value = None
+        length = None
+        for l in self.lengths:
+            if l > len( sequence ):
+                continue
+            hit = self.table.get( sequence[:l] )
+            if hit is None:
+                continue
+            if best is None or hit[0] < best:
+                best, value, length = hit[0], hit[1], l
+            elif hit[0] == best and hit[1] != value:
+                value = AMBIGUOUS
+        return value, length
+
+    def __len__( self ):
+        return len( self.table )
@@ -1,16 +1,37 @@
 import re
+from collections import OrderedDict
 from wrairlib.exceptions1 import *
 
 class BlastResult:
     def __init__( self, blastfilepath ):
         self.blast_filepath = blastfilepath
+        # identifier -> [very top row, top row with a genus id]
+        # Built the first time it is needed
+        self._index = None
+
+    def _getIndex( self ):
+        """
+            Parse the table once and keep the very top row and the top row
+            that has a genus id(not -1) for every identifier in the order
+            identifiers are first seen
+        """
+        if self._index is None:
+            index = OrderedDict()
+            for row in self._parse():
+                tops = index.get( row.ident )
+                if tops is None:
+                    tops = index[row.ident] = [row, None]
+                if tops[1] is None and row.genusid != -1:
+                    tops[1] = row
+            self._index = index
+        return self._index
 
     def topResults( self ):
         """
             Return top results for each unique identifier
             Identifier is the furthest left column(ASSUMPTION!!!)
         """
-        for ident in self.getUniqueIdentifiers():
+        for ident in self._getIndex():
             tr = self.topResult( ident )
             if not tr:
                 raise ValueError( "%s has no top result" % ident )
@@ -20,84 +41,109 @@ class BlastResult:
         """
             Return a list of all the unique identifiers
         """
-        # Set returns only the unique set from a given list
-        return set( [row.ident for row in self._parse()] )
+        return set( self._getIndex() )
 
     def topResult( self, identifier ):
         """
             Return the top result for a given identifer
             Identifier is the furthest left column(ASSUMPTION!!!)
+
+            The top row that has a genus id(not -1) or the very top row
+            if none of them do
         """
-        # Hold the very top in case nothing is found we can return it instead
-        verytop = None
-        # Loop through each row in the table
-        for row in self._parse():
-            # If the identifier matches the one we are looking for
-            if row.ident == identifier:
-                # If verytop is not set set it
-                if not verytop:
-                    verytop = row
-                # If the tax id is not -1
-                if row.genusid != -1:
-                    # Return this row(It will be the top result)
-                    return row
-        return verytop
+        tops = self._getIndex().get( identifier )
+        if tops is None:
+            return None
+        verytop, classified = tops
+        return classified or verytop
 
     def _parse( self ):
         """
             Generator yielding a BlastResultRow for each line in the table
         """
         fh = open( self.blast_filepath )
-        # Finished flag in case summary info is found
-        finished = False
-        # Seen header line?
-        seenheaderline = False
-        for l in fh:
-            line = l.strip()
-
-            # Only do this for the first line
-            if not seenheaderline:
-                seenheaderline = True
-                # If no | in the first line it is a header line
-                if '|' not in l:
-                    continue
-            # Skip blank lines
-            if not line:
+        try:
+            for row in parse_rows( fh ):
+                yield row
+        finally:
+            fh.close()
+
+def parse_rows( lines ):
+    """
+        Generator yielding a BlastResultRow for each line of a blast table
+        A header line and anything after the summary(line starting with =) are skipped
+
+        lines - Any iterable of lines such as an opened file or sys.stdin
+    """
+    # Seen header line?
+    seenheaderline = False
+    for l in lines:
+        line = l.strip()
+
+        # Only do this for the first line
+        if not seenheaderline:
+            seenheaderline = True
+            # If no | in the first line it is a header line
+            if '|' not in l:
                 continue
-
-            # Skip summary lines and set finished processing
-            if line[0] == '=':
-                finished = True
-            if finished:
-                break
-
-            b = BlastResultRow( line )
-            assert b != None
-            assert b.ident
-            yield b
-        fh.close()
-
-class BlastResultRow:
-    def __init__( self, strline = None ):
-        self.ident = ""
-        self.genbankinfo = []
-        self.match = 0
-        self.other = []
-        self.species = ""
-        self.speciesid = -1
-        self.genusname = ""
-        self.genusid = -1
-
+        # Skip blank lines
+        if not line:
+            continue
+
+        # Stop at summary lines
+        if line[0] == '=':
+            break
+
+        b = BlastResultRow( line )
+        assert b.ident
+        yield b
+
+def top_hits( stream ):
+    """
+        Generator yielding the top row of each identifier as soon as the rows
+        for that identifier end which only works for blast output where all of an
+        identifier's rows are together(the way blast writes them)
+        The top row is the first one with a genus id(not -1) or the very top row if none have one
+
+        Only the top rows of the current identifier are kept so stream can be a pipe from blast
+
+        stream - Any iterable of lines such as an opened file or sys.stdin
+    """
+    ident = None
+    verytop = None
+    classified = None
+    for row in parse_rows( stream ):
+        if row.ident != ident:
+            if verytop is not None:
+                yield classified or verytop
+            ident = row.ident
+            verytop = row
+            classified = None
+        if classified is None and row.genusid != -1:
+            classified = row
+    if verytop is not None:
+        yield classified or verytop
+
+class BlastResultRow( object ):
+    """
+        A single row of a blast result table
+
+        Only the identifier and numeric columns are decoded when the row is read.
+        The species and genus name (id) columns are decoded the first time they are used
+
+        >>> row = BlastResultRow( 'contig1\\tgi|1|gb|AB1|\\t99.5\\t200\\t1\\t0\\t1\\t200\\t1\\t200\\t1e-50\\t350\\tInfluenza A virus (11320)\\tunknown (-1)' )
+        >>> row.ident, row.match, row.other[0], row.other[-1]
+        ('contig1', 99.5, 200, 350)
+        >>> row.species, row.speciesid, row.genus, row.genusid
+        ('Influenza A virus', 11320, 'unknown', -1)
+        >>> row.genbankinfo
+        ['gi', '1', 'gb', 'AB1']
+    """
+    __slots__ = ('rawline', 'ident', 'match', 'other', '_species', '_genus')
+
+    def __init__( self, strline ):
         self.rawline = strline.strip()
-
-        self._setup()
-
-        if strline:
-            self._parse( strline )
-
-    def _setup( self ):
-        pattern = '([\w\s]+)?\s+\((\S?[0-9]+)\)'
-        self.nameidp = re.compile( pattern )
+        self._parse( self.rawline )
 
     def _parse( self, line ):
         """
@@ -107,23 +153,71 @@ class BlastResultRow:
         if not len( columns ) == 14:
             raise UnknownFormatException( "Blast row:\n%s\ndoes not contain exactly 14 columns" % line )
         self.ident = columns[0]
-        self.genbankinfo = columns[1].split( '|' )[0:-1]
-        self.match = columns[2]
-        self.other = columns[3:12]
-        self.species, self.speciesid = self._parse_nameid( columns[12] )
-        self.genus, self.genusid = self._parse_nameid( columns[13] )
+        self.match = _number( columns[2] )
+        self.other = tuple( [_number( c ) for c in columns[3:12]] )
+        # Still (name, id) text until used
+        self._species = columns[12]
+        self._genus = columns[13]
 
-    def _parse_nameid( self, text ):
+    @property
+    def genbankinfo( self ):
+        return self.rawline.split( '\t', 2 )[1].split( '|' )[0:-1]
+
+    def _nameid( self, attr ):
         """
-            Given a tax/genus of the form some name (id)
-            split into ('some name', id)
+            Decode the name (id) column in attr the first time it is used
         """
-        m = self.nameidp.search( text )
-        name, id = m.groups()
-        return name, int( id )
+        value = getattr( self, attr )
+        if not isinstance( value, tuple ):
+            value = _parse_nameid( value )
+            setattr( self, attr, value )
+        return value
+
+    @property
+    def species( self ):
+        return self._nameid( '_species' )[0]
+
+    @property
+    def speciesid( self ):
+        return self._nameid( '_species' )[1]
+
+    @property
+    def genus( self ):
+        return self._nameid( '_genus' )[0]
+
+    @property
+    def genusid( self ):
+        return self._nameid( '_genus' )[1]
 
     def __str__( self ):
         return self.__unicode__()
 
     def __unicode__( self ):
-        return "%s-%s-%s-%s-%s-%s-%s-%s" % (self.ident, self.genbankinfo, self.match, self.other, self.species, self.speciesid, self.genus, self.genusid)
+        return "%s-%s-%s-%s-%s-%s-%s-%s" % (self.ident, self.genbankinfo, self.match, list( self.other ), self.species, self.speciesid, self.genus, self.genusid)
+
+# Tax/genus columns look like: some name (id)
+NAMEID_PATTERN = re.compile( '([\w\s]+)?\s+\((\S?[0-9]+)\)' )
+
+def _parse_nameid( text ):
+    """
+        Given a tax/genus of the form some name (id)
+        split into ('some name', id)
+    """
+    m = NAMEID_PATTERN.search( text )
+    name, id = m.groups()
+    return name, int( id )
+
+def _number( text ):
+    """
+        Numeric columns as int or float(anything else is left as is)
+
+        >>> _number( '200' ), _number( '1e-50' ), _number( 'N/A' )
+        (200, 1e-50, 'N/A')
+    """
+    try:
+        return int( text )
+    except ValueError:
+        try:
+            return float( text )
+        except ValueError:
+            return text
@@ -3,11 +3,342 @@ import sys
 import os
 import re
 import time
+import json
+import hashlib
+import tempfile
+import cStringIO
+import urllib
+import urllib2
+import threading
+from multiprocessing.pool import ThreadPool
+from xml.etree import cElementTree
 
 # Defaults
 Entrez.email = 'anonymous'
 default_entrez_db = 'nucleotide'
 default_xml = "EntrezFetch.xml"
+# Where the E-utilities live
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# How many records each efetch request gets
+default_batch_size = 500
+# NCBI asks for no more than 3 requests per second without an api key
+default_requests_per_second = 3
+
+# Element holding each value iter_entrez collects keyed by the name it is given
+ENTREZ_FIELDS = (
+    ('accession', 'Textseq-id_accession'),
+    ('gi', 'Seq-id_gi'),
+    ('title', 'Seqdesc_title'),
+    ('create_year', 'Date-std_year'),
+    ('create_month', 'Date-std_month'),
+    ('create_day', 'Date-std_day'),
+    ('sequence', 'IUPACna'),
+    ('locus', 'Gene-ref_locus'),
+)
+
+def iter_entrez( xml_results_file ):
+    """
+        Generator yielding information about each sequence(Seq-entry) in an entrez
+        native xml file while only keeping the current Seq-entry in memory
+        Info gathered(None if the Seq-entry doesn't have it):
+            accession
+            gi
+            title
+            create_year, create_month and create_day
+            sequence
+            locus
+
+        The first of each element inside of the Seq-entry is used
+        Seq-entry elements inside of another Seq-entry(such as the proteins
+        of a nuc-prot set) are part of the outer Seq-entry
+    """
+    # Elements that have been started but not ended
+    open_elements = []
+    # How many Seq-entry elements are open
+    entry_depth = 0
+    for event, elem in cElementTree.iterparse( xml_results_file, events=('start', 'end') ):
+        if event == 'start':
+            open_elements.append( elem )
+            if elem.tag == 'Seq-entry':
+                entry_depth += 1
+            continue
+        open_elements.pop()
+        if elem.tag != 'Seq-entry':
+            continue
+        entry_depth -= 1
+        if entry_depth:
+            continue
+        info = {}
+        for name, tag in ENTREZ_FIELDS:
+            found = elem.find( './/' + tag )
+            info[name] = found.text if found is not None else None
+        # Done with the entry so drop it from the tree
+        elem.clear()
+        if open_elements:
+            open_elements[-1].remove( elem )
+        yield info
+
+def count_entries( data ):
+    """
+        Amount of top level Seq-entry elements in the native xml of an efetch
+        Raises ValueError if data is not complete xml or is an E-utilities ERROR
+
+        >>> count_entries( '<Bioseq-set><Seq-entry><Seq-entry></Seq-entry></Seq-entry><Seq-entry/></Bioseq-set>' )
+        2
+        >>> count_entries( '<eFetchResult><ERROR>Unable to obtain query #1</ERROR></eFetchResult>' )
+        Traceback (most recent call last):
+        ...
+        ValueError: Entrez fetch failed: Unable to obtain query #1
+        >>> count_entries( '<Bioseq-set><Seq-entry><Seq-entry></Seq-entry>' )
+        Traceback (most recent call last):
+        ...
+        ValueError: Incomplete Entrez fetch: no element found: line 1, column 46
+    """
+    count = 0
+    # How many Seq-entry elements are open
+    entry_depth = 0
+    try:
+        for event, elem in cElementTree.iterparse( cStringIO.StringIO( data ), events=('start', 'end') ):
+            if elem.tag == 'ERROR' and event == 'end':
+                raise ValueError( "Entrez fetch failed: %s" % elem.text )
+            if elem.tag != 'Seq-entry':
+                continue
+            if event == 'start':
+                entry_depth += 1
+                if entry_depth == 1:
+                    count += 1
+            else:
+                entry_depth -= 1
+                if not entry_depth:
+                    elem.clear()
+    except SyntaxError as e:
+        raise ValueError( "Incomplete Entrez fetch: %s" % e )
+    return count
+
+class EutilsTransport( object ):
+    """
+        Talks to the E-utilities over http
+        base_url can point at any server that answers like NCBI(such as a local fake one for tests)
+    """
+    def __init__( self, base_url = EUTILS_URL, timeout = 300 ):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def _get( self, utility, **params ):
+        """ Returns the body of the response from a single E-utility """
+        params.setdefault( 'email', Entrez.email )
+        params.setdefault( 'tool', 'pyWrairLib' )
+        url = self.base_url + utility + '.fcgi?' + urllib.urlencode( sorted( params.items() ) )
+        fh = urllib2.urlopen( url, timeout=self.timeout )
+        try:
+            return fh.read()
+        finally:
+            fh.close()
+
+    def search( self, db, term ):
+        """
+            Run esearch with usehistory so the results can be fetched in batches
+            Returns dictionary with Count, WebEnv and QueryKey
+        """
+        root = cElementTree.fromstring( self._get( 'esearch', db=db, term=term, usehistory='y', retmax=0 ) )
+        error = root.find( 'ERROR' )
+        if error is not None:
+            raise ValueError( "Entrez search failed: %s" % error.text )
+        return {
+            'Count': int( root.findtext( 'Count' ) ),
+            'WebEnv': root.findtext( 'WebEnv' ),
+            'QueryKey': root.findtext( 'QueryKey' ),
+        }
+
+    def fetch( self, db, webenv, query_key, retstart, retmax ):
+        """ Returns the native xml of records retstart through retstart + retmax of a search """
+        return self._get( 'efetch', db=db, WebEnv=webenv, query_key=query_key, retstart=retstart,
+            retmax=retmax, rettype='native', retmode='xml' )
+
+class RateLimiter( object ):
+    """
+        Spaces out calls to wait from any amount of threads so no more than
+        requests_per_second of them return each second
+    """
+    def __init__( self, requests_per_second = default_requests_per_second ):
+        """
+            requests_per_second - None or 0 means no limit
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self.lock = threading.Lock()
+        # Time the next request is allowed
+        self.next = 0
+
+    def wait( self ):
+        """ Block until the caller is allowed to make a request """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            start = max( now, self.next )
+            self.next = start + self.interval
+        if start > now:
+            time.sleep( start - now )
+
+class EntrezCache( object ):
+    """
+        Downloads the results of an Entrez search one efetch batch at a time into cachedir
+
+        Every search gets its own directory named by a hash of the database, search term
+        and batch size and each batch is saved there as <retstart>.xml once it is complete.
+        A batch is only complete when it parses and has every record it asked for.
+        Downloads pick up after the last complete batch and searches that are already
+        cached do not touch the network at all
+
+        Up to workers batches are downloaded at the same time while every request
+        stays within requests_per_second
+    """
+    def __init__( self, cachedir, transport = None, batch_size = default_batch_size, db = default_entrez_db,
+            workers = 1, requests_per_second = default_requests_per_second ):
+        """
+            cachedir - Directory to keep downloaded batches in
+            transport - Object with search and fetch like EutilsTransport[Default: EutilsTransport()]
+            batch_size - Records per efetch
+            db - Entrez database
+            workers - How many batches to download at the same time
+            requests_per_second - Most requests to make each second(None for no limit)
+        """
+        self.cachedir = cachedir
+        self.transport = transport or EutilsTransport()
+        self.batch_size = batch_size
+        self.db = db
+        self.workers = workers
+        self.limiter = RateLimiter( requests_per_second )
+
+    def key( self, search_term ):
+        """ Name of the directory the batches for search_term are kept in """
+        return hashlib.sha1( "%s\n%s\n%s" % (self.db, self.batch_size, search_term) ).hexdigest()
+
+    def _querydir( self, search_term ):
+        querydir = os.path.join( self.cachedir, self.key( search_term ) )
+        if not os.path.isdir( querydir ):
+            os.makedirs( querydir )
+        return querydir
+
+    def _batch_path( self, querydir, retstart ):
+        return os.path.join( querydir, '%s.xml' % retstart )
+
+    def _write( self, path, data ):
+        """ Write data to path so that path only ever exists complete """
+        fd, tmppath = tempfile.mkstemp( dir=os.path.dirname( path ), suffix='.tmp' )
+        with os.fdopen( fd, 'wb' ) as fh:
+            fh.write( data )
+        os.rename( tmppath, path )
+
+    def _meta( self, querydir ):
+        """
+            Returns the saved search information for querydir or None
+        """
+        metapath = os.path.join( querydir, 'query.json' )
+        if not os.path.exists( metapath ):
+            return None
+        with open( metapath ) as fh:
+            return json.load( fh )
+
+    def _save_meta( self, querydir, search_term, count ):
+        meta = {'db': self.db, 'term': search_term, 'batch_size': self.batch_size, 'count': count}
+        self._write( os.path.join( querydir, 'query.json' ), json.dumps( meta ) )
+        return meta
+
+    def missing_batches( self, search_term ):
+        """
+            retstart of every batch that is not downloaded yet or None if the search
+            has never been run
+        """
+        querydir = self._querydir( search_term )
+        meta = self._meta( querydir )
+        if meta is None:
+            return None
+        return [retstart for retstart in range( 0, meta['count'], self.batch_size )
+            if not os.path.exists( self._batch_path( querydir, retstart ) )]
+
+    def _search( self, querydir, search_term ):
+        """
+            Search for search_term and make sure the cache still matches its results
+            Returns the search results from the transport
+        """
+        self.limiter.wait()
+        search = self.transport.search( self.db, search_term )
+        meta = self._meta( querydir )
+        if meta is not None and meta['count'] != search['Count']:
+            # Results changed since the partial download so start over
+            print "%s now has %s records instead of %s. Downloading again" % (search_term, search['Count'], meta['count'])
+            for name in os.listdir( querydir ):
+                os.unlink( os.path.join( querydir, name ) )
+            meta = None
+        if meta is None:
+            self._save_meta( querydir, search_term, search['Count'] )
+        return search
+
+    def _fetch_batch( self, querydir, search, retstart ):
+        """ Download a single batch and return its path """
+        self.limiter.wait()
+        print "Downloading records %s through %s" % (retstart, min( retstart + self.batch_size, search['Count'] ))
+        data = self.transport.fetch( self.db, search['WebEnv'], search['QueryKey'], retstart, self.batch_size )
+        # Only complete batches are saved so anything else is fetched again next time
+        expected = min( self.batch_size, search['Count'] - retstart )
+        found = count_entries( data )
+        if found != expected:
+            raise ValueError( "Entrez fetch of records %s through %s returned %s records instead of %s" % (retstart, retstart + expected, found, expected) )
+        path = self._batch_path( querydir, retstart )
+        self._write( path, data )
+        return path
+
+    def iter_batches( self, search_term ):
+        """
+            Generator yielding the path of every batch of search_term in order as soon
+            as it and every batch before it are downloaded
+        """
+        querydir = self._querydir( search_term )
+        missing = self.missing_batches( search_term )
+        if missing is None or missing:
+            search = self._search( querydir, search_term )
+            missing = set( self.missing_batches( search_term ) )
+        meta = self._meta( querydir )
+        retstarts = range( 0, meta['count'], self.batch_size )
+        if not missing:
+            for retstart in retstarts:
+                yield self._batch_path( querydir, retstart )
+            return
+
+        def fetch( retstart ):
+            if retstart not in missing:
+                return self._batch_path( querydir, retstart )
+            return self._fetch_batch( querydir, search, retstart )
+
+        if self.workers <= 1:
+            for retstart in retstarts:
+                yield fetch( retstart )
+            return
+        pool = ThreadPool( self.workers )
+        try:
+            # imap hands back results in order no matter which batch finishes first
+            for path in pool.imap( fetch, retstarts ):
+                yield path
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def batches( self, search_term ):
+        """
+            Make sure every batch of search_term is downloaded
+            Returns list of the batch files in order
+        """
+        return list( self.iter_batches( search_term ) )
+
+    def iter_entrez( self, search_term ):
+        """
+            Generator yielding iter_entrez information for every record of search_term
+            Batches are parsed as they finish downloading
+        """
+        for path in self.iter_batches( search_term ):
+            for info in iter_entrez( path ):
+                yield info
 
 class WEntrez:
     entrez_db = 'nucleotide'
@@ -20,22 +351,22 @@ class WEntrez:
             self.entrez_fetch_xml = local_xml
 
     def _search_ncbi_sequences( self, search_term, rstart = 0, retmax = 500, increment = 500 ):
-        print "Gathering id's for records for %s through %s" % (rstart,retmax)
-        gids = []
-
-        esh = Entrez.esearch( db=self.entrez_db, retstart=rstart, retmax=retmax, term=search_term )
-        gis = Entrez.read( esh )
-        esh.close()
-
-        count = int( gis['Count'] )
-
-        if rstart + retmax >= count:
-            return gis['IdList']
+        """
+            Returns the id list for search_term gathered increment ids at a time
+        """
+        ids = []
+        count = None
+        while count is None or rstart < count:
+            print "Gathering id's for records for %s through %s" % (rstart,rstart + retmax)
+            esh = Entrez.esearch( db=self.entrez_db, retstart=rstart, retmax=retmax, term=search_term )
+            gis = Entrez.read( esh )
+            esh.close()
 
-        if rstart + (2 * retmax) >= count:
-            retmax = count - (rstart + retmax)
-            
-        return gis['IdList'] + self._search_ncbi_sequences( search_term, rstart + increment, retmax )
+            count = int( gis['Count'] )
+            ids += gis['IdList']
+            rstart += increment
+            retmax = increment
+        return ids
 
     def fetch_ncbi_sequences( self, search_term ):
         """
@@ -86,6 +417,7 @@ class WEntrez:
     def parse_entrez( self, xml_results_file = None ):
         """
             Given an xml file name, read the file and return information about the sequences contained within
+            keyed by genbank id
             Info gathered:
                 accession
                 genbank id
@@ -93,46 +425,50 @@ class WEntrez:
                 create year, month and day
                 sequence
                 locus 
+
+            Use iter_entrez to go through a file without holding all of it in memory
         """
         if not xml_results_file:
             xml_results_file = self.entrez_fetch_xml
         # Will contain all the information keyed by genbank id
         info = {}
+        for i in iter_entrez( xml_results_file ):
+            info[i['gi']] = i
+        return info
 
-        fh = open( xml_results_file )
-        # Potentially the file could be too large to fit into memory depending on the query.
-        xml = fh.read()
-        fh.close()
-        
-        # Pattern to pull out all Bioseq-set_seq-set pieces
-        bssp = re.compile( '<Bioseq-set_seq-set>.*?</Bioseq-set_seq-set>', re.DOTALL )
-
-        # Pattern to extract wanted info
-        sep = re.compile( '<Seq-entry>.*?<Textseq-id_accession>(?P<accession>.*?)</Textseq-id_accession>.*?<Seq-id_gi>(?P<gi>.*?)</Seq-id_gi>.*?<Seqdesc_title>(?P<title>.*?)</Seqdesc_title>.*?<Date-std_year>(?P<create_year>.*?)</Date-std_year>.*?<Date-std_month>(?P<create_month>.*?)</Date-std_month>.*?<Date-std_day>(?P<create_day>.*?)</Date-std_day>.*?<IUPACna>(?P<sequence>.*?)</IUPACna>.*?<Gene-ref_locus>(?P<locus>.*?)</Gene-ref_locus>.*?</Seq-entry>', re.DOTALL )
-
-        # Get all matches
-        biosets = bssp.findall( xml )
-
-        # The first set is not wanted as it is blank
-        #del biosets[1]
+    def fetch_cached( self, search_term, cachedir, transport = None, batch_size = default_batch_size,
+            workers = 1, requests_per_second = default_requests_per_second ):
+        """
+            Download the results of search_term in batches into cachedir(see EntrezCache)
+            Returns the EntrezCache so the records can be read with its iter_entrez
+        """
+        cache = EntrezCache( cachedir, transport, batch_size, self.entrez_db, workers, requests_per_second )
+        cache.batches( search_term )
+        return cache
 
-        # Loop through each set and pull out the information
-        for bs in biosets:
-            m = sep.search( bs )
-            i = m.groupdict()
-            info[i['gi']] = i
+    def write_fasta( self, xmlfile = None, records = None ):
+        """
+            Write the title and sequence of every Seq-entry into entrez.fna
+            in the order they are in the xml file
 
-        return info
+            records - iter_entrez information to write instead of reading xmlfile
 
-    def write_fasta( self, xmlfile = None ):
-        info = self.parse_entrez( xmlfile )
+            Seq-entries without a title or sequence are skipped and reported on stderr
+        """
+        if records is None:
+            if not xmlfile:
+                xmlfile = self.entrez_fetch_xml
+            records = iter_entrez( xmlfile )
         fh = open( 'entrez.fna', 'w+' )
 
-        for gi, inf in info.iteritems():
+        for inf in records:
             title = inf['title']
             #title = title.split( '/' )[2]
             sequence = inf['sequence']
+            if not title or not sequence:
+                missing = 'title' if not title else 'sequence'
+                sys.stderr.write( "Skipping %s(gi %s) because it has no %s\n" % (inf['accession'], inf['gi'], missing) )
+                continue
             fh.write( ">%s\n%s\n" % (title, sequence) )
 
         fh.close()
-
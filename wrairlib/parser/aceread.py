@@ -6,24 +6,124 @@ from Bio.Sequencing import Ace as ace
 # Python Imports
 import sys
 
+# Local Imports
+from wrairlib.util import file_stamp, load_saved, save_saved
+
+def _skip_bases( lines, nbases ):
+    """ Move lines past the sequence block of a CO or RD record that has nbases padded bases """
+    while nbases > 0:
+        line = next( lines, '' )
+        if not line:
+            break
+        nbases -= len( line.rstrip() )
+
+def read_names_by_contig( acefile ):
+    """
+        Read names of every contig in acefile in a single pass
+        Only CO and RD header lines are split, their sequence blocks are skipped by
+        base count and everything else is passed over without being parsed
+
+        @param acefile - Path to ace file
+        @returns {contig name: [read names in the order they are in the ace file]}
+    """
+    contigs = {}
+    reads = None
+    with open( acefile, 'rb' ) as fh:
+        lines = iter( fh )
+        for line in lines:
+            if line.startswith( 'RD ' ):
+                name, nbases = line.split( None, 3 )[1:3]
+                reads.append( name )
+            elif line.startswith( 'CO ' ):
+                name, nbases = line.split( None, 3 )[1:3]
+                reads = contigs.setdefault( name, [] )
+            else:
+                continue
+            _skip_bases( lines, int( nbases ) )
+    return contigs
+
 class Ace:
-    def __init__( self, acefile ):
+    # Bump when the saved index layout changes
+    INDEX_VERSION = 1
+
+    def __init__( self, acefile, persist_index = False ):
+        """
+            acefile - Path to ace file
+            persist_index - Save the contig index next to acefile(<acefile>.coidx) so
+                it only has to be built once. It is rebuilt if acefile changes
+        """
         self.ace_filename = acefile
+        self.persist_index = persist_index
+        self.index_filename = acefile + '.coidx'
+        # contig name -> [(offset, length),...] of each CO record
+        # Built the first time it is needed
+        self._index = None
 
     def _get_gen( self ):
         return ace.parse( open( self.ace_filename ) )
 
+    def _stamp( self ):
+        """ What a saved index has to match to still be valid """
+        return (self.INDEX_VERSION,) + file_stamp( self.ace_filename )
+
+    def build_index( self ):
+        """
+            Scan the ace file once for the byte offset and length of every CO record
+            A CO record goes until the next CO record or the end of the file
+        """
+        index = {}
+        offset = 0
+        # (name, offset) of the CO record being read
+        last = None
+        with open( self.ace_filename, 'rb' ) as fh:
+            for line in fh:
+                if line.startswith( 'CO ' ):
+                    if last is not None:
+                        index.setdefault( last[0], [] ).append( (last[1], offset - last[1]) )
+                    last = (line.split()[1], offset)
+                offset += len( line )
+        if last is not None:
+            index.setdefault( last[0], [] ).append( (last[1], offset - last[1]) )
+        return index
+
+    def _get_index( self ):
+        if self._index is None:
+            index = None
+            if self.persist_index:
+                index = load_saved( self.index_filename, self._stamp() )
+            if index is None:
+                index = self.build_index()
+                if self.persist_index:
+                    save_saved( self.index_filename, self._stamp(), index )
+            self._index = index
+        return self._index
+
+    def contig_names( self ):
+        return self._get_index().keys()
+
+    def read_names_by_contig( self ):
+        """ {contig name: [read names]} for every contig. See read_names_by_contig """
+        return read_names_by_contig( self.ace_filename )
+
     def has_contig( self, contigname ):
-        for contig in self._get_gen():
-            if contig.name == contigname:
-                return True
-        return False
+        return contigname in self._get_index()
 
     def reads_for_contig( self, contigname ):
+        """
+            Names of the reads in contigname in the order they are in the ace file
+            Only the RD lines of the contig's CO record are looked at
+        """
         reads = []
-        for contig in self._get_gen():
-            if contig.name == contigname:
-                for read in contig.reads:
-                    reads.append( read.rd.name )
+        records = self._get_index().get( contigname, [] )
+        if not records:
+            return reads
+        with open( self.ace_filename, 'rb' ) as fh:
+            for offset, length in records:
+                fh.seek( offset )
+                while length > 0:
+                    line = fh.readline()
+                    length -= len( line )
+                    if line.startswith( 'RD ' ):
+                        reads.append( line.split()[1] )
 
         return reads
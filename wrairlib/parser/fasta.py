@@ -4,6 +4,11 @@ import re
 import cStringIO
 
 from pyWrairLib.parser.exceptions import UnknownIdentifierLineException
+from wrairlib.VIRUS import FLUGENES
+from wrairlib.util import file_stamp, load_saved, save_saved
+
+# Order gisaid segments are merged in
+GISAID_SEGMENTS = [g for g in FLUGENES if g]
 
 def merge_segments( sequence_name, sequence_dict, segments_expected = [1,2,3,4,5,6,7,8] ):
     """
@@ -41,6 +46,11 @@ def merge_segments( sequence_name, sequence_dict, segments_expected = [1,2,3,4,5
 
     return fasta_string
 
+GENBANK_IDENTIFIER = re.compile( ">(?P<name>[-./a-zA-Z0-9_\s]+)\s+(?P<num>\d+)\s+(?P<gene>\(\w+\))" )
+GISAID_IDENTIFIER = re.compile( ">(?P<name>.*)\s\|\s(?P<gisaid_id>.*)\s\|\s(?P<collection_date>.*)\s\|\s(?P<sample_provider>.*)\s\|\s(?P<sample_submitting_laboratory>.*)\s\|\s(?P<segment>.*)\s\|\s(?P<accession_number>.*)" )
+FIX_NAME_DASH = re.compile( '-' )
+FIX_NAME_SUFFIX = re.compile( '\..*' )
+
 def is_identifier_line( fasta_line ):
     """ 
         Identifier lines in fasta files begin with >
@@ -86,10 +96,8 @@ def parse_genbank_identifier( identifier ):
         >>> print parse_genbank_identifier( ">BRD40616N.1" )
         {'num': '', 'name': 'BRD40616N.1', 'gene': ''}
     """
-    ident_pattern = ">(?P<name>[-./a-zA-Z0-9_\s]+)\s+(?P<num>\d+)\s+(?P<gene>\(\w+\))"
-    cPattern = re.compile( ident_pattern )
     try:
-        m = cPattern.match( identifier )
+        m = GENBANK_IDENTIFIER.match( identifier )
         return m.groupdict()
     except AttributeError, e:
         if " " in identifier.strip():
@@ -163,21 +171,91 @@ def parse_gisaid_identifier( identifier ):
         >>> sorted( a.keys() ) == required_keys
         True
     """
-    ident_pattern = ">(?P<name>.*)\s\|\s(?P<gisaid_id>.*)\s\|\s(?P<collection_date>.*)\s\|\s(?P<sample_provider>.*)\s\|\s(?P<sample_submitting_laboratory>.*)\s\|\s(?P<segment>.*)\s\|\s(?P<accession_number>.*)"
-    cPattern = re.compile( ident_pattern )
     try:
-        m = cPattern.match( identifier )
+        m = GISAID_IDENTIFIER.match( identifier )
         return m.groupdict()
     except AttributeError, e:
         raise UnknownIdentifierLineException( identifier )
 
+def _iter_segmented_fasta( fasta_file, parse_identifier, segment_key ):
+    """
+        Generator yielding (name, segment, sequence) for every entry of a fasta file
+        whose identifiers are parsed by parse_identifier
+        Each entry is yielded as soon as the next identifier line is read so only
+        a single sequence is ever held in memory
+
+        Entries without any sequence lines are skipped
+
+        fasta_file - Path to fasta file
+        parse_identifier - parse_gisaid_identifier or parse_genbank_identifier
+        segment_key - Key of the parsed identifier that holds the segment
+    """
+    fh = open( fasta_file, 'r' )
+    try:
+        # Identifier currently being read
+        ident = None
+        # Sequence lines of ident
+        seq_lines = []
+        for line in fh:
+            if is_identifier_line( line ):
+                if seq_lines:
+                    yield ident['name'], ident[segment_key], ''.join( seq_lines )
+                # Parse the identifier line(Throws exception if there is a malformed identifier)
+                ident = parse_identifier( line )
+                seq_lines = []
+            else:
+                seq_lines.append( line.strip() )
+        if seq_lines:
+            yield ident['name'], ident[segment_key], ''.join( seq_lines )
+    finally:
+        fh.close()
+
+def iter_gisaid_fasta( fasta_file ):
+    """
+        Generator yielding (name, segment, sequence) for every entry in a gisaid fasta file
+        in the order they are in the file
+
+        +++ Unit Tests +++
+        >>> path = os.path.dirname( __file__ )
+        >>> entries = list( iter_gisaid_fasta( os.path.join( path, "example_files/gisaid_example2.txt" ) ) )
+        >>> [(name, segment) for name, segment, seq in entries][:2]
+        [('A/Hubei-Wuchang/SWL174/2010', 'NP'), ('A/Hubei-Wuchang/SWL174/2010', 'NS')]
+        >>> entries[0][2][:10]
+        'cagggtagat'
+    """
+    return _iter_segmented_fasta( fasta_file, parse_gisaid_identifier, 'segment' )
+
+def iter_genbank_fasta( fasta_file ):
+    """
+        Generator yielding (name, segment number, sequence) for every entry in a genbank fasta file
+        in the order they are in the file
+
+        +++ Unit Tests +++
+        >>> path = os.path.dirname( __file__ )
+        >>> entries = iter_genbank_fasta( os.path.join( path, "example_files/genbank_example1.txt" ) )
+        >>> name, num, seq = entries.next()
+        >>> print name, num, seq[:10]
+        A/Addis Ababa/WR2848N/2009 1 ATGGAGAGAA
+    """
+    return _iter_segmented_fasta( fasta_file, parse_genbank_identifier, 'num' )
+
+def _segmented_dict( entries ):
+    """
+        Collect (name, segment, sequence) entries into {name: {segment: sequence}}
+    """
+    fasta = {}
+    for name, segment, sequence in entries:
+        fasta.setdefault( name, {} )[segment] = sequence
+    return fasta
+
 def read_gisaid_fasta( fasta_file, strip_these="-" ):
     """ 
         Reads gisaid fasta file which contains many of the same identifiers split into many entries
+        Use iter_gisaid_fasta for files that are too large to hold in memory
             
         Return:
-            A dictionary keyed with the identifier name and the value is a list of the sequences in order
-            that they were read from the file
+            A dictionary keyed with the identifier name and the value is a dictionary
+            of each segment's sequence keyed by the segment name
 
         +++ Unit Tests +++
         # Do a single gene test
@@ -185,7 +263,7 @@ def read_gisaid_fasta( fasta_file, strip_these="-" ):
         >>> a = read_gisaid_fasta( os.path.join( path, "example_files/gisaid_example1.txt" ) )
         >>> print len( a.keys() )
         2
-        >>> print a.keys()
+        >>> print sorted( a.keys() )
         ['ide/ a-b/asdf', 'ident1']
         >>> a = read_gisaid_fasta( os.path.join( path, "example_files/gisaid_example2.txt" ) )
         >>> print len( a.keys() )
@@ -193,44 +271,12 @@ def read_gisaid_fasta( fasta_file, strip_these="-" ):
         >>> print len( a['A/Hubei-Wuchang/SWL174/2010'] )
         8
     """
-    fasta = {}
-    fasta_contents = None
-    fh = open( fasta_file, 'r' )
-    # Holds the last identifier seen
-    last_ident = ""
-
-    # Started read sequence flag
-    start_read_seq = False
-
-    for line in fh:
-        # Identifier line
-        if is_identifier_line( line ):
-            # Every time a sequence line is encountered we should reset the start_read_seq flag
-            # so we can keep track of which segment we are reading
-            start_read_seq = False
-
-            # Parse the identifier line(Throws exception if there is a malformed identifier)
-            ident = parse_gisaid_identifier( line )
-
-            # If the identifier_name has not been seen yet start a new entry
-            #  and set the last_ident
-            # We do this because of the multiple segments
-            last_ident = ident
-            if not ident['name'] in fasta:
-                fasta[last_ident['name']] = {}
-        else:
-            if not start_read_seq:
-                fasta[last_ident['name']][last_ident['segment']] = line.strip()
-                start_read_seq = True
-            else:
-                fasta[last_ident['name']][last_ident['segment']] += line.strip()
-            
-    fh.close()
-    return fasta
+    return _segmented_dict( iter_gisaid_fasta( fasta_file ) )
 
 def read_genbank_fasta( fasta_file, strip_these="-" ):
     """ 
         Reads genbank fasta file which contains many of the same identifiers split into many entries
+        Use iter_genbank_fasta for files that are too large to hold in memory
         >ident1 1 (gene1)
         AAAA
         >ident1 2 (gene2)
@@ -242,8 +288,8 @@ def read_genbank_fasta( fasta_file, strip_these="-" ):
         >ident2 2 (gene6)
         CCCC
         
-        Returns a dictionary keyed with the identifier name and the value is a list of the sequences in order
-            that they were read from the file
+        Returns a dictionary keyed with the identifier name and the value is a dictionary
+            of each segment's sequence keyed by the segment number
 
         +++ Unit Tests +++
         # Do a single gene test
@@ -259,80 +305,362 @@ def read_genbank_fasta( fasta_file, strip_these="-" ):
         >>> print len( a )
         192
     """
-    fasta = {}
-    fasta_contents = None
-    fh = open( fasta_file, 'r' )
-    # Holds the last identifier seen
-    last_ident = ""
-
-    # Started read sequence flag
-    start_read_seq = False
-
-    for line in fh:
-        # Identifier line
-        if is_identifier_line( line ):
-            # Every time a sequence line is encountered we should reset the start_read_seq flag
-            # so we can keep track of which segment we are reading
-            start_read_seq = False
-
-            # Parse the identifier line(Throws exception if there is a malformed identifier)
-            ident = parse_genbank_identifier( line )
-
-            # If the identifier_name has not been seen yet start a new entry
-            #  and set the last_ident
-            # We do this because of the multiple segments
-            last_ident = ident
-            if not ident['name'] in fasta:
-                fasta[last_ident['name']] = {}
-        else:
-            if not start_read_seq:
-                fasta[last_ident['name']][last_ident['num']] = line.strip()
-                start_read_seq = True
+    return _segmented_dict( iter_genbank_fasta( fasta_file ) )
+
+class SegmentedFastaIndex( object ):
+    """
+        Random access to the segments of a gisaid or genbank fasta file
+        The file is scanned once to record where every segment's sequence is
+        and that is saved next to it(<fasta_file>.sidx) so later instances only
+        read the index. The index is rebuilt whenever the fasta file's size or
+        modification time changes
+
+        +++ Unit Tests +++
+        >>> import tempfile, shutil
+        >>> tdir = tempfile.mkdtemp()
+        >>> path = os.path.dirname( __file__ )
+        >>> gisaid = os.path.join( path, "example_files/gisaid_example2.txt" )
+        >>> index = SegmentedFastaIndex( gisaid, 'gisaid', os.path.join( tdir, 'gisaid.sidx' ) )
+        >>> index.segments( 'A/Hubei-Wuchang/SWL174/2010' ) == read_gisaid_fasta( gisaid )['A/Hubei-Wuchang/SWL174/2010']
+        True
+        >>> SegmentedFastaIndex( gisaid, 'gisaid', os.path.join( tdir, 'gisaid.sidx' ) ).built
+        False
+        >>> genbank = os.path.join( path, "example_files/genbank_example1.txt" )
+        >>> index = SegmentedFastaIndex( genbank, 'genbank', os.path.join( tdir, 'genbank.sidx' ) )
+        >>> index.get( 'A/Addis Ababa/WR2848N/2009', '8' )[:10]
+        'ATGGACTCCA'
+        >>> index.merged( 'A/Addis Ababa/WR2848N/2009' ) == merge_segments( 'A/Addis Ababa/WR2848N/2009', read_genbank_fasta( genbank )['A/Addis Ababa/WR2848N/2009'] )
+        True
+        >>> shutil.rmtree( tdir )
+    """
+    # Bump when the saved index layout changes
+    VERSION = 1
+    # fasta format -> (identifier parser, segment key, order segments are merged in)
+    FORMATS = {
+        'gisaid': (parse_gisaid_identifier, 'segment', GISAID_SEGMENTS),
+        'genbank': (parse_genbank_identifier, 'num', range( 1, 9 )),
+    }
+
+    def __init__( self, fasta_file, fasta_format = 'gisaid', index_file = None ):
+        """
+            fasta_file - Path to gisaid or genbank fasta file
+            fasta_format - gisaid or genbank
+            index_file - Where to save the index[Default: <fasta_file>.sidx]
+        """
+        if fasta_format not in self.FORMATS:
+            raise ValueError( "Unknown fasta format %s" % fasta_format )
+        self.fasta_file = fasta_file
+        self.fasta_format = fasta_format
+        self.index_file = index_file or fasta_file + '.sidx'
+        # Set to True when the index had to be built instead of loaded
+        self.built = False
+        # name -> segment -> (offset, length) of the sequence lines
+        self.index = load_saved( self.index_file, self._stamp() )
+        if self.index is None:
+            self.index = self.build()
+            self.built = True
+            save_saved( self.index_file, self._stamp(), self.index )
+
+    def _stamp( self ):
+        """ What the saved index has to match to still be valid """
+        return (self.VERSION, self.fasta_format) + file_stamp( self.fasta_file )
+
+    def build( self ):
+        """
+            Scan the fasta file for the offset and length of every segment's sequence lines
+            Later entries for the same name and segment replace earlier ones the same way
+            read_gisaid_fasta and read_genbank_fasta do
+        """
+        parse_identifier, segment_key, order = self.FORMATS[self.fasta_format]
+        index = {}
+        fh = open( self.fasta_file, 'rb' )
+        try:
+            offset = 0
+            # (name, segment, sequence offset) of the entry being read
+            entry = None
+            has_seq = False
+            while True:
+                line = fh.readline()
+                if not line or is_identifier_line( line ):
+                    if has_seq:
+                        name, segment, start = entry
+                        index.setdefault( name, {} )[segment] = (start, offset - start)
+                    if not line:
+                        break
+                    ident = parse_identifier( line )
+                    entry = (ident['name'], ident[segment_key], offset + len( line ))
+                    has_seq = False
+                else:
+                    has_seq = True
+                offset += len( line )
+        finally:
+            fh.close()
+        return index
+
+    def __contains__( self, name ):
+        return name in self.index
+
+    def __len__( self ):
+        return len( self.index )
+
+    def names( self ):
+        return self.index.keys()
+
+    def _read( self, fh, offset, length ):
+        fh.seek( offset )
+        return ''.join( [line.strip() for line in fh.read( length ).splitlines()] )
+
+    def get( self, name, segment ):
+        """ Sequence of a single segment """
+        offset, length = self.index[name][str( segment )]
+        with open( self.fasta_file, 'rb' ) as fh:
+            return self._read( fh, offset, length )
+
+    def segments( self, name ):
+        """ Returns {segment: sequence} for name like read_gisaid_fasta/read_genbank_fasta """
+        with open( self.fasta_file, 'rb' ) as fh:
+            return dict( [(segment, self._read( fh, offset, length )) for segment, (offset, length) in self.index[name].items()] )
+
+    def merged( self, name, segments_expected = None ):
+        """
+            Returns the merge_segments fasta string of name
+            segments_expected defaults to the usual influenza segment order for the format
+        """
+        if segments_expected is None:
+            segments_expected = self.FORMATS[self.fasta_format][2]
+        return merge_segments( name, self.segments( name ), segments_expected )
+
+class FastaIndex( object ):
+    """
+        Lazy version of read_fasta_file
+        Sequences are only read from the fasta file when they are asked for and a
+        slice of a sequence only reads the lines the slice is on
+
+        The file is scanned once for the same fields a samtools .fai has and that is
+        saved next to it(<fasta_file>.fidx). The index is rebuilt whenever the fasta
+        file's size or modification time changes
+
+        +++ Unit Tests +++
+        >>> import tempfile, shutil
+        >>> tdir = tempfile.mkdtemp()
+        >>> fasta = os.path.join( tdir, 'ref.fasta' )
+        >>> with open( fasta, 'w' ) as fh:
+        ...     fh.write( '>gene-1.1 first\\nACGTA\\nCG-TA\\nCG\\n>gene2\\nAAAA\\nCC\\nGGGG\\n' )
+        >>> index = FastaIndex( fasta )
+        >>> sorted( index.keys() )
+        ['gene2', 'gene_1']
+        >>> index['gene_1'], index.get( 'gene_1', 3, 8 ), index.get( 'gene_1', 3, 8, strip=False )
+        ('ACGTACGTACG', 'TACG', 'TACG-')
+        >>> index['gene2'] == read_fasta_file( tdir, 'ref.fasta' )['gene2']
+        True
+        >>> FastaIndex( fasta ).built
+        False
+        >>> shutil.rmtree( tdir )
+    """
+    # Bump when the saved index layout changes
+    VERSION = 1
+
+    def __init__( self, fasta_file, strip_these = "-", index_file = None ):
+        """
+            fasta_file - Path to fasta file
+            strip_these - Characters removed from the sequences that are read
+            index_file - Where to save the index[Default: <fasta_file>.fidx]
+        """
+        self.fasta_file = fasta_file
+        self.strip_these = strip_these
+        self.index_file = index_file or fasta_file + '.fidx'
+        # Set to True when the index had to be built instead of loaded
+        self.built = False
+        # name -> (offset, length, linebases, linewidth, nbytes)
+        self.index = load_saved( self.index_file, self._stamp() )
+        if self.index is None:
+            self.index = self.build()
+            self.built = True
+            save_saved( self.index_file, self._stamp(), self.index )
+
+    def _stamp( self ):
+        """ What the saved index has to match to still be valid """
+        return (self.VERSION,) + file_stamp( self.fasta_file )
+
+    def build( self ):
+        """
+            Scan the fasta file for every sequence's
+                offset - Where the first sequence line starts
+                length - Amount of bases
+                linebases - Bases on every line but the last one
+                linewidth - Bytes every line but the last one takes up
+                nbytes - Bytes all the sequence lines take up
+            linebases and linewidth are 0 if the lines are not all the same width in which case
+            slices read the whole sequence
+            Names are fixed with fix_name and later sequences with the same name replace earlier ones
+        """
+        index = {}
+        # [name, offset, length, (bases, width) of the first line, (bases, width) of the last line, same widths]
+        entry = None
+        offset = 0
+        with open( self.fasta_file, 'rb' ) as fh:
+            for line in fh:
+                if line[0] == '>':
+                    if entry is not None:
+                        self._add( index, entry, offset )
+                    entry = [fix_name( line[1:] ), offset + len( line ), 0, None, None, True]
+                elif entry is not None:
+                    bases = len( line.strip() )
+                    width = (bases, len( line ))
+                    if entry[3] is None:
+                        entry[3] = width
+                    elif entry[4] != entry[3]:
+                        # Only the last line can be different
+                        entry[5] = False
+                    # Whitespace other than the line ending would be counted as bases
+                    if bases != len( line.rstrip( '\r\n' ) ):
+                        entry[5] = False
+                    entry[2] += bases
+                    entry[4] = width
+                offset += len( line )
+        if entry is not None:
+            self._add( index, entry, offset )
+        return index
+
+    def _add( self, index, entry, offset ):
+        name, start, length, first, last, same = entry
+        if first is None or not same or last[0] > first[0]:
+            first = (0, 0)
+        index[name] = (start, length, first[0], first[1], offset - start)
+
+    def __contains__( self, name ):
+        return name in self.index
+
+    def __len__( self ):
+        return len( self.index )
+
+    def __iter__( self ):
+        return iter( self.index )
+
+    def keys( self ):
+        return self.index.keys()
+
+    def __getitem__( self, name ):
+        return self.get( name )
+
+    def get( self, name, start = None, end = None, strip = True ):
+        """
+            Sequence of name or just sequence[start:end]
+            start and end are positions in the sequence as it is in the file so they count
+            characters that strip_these removes
+            strip - Remove strip_these from what is returned
+        """
+        offset, length, linebases, linewidth, nbytes = self.index[name]
+        start, end, step = slice( start, end ).indices( length )
+        if start >= end:
+            return ''
+        with open( self.fasta_file, 'rb' ) as fh:
+            if linebases:
+                first = offset + (start // linebases) * linewidth + start % linebases
+                last = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases + 1
+                fh.seek( first )
+                seq = fh.read( last - first ).translate( None, '\r\n' )
             else:
-                fasta[last_ident['name']][last_ident['num']] += line.strip()
-            
-    fh.close()
-    return fasta
+                fh.seek( offset )
+                seq = ''.join( [line.strip() for line in fh.read( nbytes ).splitlines()] )[start:end]
+        if strip:
+            seq = strip_chars( seq, self.strip_these )
+        return seq
 
-def read_fasta_file( fasta_dir, fasta_file, strip_these="-" ):
-    """ Reads a fasta file and outputs a dictionary where the key is the sequence name and the value is the sequence """
-    genes = {}
+def read_fasta_file( fasta_dir, fasta_file, strip_these="-", lazy = False ):
+    """
+        Reads a fasta file and outputs a dictionary where the key is the sequence name and the value is the sequence
+
+        lazy - Return a FastaIndex instead so sequences are only read when they are used
+    """
     fasta_file_path = os.path.join( fasta_dir, fasta_file )
-    lines = []
-    #if not os.path.isfile( fasta_file_path ):
-    #    print( "Invalid file path given(Not found) %s" % fasta_file_path )
-    #    sys.exit( -1 )
-    fh = open( fasta_file_path, 'r' )
-    name_line = True
-    last_name = ''
-    for line in fh.readlines():
-        #log( "Line being read: %s" % line, DEBUG )
-        if line[0] == '>':
-            last_name = fix_name( line[1:] )
-            #log( "Starting new sequence name: %s" % last_name, DEBUG )
-            name_line = True
-            genes[last_name] = ''
-        else:
-            #log( "Appending sequence %s to %s" % (line, last_name), DEBUG )
-            genes[last_name] += strip_chars( line.strip(), strip_these )
+    if lazy:
+        return FastaIndex( fasta_file_path, strip_these )
+    genes = {}
+    # Sequence lines of the sequence being read
+    seq_lines = None
+    with open( fasta_file_path, 'r' ) as fh:
+        for line in fh:
+            if line[0] == '>':
+                if seq_lines is not None:
+                    genes[last_name] = strip_chars( ''.join( seq_lines ), strip_these )
+                last_name = fix_name( line[1:] )
+                seq_lines = []
+            elif seq_lines is not None:
+                seq_lines.append( line.strip() )
+    if seq_lines is not None:
+        genes[last_name] = strip_chars( ''.join( seq_lines ), strip_these )
     return genes
 
 def strip_chars( sequence, strip_chars ):
-    """ Strip all occurances of strip_chars from sequence """
-    pattern = "|".join( [c for c in strip_chars] )
-    compiled_pattern = re.compile( pattern )
-    return compiled_pattern.sub( '', sequence )
+    """
+        Strip all occurances of strip_chars from sequence
+
+        >>> strip_chars( 'A-C.G--T', '-.' )
+        'ACGT'
+        >>> strip_chars( u'A-CGT', '-' )
+        u'ACGT'
+    """
+    if isinstance( sequence, unicode ):
+        return sequence.translate( dict.fromkeys( [ord( c ) for c in strip_chars] ) )
+    return sequence.translate( None, strip_chars )
 
 def fix_name( seq_name ):
     """ Remove everything after a period and change - to _ """
-    seq_name_fixed = re.sub( '-', '_', seq_name.strip() )
-    return re.sub( '\..*', '', seq_name_fixed )
+    seq_name_fixed = FIX_NAME_DASH.sub( '_', seq_name.strip() )
+    return FIX_NAME_SUFFIX.sub( '', seq_name_fixed )
 
 def _test():
     import doctest
     doctest.testmod()
 
+def _benchmark( scale = 500 ):
+    """
+        Per record cost of parsing identifiers and stripping sequence lines of the
+        example_files repeated scale times
+        Every repeat of an identifier line is given its own name so no line is parsed twice
+        The first column is how it used to be done(compiling the pattern for every call)
+    """
+    import time
+    path = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'example_files' )
+
+    def per_record( func, items ):
+        start = time.time()
+        for item in items:
+            func( item )
+        return (time.time() - start) * 1e6 / len( items )
+
+    def read_lines( filename ):
+        with open( os.path.join( path, filename ) ) as fh:
+            return fh.readlines()
+
+    def identifiers( filename ):
+        idents = [l for l in read_lines( filename ) if is_identifier_line( l )]
+        return ['>%s%s' % (i, l[1:]) for i in range( scale ) for l in idents]
+
+    def uncompiled( pattern ):
+        def parse( identifier ):
+            return re.compile( pattern ).match( identifier ).groupdict()
+        return parse
+
+    def regex_strip( sequence ):
+        return re.compile( "|".join( [c for c in "-"] ) ).sub( '', sequence )
+
+    print "%-20s %10s %10s  (usec per record)" % ('', 'before', 'compiled')
+    idents = identifiers( 'gisaid_example2.txt' )
+    print "%-20s %10.2f %10.2f" % ('gisaid identifier', per_record( uncompiled( GISAID_IDENTIFIER.pattern ), idents ),
+        per_record( parse_gisaid_identifier, idents ))
+    idents = identifiers( 'genbank_example1.txt' )
+    print "%-20s %10.2f %10.2f" % ('genbank identifier', per_record( uncompiled( GENBANK_IDENTIFIER.pattern ), idents ),
+        per_record( parse_genbank_identifier, idents ))
+    seqlines = [l.strip() for l in read_lines( 'gisaid_example2.txt' ) * scale if not is_identifier_line( l )]
+    print "%-20s %10.2f %10.2f" % ('strip_chars', per_record( regex_strip, seqlines ),
+        per_record( lambda l: strip_chars( l, "-" ), seqlines ))
+
 if __name__ == "__main__":
     # Import the path just below the current script's path
     sys.path.append( '../' )
-    _test()
+    if '--benchmark' in sys.argv:
+        _benchmark()
+    else:
+        _test()
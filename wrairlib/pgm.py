@@ -2,12 +2,151 @@
 import multiprocessing
 import logging
 import os
+import shutil
+import tempfile
 
 from Bio.SeqIO.SffIO import SffWriter
 from Bio import SeqIO
 
+import sff
+from barcode import BarcodeIndex, AMBIGUOUS, hamming_distance
+
 logger = multiprocessing.get_logger()
 
+def barcode_lookup( barcodes ):
+    """
+        Builds a hash table of barcodes and every sequence within each barcode's
+        allowed mismatches so every read only needs a single lookup instead of
+        being compared to each barcode
+
+        barcodes - List of PGMBarcode instances
+
+        Returns a list of (adapter length, BarcodeIndex of id_str's) since the
+        barcode slice of a read depends on the length of the adapter that follows it
+
+        >>> class B( object ):
+        ...   def __init__( self, id_str, sequence, adapter, mismatches = 0 ):
+        ...     self.id_str, self.sequence, self.adapter, self.mismatches = id_str, sequence, adapter, mismatches
+        >>> lookup = barcode_lookup( [B( 'b1', 'ACGT', 'GAT' ), B( 'b2', 'TTGA', 'GAT', 1 )] )
+        >>> [(alen, len( index )) for alen, index in lookup]
+        [(3, 18)]
+        >>> lookup[0][1].get( 'ttgc' )
+        'b2'
+    """
+    tables = {}
+    for barcode in barcodes:
+        index = tables.setdefault( len( barcode.adapter ), BarcodeIndex() )
+        index.add( barcode.id_str, barcode.sequence, getattr( barcode, 'mismatches', 0 ) )
+    return sorted( tables.items() )
+
+def match_barcode( lookup, seq, keylen, clip_adapter_left ):
+    """
+        Returns the id_str in lookup for the barcode of a read, AMBIGUOUS if it is
+        as close to more than one barcode or None if it doesn't match any
+        The barcode is between the key and the adapter
+
+        lookup - Output of barcode_lookup
+        seq - Untrimmed read sequence
+        keylen - Length of the flow key
+        clip_adapter_left - Python counting clip_adapter_left of the read
+    """
+    for adapterlen, table in lookup:
+        value = table.get( seq[keylen:clip_adapter_left - adapterlen].lower() )
+        if value is not None:
+            return value
+    return None
+
+class PGMDemultiplexer( object ):
+    """
+        Demultiplexes an sff file into every barcode while only reading the sff file once
+    """
+    def __init__( self, barcodes, max_num = 'All' ):
+        """
+            barcodes - List of PGMBarcode instances
+            max_num - How many reads to process. Anything that is not an integer means all reads
+        """
+        self.barcodes = barcodes
+        self.max_num = max_num
+        self.lookup = barcode_lookup( barcodes )
+        self.processed = 0
+        self.ambiguous = 0
+        self.matched = dict( [(barcode.id_str, 0) for barcode in barcodes] )
+
+    @property
+    def unmatched( self ):
+        return self.processed - self.ambiguous - sum( self.matched.values() )
+
+    def _limitReached( self ):
+        return isinstance( self.max_num, int ) and self.processed >= self.max_num
+
+    def _matchRead( self, read, keylen ):
+        """
+            Returns the id_str of the barcode the read belongs to, AMBIGUOUS or None
+            Only the bases in front of the adapter are read
+
+            read - sff.SffRecord
+            keylen - Length of the flow key
+        """
+        return match_barcode( self.lookup, read.subsequence( 0, read.clip_adapter_left ), keylen, read.clip_adapter_left )
+
+    def reads_by_barcode( self, reads_file, header = None ):
+        """
+            Generator yielding (id_str, sff.SffRecord) for every read in reads_file that
+            matches a single barcode
+
+            reads_file - Opened sff file
+            header - sff.SffHeader of reads_file if it has already been read
+        """
+        if header is None:
+            header = sff.SffHeader.read( reads_file )
+        keylen = len( header.key_sequence )
+        for read in sff.iter_raw_reads( reads_file, header ):
+            if self._limitReached():
+                break
+            self.processed += 1
+            id_str = self._matchRead( read, keylen )
+            if id_str == AMBIGUOUS:
+                self.ambiguous += 1
+            elif id_str is not None:
+                self.matched[id_str] += 1
+                yield id_str, read
+
+    def run( self, reads_file, outdir = '.' ):
+        """
+            Write every read in reads_file to <outdir>/<id_str>.sff for the barcode it matches
+            Files are only created for barcodes that have reads
+
+            Returns dictionary keyed by barcode id_str with the amount of reads written for each
+        """
+        writers = {}
+        try:
+            with open( reads_file, 'rb' ) as fh:
+                header = sff.SffHeader.read( fh )
+                for id_str, read in self.reads_by_barcode( fh, header ):
+                    if id_str not in writers:
+                        sffpath = os.path.join( outdir, id_str + '.sff' )
+                        writers[id_str] = sff.SffRawWriter( open( sffpath, 'wb' ), header )
+                    writers[id_str].write( read.data )
+        finally:
+            for writer in writers.values():
+                writer.close()
+                writer.handle.close()
+
+        self._report()
+        return self.matched
+
+    def _report( self ):
+        """
+            Record and log how many reads each barcode got as well as the
+            reads that were ambiguous or did not match any barcode
+        """
+        for barcode in self.barcodes:
+            barcode._processed = self.processed
+            barcode._matched_reads = self.matched[barcode.id_str]
+            logger.info( "%s reads of %s matched %s" % (barcode._matched_reads, self.processed, barcode.id_str) )
+        logger.info( "%s reads of %s matched more than one barcode" % (self.ambiguous, self.processed) )
+        logger.info( "%s reads of %s did not match any barcode" % (self.unmatched, self.processed) )
+
 class BarcodeConsumer( multiprocessing.Process ):
     def __init__( self, barcode_queue ):
         multiprocessing.Process.__init__( self )
@@ -38,6 +177,7 @@ class PGMBarcode( object ):
     def __init__( self, *args, **kwargs ):
         """
             args - id_str, type, sequence, floworder, index, annotation, adapter, score_mode, score_cutoff
+            optional - mismatches(Default: 0)
         """
         self.id_str = kwargs['id_str']
         self.type = kwargs['type']
@@ -48,6 +188,8 @@ class PGMBarcode( object ):
         self.adapter = kwargs['adapter']
         self.score_mode = kwargs['score_mode']
         self.score_cutoff = kwargs['score_cutoff']
+        # How many mismatches a read's barcode can have
+        self.mismatches = int( kwargs.get( 'mismatches', 0 ) )
         self.sff_file = None
         self.proc_name = None
 
@@ -60,7 +202,8 @@ class PGMBarcode( object ):
         """
             read - Bio.Seq record representing a read from sff file
         """
-        return self.sequence.lower() == self._getReadBarcode( read )
+        distance = hamming_distance( self.sequence.lower(), self._getReadBarcode( read ) )
+        return distance is not None and distance <= self.mismatches
 
     def _getReadBarcode( self, read ):
         """
@@ -97,3 +240,103 @@ class PGMBarcode( object ):
         except ValueError:
             # No reads for barcode so remove the temporary file
             os.unlink( sffpath )
+
+def _demultiplex_chunk( args ):
+    """
+        Pool worker that sorts the reads in one byte range of an sff file into
+        per barcode part files that contain only raw reads(no header)
+
+        args - (sff path, start, end, lookup of barcode id_str's, part file directory, chunk number)
+
+        Returns (reads processed, ambiguous reads, {id_str: (part file path, reads written)})
+    """
+    sffpath, start, end, lookup, partdir, chunknum = args
+    processed = 0
+    ambiguous = 0
+    parts = {}
+    try:
+        with open( sffpath, 'rb' ) as fh:
+            header = sff.SffHeader.read( fh )
+            keylen = len( header.key_sequence )
+            for read in sff.iter_raw_reads( fh, header, start, end ):
+                processed += 1
+                id_str = match_barcode( lookup, read.subsequence( 0, read.clip_adapter_left ), keylen, read.clip_adapter_left )
+                if id_str == AMBIGUOUS:
+                    ambiguous += 1
+                    continue
+                elif id_str is None:
+                    continue
+                if id_str not in parts:
+                    partpath = os.path.join( partdir, '%s.%s.part' % (id_str, chunknum) )
+                    parts[id_str] = [open( partpath, 'wb' ), 0]
+                parts[id_str][0].write( read.data )
+                parts[id_str][1] += 1
+    finally:
+        for fh, count in parts.values():
+            fh.close()
+    return processed, ambiguous, dict( [(id_str, (fh.name, count)) for id_str, (fh, count) in parts.items()] )
+
+class ShardedPGMDemultiplexer( PGMDemultiplexer ):
+    """
+        Demultiplexes an sff file by splitting it into read aligned byte ranges
+        that are each classified by a different process then merged back into
+        a single sff file per barcode
+    """
+    def __init__( self, barcodes, max_num = 'All', cpus = multiprocessing.cpu_count() ):
+        """
+            barcodes - List of PGMBarcode instances
+            max_num - How many reads to process. Anything that is not an integer means all reads
+            cpus - How many processes to use
+        """
+        super( ShardedPGMDemultiplexer, self ).__init__( barcodes, max_num )
+        self.cpus = cpus
+
+    def run( self, reads_file, outdir = '.' ):
+        """
+            Write every read in reads_file to <outdir>/<id_str>.sff for the barcode it matches
+            Files are only created for barcodes that have reads
+
+            Returns dictionary keyed by barcode id_str with the amount of reads written for each
+        """
+        max_num = self.max_num if isinstance( self.max_num, int ) else None
+        with open( reads_file, 'rb' ) as fh:
+            header = sff.SffHeader.read( fh )
+            chunks = sff.chunk_reads( fh, header, self.cpus, max_num )
+        logger.debug( "Split %s into %s chunks" % (reads_file, len( chunks )) )
+
+        partdir = tempfile.mkdtemp( dir=outdir )
+        try:
+            tasks = [(reads_file, start, end, self.lookup, partdir, i) for i, (start, end, count) in enumerate( chunks )]
+            pool = multiprocessing.Pool( self.cpus )
+            try:
+                results = pool.map( _demultiplex_chunk, tasks )
+            finally:
+                pool.close()
+                pool.join()
+            self._merge( header, results, outdir )
+        finally:
+            shutil.rmtree( partdir )
+
+        self._report()
+        return self.matched
+
+    def _merge( self, header, results, outdir ):
+        """
+            Concatenate each barcode's part files in chunk order behind a header
+            with the total read count
+        """
+        parts = {}
+        for processed, ambiguous, chunk_parts in results:
+            self.processed += processed
+            self.ambiguous += ambiguous
+            for id_str, part in chunk_parts.items():
+                parts.setdefault( id_str, [] ).append( part )
+
+        for id_str, id_parts in parts.items():
+            sffpath = os.path.join( outdir, id_str + '.sff' )
+            with open( sffpath, 'wb' ) as fh:
+                writer = sff.SffRawWriter( fh, header )
+                for partpath, count in id_parts:
+                    with open( partpath, 'rb' ) as pfh:
+                        writer.write_from( pfh, count )
+                self.matched[id_str] = writer.close()
@@ -0,0 +1,281 @@
+### Per base position quality statistics for many reads
+import os
+import os.path
+import multiprocessing
+
+import numpy as np
+from Bio import SeqIO
+
+import sff
+
+# Highest phred quality a histogram can count
+# Qualities outside of 0-MAX_QUAL are counted as the closest end of that range
+# in the histogram(min, sum and max still use the real quality)
+MAX_QUAL = 93
+
+# Starting value of every position's min and max
+# Same as base_qual.py used before there were any reads
+MIN_START = 100
+MAX_START = 0
+
+# File extensions that can be profiled and how they are read
+QUALITY_FORMATS = {
+    '.qual': 'qual',
+    '.fastq': 'fastq',
+    '.fq': 'fastq',
+    '.sff': 'sff',
+}
+
+class QualityStats( object ):
+    """
+        Keeps the min, sum, max and depth of the quality at every base position
+        in arrays that grow as longer reads are added
+        Whole reads(or batches of reads) are added at once instead of one base at a time
+
+        >>> qs = QualityStats()
+        >>> qs.add( [35, 40, 1] )
+        >>> qs.add( [35, 40, 2, 2] )
+        >>> qs.stats() == [(35,70,35.0,35,2),(40,80,40.0,40,2),(1,3,1.5,2,2),(2,2,2.0,2,1)]
+        True
+    """
+    def __init__( self, histogram = False, size = 1024 ):
+        """
+            histogram - Also count every quality at each position so quantiles can be given
+            size - How many positions to allocate to start with
+        """
+        self.length = 0
+        self.reads = 0
+        self.min = np.empty( 0, dtype=np.int32 )
+        self.sum = np.empty( 0, dtype=np.int64 )
+        self.max = np.empty( 0, dtype=np.int32 )
+        self.depth = np.empty( 0, dtype=np.int64 )
+        self.histogram = None
+        if histogram:
+            self.histogram = np.empty( (0, MAX_QUAL + 1), dtype=np.int64 )
+        self._grow( size )
+
+    def _grow( self, length ):
+        """
+            Make sure there is room for length positions
+            Capacity is doubled so adding longer and longer reads stays cheap
+        """
+        capacity = len( self.min )
+        if length <= capacity:
+            return
+        newcap = max( length, capacity * 2 )
+        extra = newcap - capacity
+        self.min = np.concatenate( (self.min, np.full( extra, MIN_START, dtype=np.int32 )) )
+        self.sum = np.concatenate( (self.sum, np.zeros( extra, dtype=np.int64 )) )
+        self.max = np.concatenate( (self.max, np.full( extra, MAX_START, dtype=np.int32 )) )
+        self.depth = np.concatenate( (self.depth, np.zeros( extra, dtype=np.int64 )) )
+        if self.histogram is not None:
+            self.histogram = np.concatenate( (self.histogram, np.zeros( (extra, MAX_QUAL + 1), dtype=np.int64 )) )
+
+    def add( self, quals ):
+        """
+            Add the qualities of a single read
+        """
+        quals = np.asarray( quals, dtype=np.int32 )
+        n = len( quals )
+        self.reads += 1
+        if n == 0:
+            return
+        self._grow( n )
+        np.minimum( self.min[:n], quals, out=self.min[:n] )
+        np.maximum( self.max[:n], quals, out=self.max[:n] )
+        self.sum[:n] += quals
+        self.depth[:n] += 1
+        if self.histogram is not None:
+            self.histogram[np.arange( n ), quals.clip( 0, MAX_QUAL )] += 1
+        self.length = max( self.length, n )
+
+    def add_many( self, reads ):
+        """
+            Add the qualities of many reads with a single update per statistic
+
+            reads - List of quality lists/arrays
+        """
+        lengths = np.array( [len( quals ) for quals in reads], dtype=np.int64 )
+        self.reads += len( lengths )
+        if not lengths.sum():
+            return
+        n = int( lengths.max() )
+        self._grow( n )
+        quals = np.concatenate( [np.asarray( q, dtype=np.int32 ) for q in reads] )
+        # Position of every quality in quals
+        starts = np.repeat( np.cumsum( lengths ) - lengths, lengths )
+        positions = np.arange( len( quals ) ) - starts
+        np.minimum.at( self.min, positions, quals )
+        np.maximum.at( self.max, positions, quals )
+        self.sum[:n] += np.bincount( positions, weights=quals, minlength=n ).astype( np.int64 )
+        self.depth[:n] += np.bincount( positions, minlength=n )
+        if self.histogram is not None:
+            counts = np.bincount( positions * (MAX_QUAL + 1) + quals.clip( 0, MAX_QUAL ), minlength=n * (MAX_QUAL + 1) )
+            self.histogram[:n] += counts.reshape( n, MAX_QUAL + 1 )
+        self.length = max( self.length, n )
+
+    def merge( self, other ):
+        """
+            Add the statistics of other into this one
+            Merging is exact so the order statistics are merged in doesn't matter
+
+            >>> a, b = QualityStats(), QualityStats()
+            >>> a.add( [35, 40, 1] )
+            >>> b.add( [35, 40, 2, 2] )
+            >>> a.merge( b ).stats() == [(35,70,35.0,35,2),(40,80,40.0,40,2),(1,3,1.5,2,2),(2,2,2.0,2,1)]
+            True
+        """
+        if (self.histogram is None) != (other.histogram is None):
+            raise ValueError( "Cannot merge statistics with and without histograms" )
+        n = other.length
+        self._grow( n )
+        np.minimum( self.min[:n], other.min[:n], out=self.min[:n] )
+        np.maximum( self.max[:n], other.max[:n], out=self.max[:n] )
+        self.sum[:n] += other.sum[:n]
+        self.depth[:n] += other.depth[:n]
+        if self.histogram is not None:
+            self.histogram[:n] += other.histogram[:n]
+        self.length = max( self.length, n )
+        self.reads += other.reads
+        return self
+
+    def average( self ):
+        """ Average quality at each position """
+        return self.sum[:self.length] * 1.0 / self.depth[:self.length]
+
+    def quantiles( self, q ):
+        """
+            The q(0-100) percentile quality at each position
+            Requires histogram to be enabled
+
+            >>> qs = QualityStats( histogram=True )
+            >>> qs.add_many( [[10, 20], [20, 20], [30], [40]] )
+            >>> qs.quantiles( 50 ).tolist()
+            [20, 20]
+            >>> qs.quantiles( 100 ).tolist()
+            [40, 20]
+        """
+        if self.histogram is None:
+            raise ValueError( "Quantiles need QualityStats( histogram=True )" )
+        cumulative = np.cumsum( self.histogram[:self.length], axis=1 )
+        # Smallest quality whose cumulative count reaches q percent of the depth
+        target = np.ceil( self.depth[:self.length] * q / 100.0 ).clip( min=1 )
+        return (cumulative < target[:, np.newaxis]).sum( axis=1 )
+
+    def stats( self ):
+        """
+            Returns [(min, sum, avg, max, depth),...] for each base position
+        """
+        n = self.length
+        return zip( self.min[:n].tolist(), self.sum[:n].tolist(), self.average().tolist(),
+            self.max[:n].tolist(), self.depth[:n].tolist() )
+
+def merge_stats( stats, histogram = False ):
+    """
+        Returns a new QualityStats of every QualityStats in stats merged together
+    """
+    merged = QualityStats( histogram )
+    for s in stats:
+        merged.merge( s )
+    return merged
+
+def read_qualities( path ):
+    """
+        Generator yielding the quality list of every read in a qual, fastq or sff file
+        The format is picked by the file extension(see QUALITY_FORMATS)
+    """
+    ext = os.path.splitext( path )[1].lower()
+    fmt = QUALITY_FORMATS.get( ext )
+    if fmt is None:
+        raise ValueError( "Don't know how to read qualities from {}".format(path) )
+    if fmt == 'sff':
+        for record in sff.iter_records( path ):
+            yield record.quality
+    else:
+        for record in SeqIO.parse( path, fmt ):
+            yield record.letter_annotations['phred_quality']
+
+def profile_file( path, histogram = False, batch_size = 1000, progress = None ):
+    """
+        Returns QualityStats of every read in path
+        Reads are added batch_size at a time
+
+        progress - Called with how many reads have been read after every full batch
+    """
+    stats = QualityStats( histogram )
+    batch = []
+    for quals in read_qualities( path ):
+        batch.append( quals )
+        if len( batch ) == batch_size:
+            stats.add_many( batch )
+            batch = []
+            if progress is not None:
+                progress( stats.reads )
+    stats.add_many( batch )
+    return stats
+
+def _profile_file( args ):
+    """ Pool worker for profile_files """
+    path, histogram = args
+    return path, profile_file( path, histogram )
+
+def profile_files( paths, cpus = 1, histogram = False ):
+    """
+        Profile many files in a pool of cpus processes
+
+        Returns dictionary keyed by path with each file's QualityStats
+    """
+    tasks = [(path, histogram) for path in paths]
+    if cpus <= 1 or len( tasks ) <= 1:
+        return dict( map( _profile_file, tasks ) )
+    pool = multiprocessing.Pool( min( cpus, len( tasks ) ) )
+    try:
+        return dict( pool.map( _profile_file, tasks ) )
+    finally:
+        pool.close()
+        pool.join()
+
+def find_quality_files( paths ):
+    """
+        Expand any directories in paths into every file under them that
+        can be profiled(such as a whole ReadsBySample tree)
+
+        Returns sorted list of file paths
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir( path ):
+            for root, dirs, filenames in os.walk( path, followlinks=True ):
+                for filename in filenames:
+                    if os.path.splitext( filename )[1].lower() in QUALITY_FORMATS:
+                        files.add( os.path.join( root, filename ) )
+        else:
+            files.add( path )
+    return sorted( files )
+
+def sample_for_file( path ):
+    """
+        Sample name of a read file which is the directory it is in
+        like ReadsBySample/<samplename>/<read file>
+
+        >>> sample_for_file( '/data/ReadsBySample/sample1/reads.sff' )
+        'sample1'
+    """
+    return os.path.basename( os.path.dirname( os.path.abspath( path ) ) )
+
+def profile_run( paths, cpus = 1, histogram = False ):
+    """
+        Profile every quality file in paths and merge them per sample and for the entire run
+
+        Returns (per file, per sample, run) where per file and per sample are
+        dictionaries of QualityStats keyed by path and sample name
+    """
+    per_file = profile_files( find_quality_files( paths ), cpus, histogram )
+    per_sample = {}
+    for path, stats in sorted( per_file.items() ):
+        sample = sample_for_file( path )
+        if sample not in per_sample:
+            per_sample[sample] = QualityStats( histogram )
+        per_sample[sample].merge( stats )
+    run = merge_stats( per_sample.values(), histogram )
+    return per_file, per_sample, run
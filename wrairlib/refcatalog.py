@@ -0,0 +1,162 @@
+"""
+    Catalog of every identifier in a directory of reference fasta files
+
+    The reference files are scanned once for where each identifier's sequence is,
+    how long it is and which gene it is. The catalog is saved in the reference
+    directory(.refcatalog) and on later use only files whose size or modification
+    time changed are scanned again
+"""
+import os
+import os.path
+import re
+from collections import namedtuple
+
+from wrairlib.VIRUS import GENES
+from wrairlib.util import list_dir, FASTA_EXTENSIONS, file_stamp, load_saved, save_saved
+from wrairlib.exceptions1 import TooManyReferenceFilesException, NoReferenceFileException
+
+# Every gene abbreviation any virus has
+KNOWN_GENES = set( [gene for genes in GENES.values() for gene in genes if gene] )
+
+# Splits identifiers into the words a gene abbreviation can be
+IDENT_WORDS = re.compile( '[^A-Za-z0-9]+' )
+
+# file - Reference file the identifier is in
+# offset - Byte offset of the first sequence line
+# length - Amount of bases in the sequence
+# gene - Gene abbreviation found in the identifier or None
+Reference = namedtuple( 'Reference', 'ident file offset length gene' )
+
+def gene_for_ident( ident ):
+    """
+        First word of an identifier that is a gene abbreviation from VIRUS.GENES
+
+        >>> gene_for_ident( 'CY081008_PB2_Boston09' ), gene_for_ident( 'Human/4_(HA)/H5N1/4/Thailand/2004' )
+        ('PB2', 'HA')
+        >>> print gene_for_ident( 'contig00001' )
+        None
+    """
+    for word in IDENT_WORDS.split( ident ):
+        if word in KNOWN_GENES:
+            return word
+    return None
+
+def scan_reference( path ):
+    """
+        Reference for every identifier line in a fasta file in the order they are in the file
+        The identifier is the first word after the >
+    """
+    refs = []
+    # [ident, offset, length] of the sequence being read
+    entry = None
+    offset = 0
+    with open( path, 'rb' ) as fh:
+        for line in fh:
+            offset += len( line )
+            if line[0] == '>':
+                if entry is not None:
+                    refs.append( Reference( entry[0], path, entry[1], entry[2], gene_for_ident( entry[0] ) ) )
+                words = line[1:].split()
+                entry = [words[0] if words else '', offset, 0]
+            elif entry is not None:
+                entry[2] += len( line.strip() )
+    if entry is not None:
+        refs.append( Reference( entry[0], path, entry[1], entry[2], gene_for_ident( entry[0] ) ) )
+    return refs
+
+class ReferenceCatalog( object ):
+    """
+        Lookup of every identifier in a reference directory
+
+        >>> catalog = ReferenceCatalog( 'Examples/Ref', persist=False )
+        >>> ref = catalog.lookup( '>CY081008_PB2_Boston09' )
+        >>> ref.file, ref.length, ref.gene
+        ('Examples/Ref/H1N1_boston.fasta', 2314, 'PB2')
+    """
+    # Bump when the saved catalog layout changes
+    VERSION = 1
+
+    def __init__( self, refdir, ext = FASTA_EXTENSIONS, catalog_file = None, persist = True ):
+        """
+            refdir - Directory of reference files
+            ext - Extensions of the reference files(see util.list_dir)
+            catalog_file - Where to save the catalog[Default: <refdir>/.refcatalog]
+            persist - Load and save the catalog instead of scanning every file each time
+        """
+        self.refdir = refdir
+        self.ext = ext
+        self.catalog_file = catalog_file or os.path.join( refdir, '.refcatalog' )
+        self.persist = persist
+        # path -> ((size, mtime), [Reference,...])
+        self.files = {}
+        if persist:
+            self.files = load_saved( self.catalog_file, self.VERSION ) or {}
+        # ident -> [Reference,...]
+        self.idents = {}
+        # Files scanned by the last refresh
+        self.scanned = []
+        self.refresh()
+
+    def refresh( self ):
+        """
+            Scan reference files that are new or changed since they were cataloged and
+            forget the ones that are gone
+            Returns the paths that were scanned
+        """
+        paths = list_dir( self.refdir, self.ext )
+        self.scanned = []
+        changed = False
+        for path in set( self.files ) - set( paths ):
+            del self.files[path]
+            changed = True
+        for path in paths:
+            stamp = file_stamp( path )
+            if path not in self.files or self.files[path][0] != stamp:
+                self.files[path] = (stamp, scan_reference( path ))
+                self.scanned.append( path )
+                changed = True
+        self.idents = {}
+        for path in sorted( self.files ):
+            for ref in self.files[path][1]:
+                self.idents.setdefault( ref.ident, [] ).append( ref )
+        if changed and self.persist:
+            save_saved( self.catalog_file, self.VERSION, self.files )
+        return self.scanned
+
+    def __contains__( self, ident ):
+        return ident.lstrip( '>' ) in self.idents
+
+    def __len__( self ):
+        return len( self.idents )
+
+    def lookup( self, ident ):
+        """
+            Reference of an identifier(with or without the >)
+            Raises the same exceptions util.find_reference_file_for does when it is not in exactly one file
+        """
+        refs = self.idents.get( ident.lstrip( '>' ), [] )
+        if len( refs ) > 1:
+            raise TooManyReferenceFilesException( ident, [r.file for r in refs] )
+        elif not refs:
+            raise NoReferenceFileException( ident, self.refdir )
+        return refs[0]
+
+    def length( self, ident ):
+        """ Sequence length of an identifier like util.get_gap_sequence_length """
+        return self.lookup( ident ).length
+
+    def idents_in( self, path ):
+        """ Identifiers of a reference file in the order they are in the file like util.get_idents_from_reference """
+        return [ref.ident for ref in self.files[path][1]]
+
+    def sequence( self, ident ):
+        """ Sequence of an identifier read straight from its reference file """
+        ref = self.lookup( ident )
+        seq = []
+        with open( ref.file, 'rb' ) as fh:
+            fh.seek( ref.offset )
+            for line in fh:
+                if line[0] == '>':
+                    break
+                seq.append( line.strip() )
+        return ''.join( seq )
@@ -0,0 +1,344 @@
+### Low level access to sff files without decoding every read into a SeqRecord
+import mmap
+import struct
+import shutil
+
+# Common header up to the flow characters and key sequence
+# magic_number, version, index_offset, index_length, number_of_reads,
+# header_length, key_length, number_of_flows_per_read, flowgram_format_code
+HEADER_FORMAT = '>I4sQIIHHHB'
+HEADER_SIZE = struct.calcsize( HEADER_FORMAT )
+MAGIC_NUMBER = 0x2E736666
+VERSION = '\x00\x00\x00\x01'
+
+# Fixed part of every read header
+# read_header_length, name_length, number_of_bases, clip_qual_left,
+# clip_qual_right, clip_adapter_left, clip_adapter_right
+READ_HEADER_FORMAT = '>HHIHHHH'
+READ_HEADER_SIZE = struct.calcsize( READ_HEADER_FORMAT )
+
+def padded( length ):
+    """
+        Sff sections are padded to a multiple of 8 bytes
+
+        >>> [padded( l ) for l in (0, 1, 8, 9, 31)]
+        [0, 8, 8, 16, 32]
+    """
+    return (length + 7) & ~7
+
+class SffHeader( object ):
+    """
+        Common header of an sff file
+    """
+    def __init__( self, number_of_reads, key_sequence, flow_chars, index_offset = 0, index_length = 0, flowgram_format_code = 1 ):
+        self.number_of_reads = number_of_reads
+        self.key_sequence = key_sequence
+        self.flow_chars = flow_chars
+        self.index_offset = index_offset
+        self.index_length = index_length
+        self.flowgram_format_code = flowgram_format_code
+
+    @property
+    def number_of_flows( self ):
+        return len( self.flow_chars )
+
+    @property
+    def header_length( self ):
+        return padded( HEADER_SIZE + len( self.flow_chars ) + len( self.key_sequence ) )
+
+    @classmethod
+    def read( self, fh ):
+        """
+            Read the header from the start of an opened sff file
+        """
+        fh.seek( 0 )
+        fields = struct.unpack( HEADER_FORMAT, fh.read( HEADER_SIZE ) )
+        magic, version, index_offset, index_length, number_of_reads, \
+            header_length, key_length, number_of_flows, format_code = fields
+        if magic != MAGIC_NUMBER:
+            raise ValueError( "%s is not an sff file" % getattr( fh, 'name', fh ) )
+        if version != VERSION:
+            raise ValueError( "Unsupported sff version %r" % version )
+        flow_chars = fh.read( number_of_flows )
+        key_sequence = fh.read( key_length )
+        header = SffHeader( number_of_reads, key_sequence, flow_chars, index_offset, index_length, format_code )
+        if header.header_length != header_length:
+            raise ValueError( "Sff header length %s does not match %s" % (header_length, header.header_length) )
+        return header
+
+    def pack( self ):
+        """
+            Return the header as it is written to a file(including padding)
+        """
+        header = struct.pack( HEADER_FORMAT, MAGIC_NUMBER, VERSION,
+            self.index_offset, self.index_length, self.number_of_reads,
+            self.header_length, len( self.key_sequence ), self.number_of_flows,
+            self.flowgram_format_code ) + self.flow_chars + self.key_sequence
+        return header + '\x00' * (self.header_length - len( header ))
+
+class SffRecord( object ):
+    """
+        View of a single read inside of a memory mapped sff file
+        Nothing is decoded until it is asked for so loops that only need a
+        few bases or the clip points don't pay for the flowgram and qualities
+
+        Clip positions use python counting like Bio.SeqIO's sff annotations
+        A record is only usable while the iter_raw_reads/iter_records loop that made it is
+        running since the memory map is closed when that loop ends
+    """
+    __slots__ = ('buf', 'offset', 'length', 'number_of_flows', 'read_header')
+    def __init__( self, buf, offset, length, number_of_flows, read_header ):
+        self.buf = buf
+        self.offset = offset
+        self.length = length
+        self.number_of_flows = number_of_flows
+        self.read_header = read_header
+
+    @property
+    def number_of_bases( self ):
+        return self.read_header[2]
+
+    @property
+    def name( self ):
+        start = self.offset + READ_HEADER_SIZE
+        return self.buf[start:start + self.read_header[1]]
+
+    @property
+    def clip_qual_left( self ):
+        return max( 0, self.read_header[3] - 1 )
+
+    @property
+    def clip_qual_right( self ):
+        return self.read_header[4]
+
+    @property
+    def clip_adapter_left( self ):
+        return max( 0, self.read_header[5] - 1 )
+
+    @property
+    def clip_adapter_right( self ):
+        return self.read_header[6]
+
+    @property
+    def clip_left( self ):
+        """ Most aggressive of the left quality and adapter clips """
+        return max( self.clip_qual_left, self.clip_adapter_left )
+
+    @property
+    def clip_right( self ):
+        """ Most aggressive of the right quality and adapter clips where 0 means no clip """
+        rights = [c for c in (self.clip_qual_right, self.clip_adapter_right) if c]
+        if rights:
+            return min( rights )
+        return self.number_of_bases
+
+    def _section( self, section ):
+        """
+            Offset in buf of a section after the read header
+            0 - flowgram, 1 - flow index, 2 - bases, 3 - qualities
+        """
+        start = self.offset + self.read_header[0]
+        if section == 0:
+            return start
+        return start + self.number_of_flows * 2 + (section - 1) * self.number_of_bases
+
+    def subsequence( self, start, end = None ):
+        """
+            Bases from start to end(python counting) without copying any other part of the read
+        """
+        if end is None or end > self.number_of_bases:
+            end = self.number_of_bases
+        base_start = self._section( 2 )
+        return self.buf[base_start + start:base_start + max( start, end )]
+
+    @property
+    def bases( self ):
+        """ Untrimmed bases as they are stored """
+        return self.subsequence( 0 )
+
+    @property
+    def seq( self ):
+        """
+            Untrimmed bases with the clipped ends in lower case the same way
+            Bio.SeqIO and the Roche tools show them
+        """
+        bases = self.bases
+        left, right = self.clip_left, self.clip_right
+        if left >= right:
+            return bases.lower()
+        return bases[:left].lower() + bases[left:right].upper() + bases[right:].lower()
+
+    @property
+    def quality( self ):
+        """ Phred quality of every base """
+        start = self._section( 3 )
+        return list( struct.unpack_from( '>%sB' % self.number_of_bases, self.buf, start ) )
+
+    @property
+    def flow_index( self ):
+        """ Flow index of every base """
+        return struct.unpack_from( '>%sB' % self.number_of_bases, self.buf, self._section( 1 ) )
+
+    @property
+    def flowgram( self ):
+        """ Flowgram value(signal * 100) of every flow """
+        return struct.unpack_from( '>%sH' % self.number_of_flows, self.buf, self._section( 0 ) )
+
+    @property
+    def data( self ):
+        """ The read as it is stored in the file so it can be copied into another sff file """
+        return self.buf[self.offset:self.offset + self.length]
+
+def _read_length( read_header, number_of_flows ):
+    """
+        Total length in bytes of a read given its unpacked fixed read header
+    """
+    read_header_length, name_length, number_of_bases = read_header[:3]
+    return read_header_length + padded( number_of_flows * 2 + number_of_bases * 3 )
+
+def chunk_reads( fh, header, numchunks, max_num = None ):
+    """
+        Split the reads of an sff file into numchunks read aligned byte ranges
+        with about the same amount of reads in each
+
+        Reads can only be found by walking from one read header to the next so this
+        is a single pass over the file. Only the fixed part of each read header is
+        unpacked straight out of a memory map and only the chunk boundaries are kept
+        fh has to be a real file since it is memory mapped
+
+        Returns list of (start, end, number of reads)
+    """
+    total = header.number_of_reads
+    if max_num is not None:
+        total = min( total, max_num )
+    if total <= 0:
+        return []
+    numchunks = max( 1, min( numchunks, total ) )
+    per_chunk, extra = divmod( total, numchunks )
+    counts = [per_chunk + (1 if i < extra else 0) for i in range( numchunks )]
+
+    index_offset = header.index_offset if header.index_length else None
+    index_length = padded( header.index_length )
+    flow_bytes = header.number_of_flows * 2
+    # read_header_length, name_length, number_of_bases
+    unpack_from = struct.Struct( READ_HEADER_FORMAT[:4] ).unpack_from
+    starts = []
+    buf = mmap.mmap( fh.fileno(), 0, access=mmap.ACCESS_READ )
+    try:
+        offset = header.header_length
+        for count in counts:
+            starts.append( offset )
+            for i in xrange( count ):
+                if offset == index_offset:
+                    offset += index_length
+                read_header_length, name_length, number_of_bases = unpack_from( buf, offset )
+                # _read_length without the function calls since this runs for every read
+                offset += read_header_length + ((flow_bytes + number_of_bases * 3 + 7) & ~7)
+    except struct.error:
+        raise ValueError( "Sff file ends before all %s reads" % total )
+    finally:
+        buf.close()
+    return zip( starts, starts[1:] + [offset], counts )
+
+def iter_raw_reads( fh, header, start = None, end = None ):
+    """
+        Generator yielding an SffRecord for every read that starts in the byte range [start, end)
+        start should be the offset of a read(see chunk_reads)
+        fh has to be a real file since it is memory mapped
+
+        The memory map is closed when the generator finishes or is closed so the records
+        can only be used while iterating. Copy what is needed(data, name, ...) to keep it
+    """
+    buf = mmap.mmap( fh.fileno(), 0, access=mmap.ACCESS_READ )
+    try:
+        if start is None:
+            start = header.header_length
+        if end is None or end > len( buf ):
+            end = len( buf )
+        number_of_flows = header.number_of_flows
+        offset = start
+        while offset + READ_HEADER_SIZE <= end:
+            if header.index_length and offset == header.index_offset:
+                offset += padded( header.index_length )
+                continue
+            read_header = struct.unpack_from( READ_HEADER_FORMAT, buf, offset )
+            length = _read_length( read_header, number_of_flows )
+            yield SffRecord( buf, offset, length, number_of_flows, read_header )
+            offset += length
+    finally:
+        buf.close()
+
+def iter_records( sffpath, max_num = None ):
+    """
+        Generator yielding an SffRecord for every read in the sff file at sffpath
+        Stops after max_num reads if it is given
+        The file and its memory map are closed when the generator finishes or is closed
+    """
+    with open( sffpath, 'rb' ) as fh:
+        header = SffHeader.read( fh )
+        for i, record in enumerate( iter_raw_reads( fh, header ) ):
+            if max_num is not None and i >= max_num:
+                break
+            yield record
+
+def write_fastq( records, handle ):
+    """
+        Write records as fastq with the same case masked sequences that
+        Bio.SeqIO writes for an sff file
+
+        Returns how many records were written
+    """
+    count = 0
+    for record in records:
+        quality = ''.join( [chr( q + 33 ) for q in record.quality] )
+        handle.write( '@%s\n%s\n+\n%s\n' % (record.name, record.seq, quality) )
+        count += 1
+    return count
+
+def set_clip_qual_left( data, clip_qual_left ):
+    """
+        Returns the on disk bytes of a read with clip_qual_left(python counting) replaced
+
+        >>> data = struct.pack( READ_HEADER_FORMAT, 16, 0, 10, 5, 0, 0, 0 )
+        >>> struct.unpack( READ_HEADER_FORMAT, set_clip_qual_left( data, 8 ) )
+        (16, 0, 10, 9, 0, 0, 0)
+    """
+    return data[:8] + struct.pack( '>H', clip_qual_left + 1 if clip_qual_left else 0 ) + data[10:]
+
+class SffRawWriter( object ):
+    """
+        Writes reads that are already in their on disk format
+        The read count in the header is filled in when the writer is closed
+        No index is written
+    """
+    def __init__( self, handle, header ):
+        self.handle = handle
+        self.header = SffHeader( 0, header.key_sequence, header.flow_chars, flowgram_format_code=header.flowgram_format_code )
+        self.count = 0
+        self.handle.write( self.header.pack() )
+
+    def write( self, data, count = 1 ):
+        """
+            Write data containing count reads
+        """
+        self.handle.write( data )
+        self.count += count
+
+    def write_from( self, fh, count ):
+        """
+            Copy an opened file of count raw reads
+        """
+        shutil.copyfileobj( fh, self.handle )
+        self.count += count
+
+    def close( self ):
+        """
+            Record the read count in the header
+            Returns how many reads were written
+        """
+        offset = self.handle.tell()
+        self.header.number_of_reads = self.count
+        self.handle.seek( 0 )
+        self.handle.write( self.header.pack() )
+        self.handle.seek( offset )
+        return self.count
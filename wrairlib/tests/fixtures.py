@@ -5,3 +5,32 @@ import glob
 PATH = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'fixtures' )
 
 RUNFILES = glob.glob( os.path.join( PATH, 'Run*' ) )
+
+# Flow information used for generated sff files
+FLOW_CHARS = 'TACG' * 25
+KEY_SEQUENCE = 'TCAG'
+
+def sff_record( name, seq, clip_adapter_left = 0 ):
+    ''' Create a SeqRecord with all the annotations SffWriter needs '''
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    record = SeqRecord( Seq( seq ), id=name, name=name, description='' )
+    record.letter_annotations['phred_quality'] = [30] * len( seq )
+    record.annotations.update(
+        flow_key=KEY_SEQUENCE,
+        flow_chars=FLOW_CHARS,
+        flow_values=[100] * len( FLOW_CHARS ),
+        flow_index=[1] * len( seq ),
+        clip_qual_left=0,
+        clip_qual_right=0,
+        clip_adapter_left=clip_adapter_left,
+        clip_adapter_right=0
+    )
+    return record
+
+def make_sff( path, records ):
+    ''' Write records to an sff file at path '''
+    from Bio.SeqIO.SffIO import SffWriter
+    with open( path, 'wb' ) as fh:
+        SffWriter( fh ).write_file( records )
+    return path
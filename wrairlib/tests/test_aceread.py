@@ -0,0 +1,92 @@
+import os
+import os.path
+import tempfile
+import shutil
+
+from nose.tools import eq_, ok_
+
+from ..parser import aceread
+
+def contig( name, reads ):
+    ''' CO record with a RD record for each read name '''
+    seq = 'ACGTACGTAC'
+    lines = ['CO %s %s %s 1 U' % (name, len( seq ), len( reads )), seq, '', 'BQ', ' '.join( ['30'] * len( seq ) ), '']
+    for read in reads:
+        lines.append( 'AF %s U 1' % read )
+    lines.append( 'BS 1 %s %s' % (len( seq ), reads[0]) )
+    lines.append( '' )
+    for read in reads:
+        # Read sequence that looks like a record line to make sure it is skipped
+        lines += ['RD %s %s 0 0' % (read, len( seq )), seq, 'RDACGTAC', '',
+            'QA 1 %s 1 %s' % (len( seq ), len( seq )),
+            'DS CHROMAT_FILE: %s PHD_FILE: %s.phd.1 TIME: Thu Jan  1 00:00:00 2010' % (read, read), '']
+    return '\n'.join( lines ) + '\n'
+
+class TestAce( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join( self.tempdir, '454Contigs.ace' )
+        self.contigs = [
+            ('contig00001', ['read1', 'read2', 'read3']),
+            ('contig00002', ['read4']),
+            ('contig00003', ['read5', 'read6']),
+        ]
+        self.write( self.contigs )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def write( self, contigs ):
+        with open( self.path, 'w' ) as fh:
+            fh.write( 'AS %s %s\n\n' % (len( contigs ), sum( [len( r ) for c, r in contigs] )) )
+            for name, reads in contigs:
+                fh.write( contig( name, reads ) )
+
+    def test_same_as_biopython( self ):
+        ''' Reads for every contig are the same as the full parse gives '''
+        a = aceread.Ace( self.path )
+        for c in a._get_gen():
+            eq_( [r.rd.name for r in c.reads], a.reads_for_contig( c.name ) )
+
+    def test_has_contig( self ):
+        a = aceread.Ace( self.path )
+        ok_( a.has_contig( 'contig00002' ) )
+        ok_( not a.has_contig( 'contig00004' ) )
+        eq_( [], a.reads_for_contig( 'contig00004' ) )
+        eq_( ['contig00001', 'contig00002', 'contig00003'], sorted( a.contig_names() ) )
+
+    def test_not_persisted( self ):
+        aceread.Ace( self.path ).reads_for_contig( 'contig00001' )
+        ok_( not os.path.exists( self.path + '.coidx' ) )
+
+    def test_persist_index( self ):
+        ''' Saved index is used instead of scanning the file again '''
+        aceread.Ace( self.path, True ).reads_for_contig( 'contig00001' )
+        ok_( os.path.exists( self.path + '.coidx' ) )
+        a = aceread.Ace( self.path, True )
+        a.build_index = None
+        eq_( ['read4'], a.reads_for_contig( 'contig00002' ) )
+
+    def test_rebuild_changed( self ):
+        ''' Saved index is thrown away when the ace file changes '''
+        aceread.Ace( self.path, True ).has_contig( 'contig00001' )
+        self.write( [('contig00004', ['read7', 'read8'])] + self.contigs )
+        # Make sure mtime changes even on coarse filesystems
+        st = os.stat( self.path )
+        os.utime( self.path, (st.st_atime, st.st_mtime + 10) )
+        a = aceread.Ace( self.path, True )
+        eq_( ['read7', 'read8'], a.reads_for_contig( 'contig00004' ) )
+        eq_( ['read4'], a.reads_for_contig( 'contig00002' ) )
+
+    def test_read_names_by_contig( self ):
+        ''' Single pass scan gives the same reads as the full parse '''
+        expected = dict( [(c.name, [r.rd.name for r in c.reads]) for c in aceread.Ace( self.path )._get_gen()] )
+        eq_( expected, aceread.read_names_by_contig( self.path ) )
+        eq_( expected, aceread.Ace( self.path ).read_names_by_contig() )
+
+    def test_skips_sequence_lines( self ):
+        ''' Sequence lines that look like records are not mistaken for them '''
+        with open( self.path, 'w' ) as fh:
+            fh.write( 'AS 1 1\n\nCO contig1 12 1 1 U\nACGTAC\nRD ACG\n\nBQ\n30\n\nAF read1 U 1\n\n' )
+            fh.write( 'RD read1 12 0 0\nACGTAC\nCO TAC\n\nQA 1 12 1 12\n' )
+        eq_( {'contig1': ['read1']}, aceread.read_names_by_contig( self.path ) )
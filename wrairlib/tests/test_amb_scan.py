@@ -0,0 +1,105 @@
+import os
+import os.path
+import imp
+import tempfile
+import shutil
+
+from nose.tools import eq_
+from nose.plugins.skip import SkipTest
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+BIN = os.path.join( os.path.dirname( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) ), 'bin' )
+
+# (reference, read name, position, sequence) sorted the way an indexed bam has to be
+READS = [
+    (0, 'read1', 0, 'ACGTNNACGT'),
+    (0, 'read2', 4, 'NACGTRYACG'),
+    (1, 'read1', 2, 'ANNNACGTAC'),
+    (1, 'read3', 20, 'NNNNNNNNNN'),
+]
+
+# (reference, read name, position, sequence, cigar) of reads with clips and indels on NA
+CIGAR_READS = [
+    (2, 'tailsoft', 2, 'ACGTNNNNNN', [(0, 4), (4, 6)]),
+    (2, 'soft', 10, 'NNNNACGTAC', [(4, 4), (0, 6)]),
+    (2, 'ins', 10, 'ACNNNGTRCG', [(0, 2), (1, 3), (0, 5)]),
+    (2, 'del', 10, 'ACGTNRACGT', [(0, 4), (2, 5), (0, 6)]),
+]
+
+def aligned_count( reads, start, end ):
+    ''' Ambiguous bases at aligned reference positions start < i < end found by walking each cigar '''
+    counts = {}
+    for tid, name, pos, seq, cigar in reads:
+        i = 0
+        for op, length in cigar:
+            for j in range( length ):
+                # Match consumes both, insertion and soft clip only the read, deletion only the reference
+                if op == 0 and start < pos < end and seq[i].lower() not in 'atgc':
+                    counts[name] = counts.get( name, 0 ) + 1
+                if op in (0, 1, 4):
+                    i += 1
+                if op in (0, 2):
+                    pos += 1
+    return counts
+
+def old_count( reads, start, end ):
+    ''' Per base loop amb_scan.py used to do over bam.fetch() of every reference '''
+    counts = {}
+    for tid, name, pos, seq in reads:
+        for i, base in enumerate( seq, pos ):
+            if i in range( start + 1, end ) and base.lower() not in 'atgc':
+                counts[name] = counts.get( name, 0 ) + 1
+    return counts
+
+class TestAmbScan( object ):
+    def setUp( self ):
+        if pysam is None:
+            raise SkipTest( 'pysam is not installed' )
+        self.amb_scan = imp.load_source( 'amb_scan', os.path.join( BIN, 'amb_scan.py' ) )
+        self.tempdir = tempfile.mkdtemp()
+        self.bampath = os.path.join( self.tempdir, 'two_refs.bam' )
+        header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+            'SQ': [{'SN': 'PB2', 'LN': 100}, {'SN': 'HA', 'LN': 100}, {'SN': 'NA', 'LN': 100}]}
+        segment = getattr( pysam, 'AlignedSegment', None ) or pysam.AlignedRead
+        out = pysam.Samfile( self.bampath, 'wb', header=header )
+        for tid, name, pos, seq, cigar in [r + ([(0, len( r[3] ))],) for r in READS] + CIGAR_READS:
+            read = segment()
+            read.qname = name
+            read.seq = seq
+            read.flag = 0
+            read.tid = tid
+            read.pos = pos
+            read.mapq = 60
+            read.cigar = cigar
+            read.qual = 'I' * len( seq )
+            out.write( read )
+        out.close()
+        pysam.index( self.bampath )
+        self.bam = pysam.Samfile( self.bampath )
+
+    def tearDown( self ):
+        self.bam.close()
+        shutil.rmtree( self.tempdir )
+
+    def test_every_reference( self ):
+        ''' No reference scans every reference like bam.fetch() did '''
+        for start, end in ((0, 30), (3, 8), (5, 25)):
+            expected = old_count( READS, start, end )
+            for name, count in aligned_count( CIGAR_READS, start, end ).items():
+                expected[name] = expected.get( name, 0 ) + count
+            eq_( expected, self.amb_scan.region_ambiguities( self.bam, None, start, end ) )
+
+    def test_single_reference( self ):
+        eq_( old_count( READS[2:], 0, 30 ), self.amb_scan.region_ambiguities( self.bam, 'HA', 0, 30 ) )
+        eq_( old_count( READS[:2], 0, 30 ), self.amb_scan.count_ambiguities( self.bam, 'PB2', 0, 30 ) )
+
+    def test_clips_and_indels( self ):
+        ''' Bases are counted at the reference position they are aligned to '''
+        for start, end in ((0, 30), (3, 8), (9, 16), (13, 22), (15, 40)):
+            eq_( aligned_count( CIGAR_READS, start, end ), self.amb_scan.count_ambiguities( self.bam, 'NA', start, end ) )
+        # Soft clipped and inserted N's are not on the reference and the deletion moves NR to 19 and 20
+        eq_( {'ins': 1, 'del': 2}, self.amb_scan.count_ambiguities( self.bam, 'NA', 0, 30 ) )
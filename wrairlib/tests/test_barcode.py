@@ -0,0 +1,48 @@
+from nose.tools import eq_, ok_, raises
+
+from .. import barcode
+from ..barcode import BarcodeIndex, AMBIGUOUS
+
+class TestHammingNeighbors( object ):
+    def test_distances( self ):
+        ''' Every neighbor is really that distance away '''
+        for n, d in barcode.hamming_neighbors( 'acgtac', 2 ).items():
+            eq_( d, barcode.hamming_distance( 'acgtac', n ) )
+
+    def test_size( self ):
+        ''' 1 + 4L + 16 * L choose 2 neighbors for the acgtn alphabet '''
+        eq_( 1 + 4 * 10 + 16 * 45, len( barcode.hamming_neighbors( 'acgtacgtac', 2 ) ) )
+
+class TestBarcodeIndex( object ):
+    def test_exact_wins( self ):
+        ''' Exact match beats being within mismatches of another barcode '''
+        index = BarcodeIndex( [('b1', 'AAAA', 1), ('b2', 'AAAT', 1)] )
+        eq_( 'b1', index.get( 'aaaa' ) )
+        eq_( 'b2', index.get( 'aaat' ) )
+        eq_( AMBIGUOUS, index.get( 'aaac' ) )
+
+    def test_closest_wins( self ):
+        ''' Closer barcode wins over one that is further away '''
+        index = BarcodeIndex( [('b1', 'AAAAAA', 2), ('b2', 'AAATTT', 2)] )
+        eq_( 'b1', index.get( 'aaaata' ) )
+        eq_( 'b2', index.get( 'aaatta' ) )
+
+    def test_per_barcode_mismatches( self ):
+        index = BarcodeIndex( [('b1', 'AAAA', 0), ('b2', 'CCCC', 1)] )
+        eq_( None, index.get( 'aaat' ) )
+        eq_( 'b2', index.get( 'ccct' ) )
+        eq_( 'b2', index.get( 'cccn' ) )
+
+    def test_lengths( self ):
+        ''' Different length sequences never match '''
+        index = BarcodeIndex( [('b1', 'AAAA', 2)] )
+        eq_( None, index.get( 'aaa' ) )
+        eq_( None, index.get( 'aaaaa' ) )
+
+    @raises( ValueError )
+    def test_duplicate( self ):
+        BarcodeIndex( [('b1', 'AAAA', 0), ('b2', 'aaaa', 0)] )
+
+    @raises( ValueError )
+    def test_too_many_mismatches( self ):
+        BarcodeIndex( [('b1', 'AAAA', barcode.MAX_MISMATCHES + 1)] )
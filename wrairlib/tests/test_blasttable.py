@@ -0,0 +1,98 @@
+import os
+import os.path
+import tempfile
+import shutil
+
+from nose.tools import eq_, ok_
+
+from ..blastresult import blasttable
+
+HEADER = 'query\tsubject\tpident\tlength\tmismatch\tgapopen\tqstart\tqend\tsstart\tsend\tevalue\tbitscore\tspecies\tgenus'
+
+def blast_row( ident, gi, genusid ):
+    ''' Tab separated row of a blast table with 14 columns '''
+    genus = 'Influenzavirus A' if genusid != -1 else 'unknown'
+    return '\t'.join( [ident, 'gi|%s|gb|AB%s|' % (gi, gi), '99.5', '200', '1', '0', '1', '200', '1', '200', '1e-50', '350',
+        'Influenza A virus (11320)', '%s (%s)' % (genus, genusid)] )
+
+class TestBlastResult( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join( self.tempdir, 'blast.tsv' )
+        rows = [
+            blast_row( 'contig1', 1, -1 ),
+            blast_row( 'contig1', 2, 197911 ),
+            blast_row( 'contig1', 3, 197911 ),
+            blast_row( 'contig2', 4, -1 ),
+            blast_row( 'contig3', 5, 197912 ),
+        ]
+        with open( self.path, 'w' ) as fh:
+            fh.write( HEADER + '\n' + '\n'.join( rows ) + '\n' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def test_top_results( self ):
+        ''' Top classified row for each identifier or the very top row '''
+        b = blasttable.BlastResult( self.path )
+        result = [(r.ident, r.genbankinfo[1]) for r in b.topResults()]
+        eq_( [('contig1', '2'), ('contig2', '4'), ('contig3', '5')], result )
+
+    def test_top_result( self ):
+        b = blasttable.BlastResult( self.path )
+        eq_( '2', b.topResult( 'contig1' ).genbankinfo[1] )
+        ok_( b.topResult( 'missing' ) is None )
+
+    def test_unique_identifiers( self ):
+        b = blasttable.BlastResult( self.path )
+        eq_( set( ['contig1', 'contig2', 'contig3'] ), b.getUniqueIdentifiers() )
+
+    def test_parses_once( self ):
+        ''' Table is only read once for every lookup '''
+        b = blasttable.BlastResult( self.path )
+        list( b.topResults() )
+        os.unlink( self.path )
+        eq_( '5', b.topResult( 'contig3' ).genbankinfo[1] )
+
+class TestBlastResultRow( object ):
+    def test_columns( self ):
+        line = blast_row( 'contig1', 7, 197911 )
+        row = blasttable.BlastResultRow( line )
+        eq_( line, row.rawline )
+        eq_( 99.5, row.match )
+        eq_( (200, 1, 0, 1, 200, 1, 200, 1e-50, 350), row.other )
+        eq_( ('Influenzavirus A', 197911), (row.genus, row.genusid) )
+        ok_( not hasattr( row, '__dict__' ) )
+
+    def test_badrow( self ):
+        try:
+            blasttable.BlastResultRow( 'contig1\tgi|1|' )
+            assert False, 'Row without 14 columns did not raise'
+        except blasttable.UnknownFormatException:
+            pass
+
+class TestTopHits( object ):
+    def test_same_as_blastresult( self ):
+        ''' Streaming gives the same top rows as BlastResult '''
+        rows = [
+            blast_row( 'contig1', 1, -1 ),
+            blast_row( 'contig1', 2, 197911 ),
+            blast_row( 'contig2', 3, -1 ),
+            blast_row( 'contig2', 4, -1 ),
+            blast_row( 'contig3', 5, 197912 ),
+        ]
+        lines = iter( [HEADER + '\n'] + [r + '\n' for r in rows] + ['\n', '====summary\n', blast_row( 'contig4', 6, 1 )] )
+        result = [r.genbankinfo[1] for r in blasttable.top_hits( lines )]
+        eq_( ['2', '3', '5'], result )
+
+    def test_yields_when_block_ends( self ):
+        ''' Top hit is given before the rest of the stream is read '''
+        def stream():
+            yield blast_row( 'contig1', 1, 197911 ) + '\n'
+            yield blast_row( 'contig2', 2, 197911 ) + '\n'
+            raise AssertionError( 'Read past the second block' )
+        hits = blasttable.top_hits( stream() )
+        eq_( 'contig1', hits.next().ident )
+
+    def test_empty( self ):
+        eq_( [], list( blasttable.top_hits( iter( [] ) ) ) )
@@ -0,0 +1,277 @@
+import os
+import os.path
+import tempfile
+import shutil
+import threading
+import time
+import urlparse
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+from nose.tools import eq_, ok_
+
+from .. import entrez
+
+def seq_entry( accession, gi, title, sequence, locus ):
+    ''' A nuc-prot Seq-entry the way efetch native xml has them '''
+    return '''
+    <Seq-entry>
+      <Seq-entry_set>
+        <Bioseq-set>
+          <Bioseq-set_seq-set>
+            <Seq-entry>
+              <Seq-entry_seq>
+                <Bioseq>
+                  <Bioseq_id>
+                    <Seq-id><Seq-id_genbank><Textseq-id><Textseq-id_accession>%s</Textseq-id_accession></Textseq-id></Seq-id_genbank></Seq-id>
+                    <Seq-id><Seq-id_gi>%s</Seq-id_gi></Seq-id>
+                  </Bioseq_id>
+                  <Bioseq_descr><Seq-descr>
+                    <Seqdesc><Seqdesc_title>%s</Seqdesc_title></Seqdesc>
+                    <Seqdesc><Seqdesc_create-date><Date><Date_std><Date-std>
+                      <Date-std_year>2010</Date-std_year><Date-std_month>4</Date-std_month><Date-std_day>11</Date-std_day>
+                    </Date-std></Date_std></Date></Seqdesc_create-date></Seqdesc>
+                  </Seq-descr></Bioseq_descr>
+                  <Bioseq_inst><Seq-inst><Seq-inst_seq-data><Seq-data><Seq-data_iupacna><IUPACna>%s</IUPACna></Seq-data_iupacna></Seq-data></Seq-inst_seq-data></Seq-inst></Bioseq_inst>
+                </Bioseq>
+              </Seq-entry_seq>
+            </Seq-entry>
+            <Seq-entry>
+              <Seq-entry_seq><Bioseq><Bioseq_id><Seq-id><Seq-id_gi>999</Seq-id_gi></Seq-id></Bioseq_id></Bioseq></Seq-entry_seq>
+            </Seq-entry>
+          </Bioseq-set_seq-set>
+          <Bioseq-set_annot><Seq-annot><Seq-feat><Gene-ref><Gene-ref_locus>%s</Gene-ref_locus></Gene-ref></Seq-feat></Seq-annot></Bioseq-set_annot>
+        </Bioseq-set>
+      </Seq-entry_set>
+    </Seq-entry>''' % (accession, gi, title, sequence, locus)
+
+class TestIterEntrez( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir( self.tempdir )
+        self.xml = os.path.join( self.tempdir, 'EntrezFetch.xml' )
+        with open( self.xml, 'w' ) as fh:
+            fh.write( '<?xml version="1.0"?>\n<Bioseq-set><Bioseq-set_seq-set>' )
+            fh.write( seq_entry( 'CY1', '101', 'A/one/1/2010 segment 4', 'ACGT', 'HA' ) )
+            fh.write( seq_entry( 'CY2', '102', 'A/two/2/2010 segment 6', 'TTGA', 'NA' ) )
+            fh.write( '</Bioseq-set_seq-set></Bioseq-set>\n' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def test_iter_entrez( self ):
+        ''' Nested protein Seq-entry is part of the outer one '''
+        result = list( entrez.iter_entrez( self.xml ) )
+        eq_( 2, len( result ) )
+        eq_( {'accession': 'CY1', 'gi': '101', 'title': 'A/one/1/2010 segment 4', 'create_year': '2010',
+            'create_month': '4', 'create_day': '11', 'sequence': 'ACGT', 'locus': 'HA'}, result[0] )
+        eq_( 'CY2', result[1]['accession'] )
+
+    def test_parse_entrez( self ):
+        info = entrez.WEntrez( self.xml ).parse_entrez()
+        eq_( ['101', '102'], sorted( info.keys() ) )
+
+    def test_write_fasta( self ):
+        entrez.WEntrez( self.xml ).write_fasta()
+        with open( 'entrez.fna' ) as fh:
+            eq_( '>A/one/1/2010 segment 4\nACGT\n>A/two/2/2010 segment 6\nTTGA\n', fh.read() )
+
+    def test_write_fasta_incomplete( self ):
+        ''' Seq-entries missing a title or sequence are skipped instead of written as None '''
+        records = list( entrez.iter_entrez( self.xml ) )
+        records[0]['title'] = None
+        records.append( dict( records[1], accession='CY3', sequence=None ) )
+        entrez.WEntrez( self.xml ).write_fasta( records=records )
+        with open( 'entrez.fna' ) as fh:
+            eq_( '>A/two/2/2010 segment 6\nTTGA\n', fh.read() )
+
+class FakeEntrezHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    ''' Answers esearch and efetch for the records of the server it belongs to '''
+    def do_GET( self ):
+        url = urlparse.urlparse( self.path )
+        params = dict( urlparse.parse_qsl( url.query ) )
+        server = self.server
+        server.requests.append( (url.path, params) )
+        if url.path.endswith( 'esearch.fcgi' ):
+            body = '<eSearchResult><Count>%s</Count><QueryKey>1</QueryKey><WebEnv>WEBENV</WebEnv></eSearchResult>' % len( server.records )
+        elif url.path.endswith( 'efetch.fcgi' ):
+            retstart = int( params['retstart'] )
+            if retstart in server.fail_at:
+                server.fail_at.remove( retstart )
+                self.send_error( 500 )
+                return
+            time.sleep( server.delay )
+            records = server.records[retstart:retstart + int( params['retmax'] )]
+            body = '<Bioseq-set><Bioseq-set_seq-set>%s</Bioseq-set_seq-set></Bioseq-set>' % ''.join( [seq_entry( *r ) for r in records] )
+            if retstart in server.error_at:
+                server.error_at.remove( retstart )
+                body = '<eFetchResult><ERROR>Unable to obtain query #1</ERROR></eFetchResult>'
+            elif retstart in server.truncate_at:
+                server.truncate_at.remove( retstart )
+                body = body[:len( body ) / 2]
+            elif retstart in server.short_at:
+                server.short_at.remove( retstart )
+                body = '<Bioseq-set><Bioseq-set_seq-set>%s</Bioseq-set_seq-set></Bioseq-set>' % ''.join( [seq_entry( *r ) for r in records[:-1]] )
+        else:
+            self.send_error( 404 )
+            return
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'text/xml' )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        pass
+
+class ThreadedHTTPServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    daemon_threads = True
+
+class FakeEntrez( object ):
+    ''' Local http server that acts like the E-utilities '''
+    def __init__( self, numrecords, delay = 0 ):
+        '''
+            numrecords - How many records the search finds
+            delay - Seconds each efetch takes
+        '''
+        self.server = ThreadedHTTPServer( ('127.0.0.1', 0), FakeEntrezHandler )
+        self.server.delay = delay
+        self.server.records = [('CY%s' % i, str( i ), 'A/strain/%s/2010' % i, 'ACGT', 'HA') for i in range( numrecords )]
+        self.server.requests = []
+        # efetch retstart's that fail once
+        self.server.fail_at = []
+        # efetch retstart's that answer once with 200 and an ERROR, half the body or one record short
+        self.server.error_at = []
+        self.server.truncate_at = []
+        self.server.short_at = []
+        self.thread = threading.Thread( target=self.server.serve_forever )
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+
+    @property
+    def requests( self ):
+        return self.server.requests
+
+    def efetches( self ):
+        return sorted( [int( p['retstart'] ) for path, p in self.requests if path.endswith( 'efetch.fcgi' )] )
+
+    def stop( self ):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestEntrezCache( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.fake = FakeEntrez( 23 )
+        self.transport = entrez.EutilsTransport( self.fake.url )
+
+    def tearDown( self ):
+        self.fake.stop()
+        shutil.rmtree( self.tempdir )
+
+    def cache( self, **kwargs ):
+        kwargs.setdefault( 'requests_per_second', None )
+        return entrez.EntrezCache( self.tempdir, self.transport, batch_size=5, **kwargs )
+
+    def test_downloads_in_batches( self ):
+        result = [i['accession'] for i in self.cache().iter_entrez( 'flu' )]
+        eq_( ['CY%s' % i for i in range( 23 )], result )
+        eq_( [0, 5, 10, 15, 20], self.fake.efetches() )
+
+    def test_repeat_from_disk( self ):
+        ''' Second time does not make any requests '''
+        self.cache().batches( 'flu' )
+        del self.fake.requests[:]
+        eq_( 5, len( self.cache().batches( 'flu' ) ) )
+        eq_( [], self.fake.requests )
+
+    def test_different_queries( self ):
+        cache = self.cache()
+        ok_( cache.key( 'flu' ) != cache.key( 'dengue' ) )
+
+    def test_resume( self ):
+        ''' Only batches that did not finish are downloaded again '''
+        self.fake.server.fail_at.append( 15 )
+        try:
+            self.cache().batches( 'flu' )
+            assert False, 'Failed batch did not raise'
+        except urllib2.HTTPError:
+            pass
+        ok_( 15 in self.cache().missing_batches( 'flu' ) )
+        missing = self.cache().missing_batches( 'flu' )
+        del self.fake.requests[:]
+        eq_( 23, len( list( self.cache().iter_entrez( 'flu' ) ) ) )
+        eq_( missing, self.fake.efetches() )
+        ok_( not [n for n in os.listdir( os.path.dirname( self.cache().batches( 'flu' )[0] ) ) if n.endswith( '.tmp' )] )
+
+    def check_bad_batch( self, bad_at ):
+        ''' A 200 response that is not the whole batch is not cached and is fetched again '''
+        bad_at.append( 10 )
+        try:
+            self.cache().batches( 'flu' )
+            assert False, 'Bad batch did not raise'
+        except ValueError:
+            pass
+        ok_( 10 in self.cache().missing_batches( 'flu' ) )
+        eq_( ['CY%s' % i for i in range( 23 )], [i['accession'] for i in self.cache().iter_entrez( 'flu' )] )
+
+    def test_error_body( self ):
+        self.check_bad_batch( self.fake.server.error_at )
+
+    def test_truncated_body( self ):
+        self.check_bad_batch( self.fake.server.truncate_at )
+
+    def test_short_body( self ):
+        self.check_bad_batch( self.fake.server.short_at )
+
+    def test_wentrez_fetch_cached( self ):
+        os.chdir( self.tempdir )
+        w = entrez.WEntrez()
+        cache = w.fetch_cached( 'flu', self.tempdir, self.transport, 10, requests_per_second=None )
+        w.write_fasta( records=cache.iter_entrez( 'flu' ) )
+        with open( 'entrez.fna' ) as fh:
+            eq_( 46, len( fh.readlines() ) )
+
+class TestConcurrentEntrezCache( TestEntrezCache ):
+    ''' Same as sequential but with batches downloaded at the same time '''
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.fake = FakeEntrez( 23, delay=0.2 )
+        self.transport = entrez.EutilsTransport( self.fake.url )
+
+    def cache( self, **kwargs ):
+        kwargs.setdefault( 'workers', 5 )
+        return super( TestConcurrentEntrezCache, self ).cache( **kwargs )
+
+    def test_in_flight( self ):
+        ''' 5 batches at the same time take about as long as one '''
+        start = time.time()
+        self.cache().batches( 'flu' )
+        ok_( time.time() - start < 0.2 * 4, 'Batches were not downloaded concurrently' )
+
+    def test_rate_limit( self ):
+        ''' 6 requests at 10 per second take at least half a second '''
+        self.fake.server.delay = 0
+        start = time.time()
+        eq_( 23, len( list( self.cache( requests_per_second=10 ).iter_entrez( 'flu' ) ) ) )
+        ok_( time.time() - start >= 0.5 )
+
+class TestRateLimiter( object ):
+    def test_no_limit( self ):
+        limiter = entrez.RateLimiter( None )
+        start = time.time()
+        for i in range( 100 ):
+            limiter.wait()
+        ok_( time.time() - start < 0.1 )
+
+    def test_threads( self ):
+        ''' Calls from many threads are spaced out '''
+        limiter = entrez.RateLimiter( 20 )
+        start = time.time()
+        threads = [threading.Thread( target=limiter.wait ) for i in range( 10 )]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ok_( time.time() - start >= 9 / 20.0 - 0.01 )
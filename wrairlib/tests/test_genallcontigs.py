@@ -0,0 +1,69 @@
+import os
+import os.path
+import sys
+import imp
+import tempfile
+import shutil
+import argparse
+
+from nose.tools import eq_
+from nose.plugins.skip import SkipTest
+
+BIN = os.path.join( os.path.dirname( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) ), 'bin' )
+
+# Project directory name(GsProject samplename__midkey__virus) -> [(contig title, sequence)]
+PROJECTS = {
+    'sample1__RL1__H3N2': [
+        ('contig00001 HA, 1..8  length=8   numreads=3', 'ACGTACGT'),
+        ('contig00002 NA, 1..4  length=4   numreads=2', 'TTGA'),
+    ],
+    'sample2__RL2__H1N1': [
+        ('contig00001 PB2, 1..6  length=6   numreads=5', 'GGCCAA'),
+    ],
+}
+
+def write_project( maindir, name, contigs ):
+    ''' gsMapper project directory with 454AllContigs.fna/qual for contigs '''
+    mapping = os.path.join( maindir, name, 'mapping' )
+    os.makedirs( mapping )
+    with open( os.path.join( maindir, name, '454Project.xml' ), 'w' ) as fh:
+        fh.write( '<?xml version="1.0"?>\n<newblerProject><projectType>mapping</projectType></newblerProject>\n' )
+    with open( os.path.join( mapping, '454AllContigs.fna' ), 'w' ) as fna:
+        with open( os.path.join( mapping, '454AllContigs.qual' ), 'w' ) as qual:
+            for title, seq in contigs:
+                fna.write( '>%s\n%s\n' % (title, seq) )
+                qual.write( '>%s\n%s\n' % (title, ' '.join( ['40'] * len( seq ) )) )
+
+class TestGenAllContigs( object ):
+    def setUp( self ):
+        try:
+            import roche.newbler
+        except ImportError:
+            raise SkipTest( 'roche is not installed' )
+        sys.path.insert( 0, BIN )
+        self.genallcontigs = imp.load_source( 'genallcontigs', os.path.join( BIN, 'genallcontigs.py' ) )
+        self.maindir = tempfile.mkdtemp()
+        for name, contigs in PROJECTS.items():
+            write_project( self.maindir, name, contigs )
+
+    def tearDown( self ):
+        sys.path.remove( BIN )
+        shutil.rmtree( self.maindir )
+
+    def convert( self, outdir, jobs ):
+        ''' {output file name: contents} of running genallcontigs with jobs '''
+        self.genallcontigs.main( argparse.Namespace( maindir=self.maindir, outdir=outdir, jobs=jobs, loglevel='INFO' ) )
+        outdir = os.path.join( self.maindir, outdir )
+        files = {}
+        for name in os.listdir( outdir ):
+            with open( os.path.join( outdir, name ) ) as fh:
+                files[name] = fh.read()
+        return files
+
+    def test_jobs_same_as_serial( self ):
+        ''' Projects converted by pool workers have the same names and renamed ids as a serial run '''
+        serial = self.convert( 'serial', 1 )
+        eq_( ['sample1__RL1__H3N2.fastq', 'sample2__RL2__H1N1.fastq'], sorted( serial ) )
+        ids = [line.split()[0] for line in serial['sample1__RL1__H3N2.fastq'].splitlines() if line.startswith( '@' )]
+        eq_( ['@sample1.1', '@sample1.2'], ids )
+        eq_( serial, self.convert( 'parallel', 2 ) )
@@ -0,0 +1,142 @@
+import os
+import os.path
+import tempfile
+import shutil
+
+from nose.tools import eq_, ok_, raises
+
+from Bio import SeqIO
+
+from .. import pgm
+from .. import sff
+
+import fixtures
+
+ADAPTER = 'GAT'
+BARCODES = (
+    ('IonXpress_001', 'CTAAGGTAAC'),
+    ('IonXpress_002', 'TAAGGAGAAC'),
+    ('IonXpress_003', 'AAGAGGATTC'),
+)
+
+def pgm_barcode( id_str, sequence, adapter = ADAPTER, sfffilepath = None, max_num = 'All', mismatches = 0 ):
+    return pgm.PGMBarcode(
+        id_str=id_str, type='', sequence=sequence, floworder='', index='1',
+        annotation='', adapter=adapter, score_mode='1', score_cutoff='2',
+        sfffilepath=sfffilepath, max_num=max_num, mismatches=mismatches
+    )
+
+def barcoded_read( name, barcode, insert = 'ACGTACGTACGT' ):
+    ''' Read made up of key + barcode + adapter + insert '''
+    seq = fixtures.KEY_SEQUENCE + barcode + ADAPTER + insert
+    clip = len( fixtures.KEY_SEQUENCE ) + len( barcode ) + len( ADAPTER )
+    return fixtures.sff_record( name, seq, clip )
+
+class TestPGMDemultiplexer( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.sff = os.path.join( self.tempdir, 'reads.sff' )
+        reads = []
+        # Barcode 1 gets 3 reads, barcode 2 gets 1 and barcode 3 none
+        for i in range( 3 ):
+            reads.append( barcoded_read( 'read1_%s' % i, BARCODES[0][1] ) )
+        reads.append( barcoded_read( 'read2_0', BARCODES[1][1] ) )
+        reads.append( barcoded_read( 'nomatch', 'GGGGGGGGGG' ) )
+        fixtures.make_sff( self.sff, reads )
+        self.barcodes = [pgm_barcode( i, s, sfffilepath=self.sff ) for i, s in BARCODES]
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def demultiplexer( self, *args ):
+        return pgm.PGMDemultiplexer( *args )
+
+    def test_counts( self ):
+        ''' Every read goes to its barcode in one pass '''
+        d = self.demultiplexer( self.barcodes )
+        result = d.run( self.sff, self.tempdir )
+        eq_( {'IonXpress_001': 3, 'IonXpress_002': 1, 'IonXpress_003': 0}, result )
+        eq_( 5, d.processed )
+
+    def test_output_files( self ):
+        ''' Only barcodes with reads get an sff file and it contains the right reads '''
+        self.demultiplexer( self.barcodes ).run( self.sff, self.tempdir )
+        ok_( not os.path.exists( os.path.join( self.tempdir, 'IonXpress_003.sff' ) ) )
+        names = [r.id for r in SeqIO.parse( os.path.join( self.tempdir, 'IonXpress_001.sff' ), 'sff' )]
+        eq_( ['read1_0', 'read1_1', 'read1_2'], names )
+
+    def test_same_as_per_barcode( self ):
+        ''' Matches what PGMBarcode.reads_for_barcode finds '''
+        result = self.demultiplexer( self.barcodes ).run( self.sff, self.tempdir )
+        for barcode in [pgm_barcode( i, s ) for i, s in BARCODES]:
+            eq_( result[barcode.id_str], len( list( barcode.reads_for_barcode( self.sff ) ) ) )
+
+    def test_max_num( self ):
+        ''' Stops after max_num reads '''
+        d = self.demultiplexer( self.barcodes, 2 )
+        result = d.run( self.sff, self.tempdir )
+        eq_( 2, d.processed )
+        eq_( 2, result['IonXpress_001'] )
+
+    @raises( ValueError )
+    def test_duplicate_barcodes( self ):
+        ''' Two barcodes with the same sequence are an error '''
+        pgm.barcode_lookup( self.barcodes + [pgm_barcode( 'dup', BARCODES[0][1].lower() )] )
+
+    def test_mismatches( self ):
+        ''' Reads within a barcode's mismatches match it and ties are ambiguous '''
+        reads = [
+            # 1 mismatch from barcode 1
+            barcoded_read( 'mm1', 'CTAAGGTAAA' ),
+            # 2 mismatches from barcode 1
+            barcoded_read( 'mm2', 'CTAAGGTATA' ),
+            # 1 mismatch from both of the barcodes below
+            barcoded_read( 'amb', 'AAAAAAAAAT' ),
+        ]
+        fixtures.make_sff( self.sff, reads )
+        barcodes = [
+            pgm_barcode( 'bc1', 'CTAAGGTAAC', mismatches=1 ),
+            pgm_barcode( 'bc2', 'AAAAAAAAAA', mismatches=1 ),
+            pgm_barcode( 'bc3', 'AAAAAAAATT', mismatches=1 ),
+        ]
+        d = self.demultiplexer( barcodes )
+        result = d.run( self.sff, self.tempdir )
+        eq_( {'bc1': 1, 'bc2': 0, 'bc3': 0}, result )
+        eq_( 1, d.ambiguous )
+        eq_( 1, d.unmatched )
+
+    def test_readmatches_mismatches( self ):
+        ''' Per barcode reads_for_barcode honors mismatches too '''
+        fixtures.make_sff( self.sff, [barcoded_read( 'mm1', 'CTAAGGTAAA' )] )
+        eq_( 0, len( list( pgm_barcode( 'bc1', 'CTAAGGTAAC' ).reads_for_barcode( self.sff ) ) ) )
+        eq_( 1, len( list( pgm_barcode( 'bc1', 'CTAAGGTAAC', mismatches=1 ).reads_for_barcode( self.sff ) ) ) )
+
+class TestShardedPGMDemultiplexer( TestPGMDemultiplexer ):
+    def demultiplexer( self, *args ):
+        return pgm.ShardedPGMDemultiplexer( *args, cpus=2 )
+
+    def test_same_as_single_pass( self ):
+        ''' Sharded output has the same reads in the same order as the single pass '''
+        single = os.path.join( self.tempdir, 'single' )
+        sharded = os.path.join( self.tempdir, 'sharded' )
+        os.mkdir( single )
+        os.mkdir( sharded )
+        expect = pgm.PGMDemultiplexer( self.barcodes ).run( self.sff, single )
+        result = pgm.ShardedPGMDemultiplexer( self.barcodes, cpus=3 ).run( self.sff, sharded )
+        eq_( expect, result )
+        eq_( sorted( os.listdir( single ) ), sorted( os.listdir( sharded ) ) )
+        for sff in os.listdir( single ):
+            expect = [(r.id, str( r.seq )) for r in SeqIO.parse( os.path.join( single, sff ), 'sff' )]
+            result = [(r.id, str( r.seq )) for r in SeqIO.parse( os.path.join( sharded, sff ), 'sff' )]
+            eq_( expect, result )
+
+    def test_read_count_header( self ):
+        ''' Merged sff header has the total read count '''
+        pgm.ShardedPGMDemultiplexer( self.barcodes, cpus=4 ).run( self.sff, self.tempdir )
+        with open( os.path.join( self.tempdir, 'IonXpress_001.sff' ), 'rb' ) as fh:
+            eq_( 3, sff.SffHeader.read( fh ).number_of_reads )
+
+    def test_no_leftover_parts( self ):
+        ''' Part files are cleaned up '''
+        pgm.ShardedPGMDemultiplexer( self.barcodes, cpus=2 ).run( self.sff, self.tempdir )
+        eq_( ['IonXpress_001.sff', 'IonXpress_002.sff', 'reads.sff'], sorted( os.listdir( self.tempdir ) ) )
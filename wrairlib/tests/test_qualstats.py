@@ -0,0 +1,139 @@
+import os
+import os.path
+import sys
+import imp
+import random
+import subprocess
+import tempfile
+import shutil
+
+from nose.tools import eq_, raises
+from Bio import SeqIO
+
+from .. import qualstats
+
+import fixtures
+
+BIN = os.path.join( os.path.dirname( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) ), 'bin' )
+
+def naive_stats( reads ):
+    ''' Same per base loop base_qual.py used to do '''
+    stats = []
+    for quals in reads:
+        for i, q in enumerate( quals ):
+            if len( stats ) <= i:
+                stats.append( (100, 0, 0, 0, 0) )
+            minq, sumq, avgq, maxq, depth = stats[i]
+            stats[i] = (min( q, minq ), sumq + q, (sumq + q) * 1.0 / (depth + 1), max( q, maxq ), depth + 1)
+    return stats
+
+class TestQualityStats( object ):
+    def setUp( self ):
+        rand = random.Random( 42 )
+        self.reads = [[rand.randint( 0, 40 ) for i in range( rand.randint( 0, 50 ) )] for j in range( 200 )]
+
+    def test_add( self ):
+        qs = qualstats.QualityStats( size=4 )
+        for quals in self.reads:
+            qs.add( quals )
+        eq_( naive_stats( self.reads ), qs.stats() )
+        eq_( 200, qs.reads )
+
+    def test_add_many( self ):
+        ''' Batches grow the arrays and give the same stats as single reads '''
+        qs = qualstats.QualityStats( size=4 )
+        qs.add_many( self.reads[:50] )
+        qs.add_many( self.reads[50:] )
+        eq_( naive_stats( self.reads ), qs.stats() )
+
+    def test_histogram( self ):
+        qs = qualstats.QualityStats( histogram=True )
+        qs.add_many( self.reads )
+        eq_( qs.depth[:qs.length].tolist(), qs.histogram[:qs.length].sum( axis=1 ).tolist() )
+        eq_( qs.min[:qs.length].tolist(), qs.quantiles( 0 ).tolist() )
+        eq_( qs.max[:qs.length].tolist(), qs.quantiles( 100 ).tolist() )
+
+    def test_histogram_out_of_range( self ):
+        ''' Qualities outside of 0-MAX_QUAL are clipped instead of counted at the next position '''
+        reads = [[95, 10, 10], [-1, 10]]
+        qs = qualstats.QualityStats( histogram=True )
+        qs.add_many( reads )
+        single = qualstats.QualityStats( histogram=True )
+        for quals in reads:
+            single.add( quals )
+        for stats in (qs, single):
+            eq_( [2, 2, 1], stats.histogram[:stats.length].sum( axis=1 ).tolist() )
+            eq_( [qualstats.MAX_QUAL, 10, 10], stats.quantiles( 100 ).tolist() )
+            eq_( [0, 10, 10], stats.quantiles( 0 ).tolist() )
+            eq_( naive_stats( reads ), stats.stats() )
+
+    @raises( ValueError )
+    def test_quantiles_need_histogram( self ):
+        qualstats.QualityStats().quantiles( 50 )
+
+class ReadsBySample( object ):
+    def setUp( self ):
+        ''' ReadsBySample like tree with a qual, fastq and sff file '''
+        self.tempdir = tempfile.mkdtemp()
+        rand = random.Random( 7 )
+        self.records = []
+        for i in range( 30 ):
+            record = fixtures.sff_record( 'read%s' % i, 'ACGT' * rand.randint( 1, 20 ) )
+            record.letter_annotations['phred_quality'] = [rand.randint( 0, 40 ) for b in record.seq]
+            self.records.append( record )
+        for sample in ('sample1', 'sample2'):
+            os.mkdir( os.path.join( self.tempdir, sample ) )
+        SeqIO.write( self.records[:10], os.path.join( self.tempdir, 'sample1', 'a.qual' ), 'qual' )
+        SeqIO.write( self.records[10:20], os.path.join( self.tempdir, 'sample1', 'b.fastq' ), 'fastq' )
+        fixtures.make_sff( os.path.join( self.tempdir, 'sample2', 'c.sff' ), self.records[20:] )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def quals( self, records ):
+        return [r.letter_annotations['phred_quality'] for r in records]
+
+class TestProfileRun( ReadsBySample ):
+    def test_profile_run( self ):
+        ''' Merged profiles are the same as profiling the reads serially '''
+        per_file, per_sample, run = qualstats.profile_run( [self.tempdir], cpus=2 )
+        eq_( 3, len( per_file ) )
+        eq_( naive_stats( self.quals( self.records[:20] ) ), per_sample['sample1'].stats() )
+        eq_( naive_stats( self.quals( self.records[20:] ) ), per_sample['sample2'].stats() )
+        eq_( naive_stats( self.quals( self.records ) ), run.stats() )
+        eq_( 30, run.reads )
+
+    @raises( ValueError )
+    def test_unknown_format( self ):
+        list( qualstats.read_qualities( 'reads.txt' ) )
+
+class TestBaseQual( ReadsBySample ):
+    def base_qual( self, *args ):
+        ''' Rows of base_qual.py's csv output '''
+        env = dict( os.environ, PYTHONPATH=os.path.dirname( BIN ) )
+        out = subprocess.check_output( [sys.executable, os.path.join( BIN, 'base_qual.py' )] + list( args ),
+            env=env, stderr=open( os.devnull, 'w' ) )
+        return [line.split( ',' ) for line in out.splitlines()]
+
+    def expected( self, records ):
+        return [['Pos', 'Min', 'Sum', 'Avg', 'Max', 'Depth']] + \
+            [[str( p )] + [str( x ) for x in stat] for p, stat in enumerate( naive_stats( self.quals( records ) ), 1 )]
+
+    def test_single_fastq( self ):
+        eq_( self.expected( self.records[10:20] ), self.base_qual( os.path.join( self.tempdir, 'sample1', 'b.fastq' ) ) )
+
+    def test_single_sff( self ):
+        eq_( self.expected( self.records[20:] ), self.base_qual( os.path.join( self.tempdir, 'sample2', 'c.sff' ) ) )
+
+    def test_write_profiles( self ):
+        ''' A sample named all does not replace the profile of the entire run '''
+        os.rename( os.path.join( self.tempdir, 'sample2' ), os.path.join( self.tempdir, 'all' ) )
+        outdir = os.path.join( self.tempdir, 'profiles' )
+        base_qual = imp.load_source( 'base_qual', os.path.join( BIN, 'base_qual.py' ) )
+        per_file, per_sample, run = qualstats.profile_run( [self.tempdir] )
+        base_qual.write_profiles( outdir, per_file, per_sample, run )
+        eq_( ['files', 'run.csv', 'samples'], sorted( os.listdir( outdir ) ) )
+        eq_( ['all.csv', 'sample1.csv'], sorted( os.listdir( os.path.join( outdir, 'samples' ) ) ) )
+        eq_( ['c.sff.csv'], os.listdir( os.path.join( outdir, 'files', 'all' ) ) )
+        with open( os.path.join( outdir, 'run.csv' ) ) as fh:
+            eq_( len( naive_stats( self.quals( self.records ) ) ) + 1, len( fh.readlines() ) )
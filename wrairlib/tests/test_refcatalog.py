@@ -0,0 +1,64 @@
+import os
+import os.path
+import tempfile
+import shutil
+
+from nose.tools import eq_, ok_, raises
+from Bio import SeqIO
+
+from .. import refcatalog, util
+from ..exceptions1 import TooManyReferenceFilesException, NoReferenceFileException
+
+REFDIR = os.path.join( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ), 'Examples', 'Ref' )
+
+class TestReferenceCatalog( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.refdir = os.path.join( self.tempdir, 'Ref' )
+        shutil.copytree( REFDIR, self.refdir )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tempdir )
+
+    def path( self, name ):
+        return os.path.join( self.refdir, name )
+
+    def test_same_as_util( self ):
+        ''' Files, lengths and identifiers are the same as util finds by scanning '''
+        catalog = refcatalog.ReferenceCatalog( self.refdir )
+        for ident in util.get_idents_from_reference( self.path( 'H3N2_Managua.fasta' ) ):
+            eq_( util.find_reference_file_for( '>' + ident, self.refdir )[0], catalog.lookup( ident ).file )
+            eq_( util.get_gap_sequence_length( '>' + ident, self.refdir ), catalog.length( ident ) )
+        for path in util.list_dir( self.refdir, util.FASTA_EXTENSIONS ):
+            eq_( util.get_idents_from_reference( path ), catalog.idents_in( path ) )
+
+    def test_sequence_and_gene( self ):
+        catalog = refcatalog.ReferenceCatalog( self.refdir )
+        record = SeqIO.index( self.path( 'infB_Victoria.fasta' ), 'fasta' )['CY040451_B/Malaysia/2506/2004/6(NA)']
+        eq_( str( record.seq ), catalog.sequence( '>CY040451_B/Malaysia/2506/2004/6(NA)' ) )
+        eq_( 'NA', catalog.lookup( 'CY040451_B/Malaysia/2506/2004/6(NA)' ).gene )
+
+    @raises( TooManyReferenceFilesException )
+    def test_too_many( self ):
+        refcatalog.ReferenceCatalog( self.refdir ).lookup( '>GQ377049_PB1_California04' )
+
+    @raises( NoReferenceFileException )
+    def test_missing( self ):
+        refcatalog.ReferenceCatalog( self.refdir ).lookup( 'NOPECANTfindME' )
+
+    def test_incremental_refresh( self ):
+        ''' Only new and changed files are scanned again and removed files are forgotten '''
+        eq_( 6, len( refcatalog.ReferenceCatalog( self.refdir ).scanned ) )
+        eq_( [], refcatalog.ReferenceCatalog( self.refdir ).scanned )
+        with open( self.path( 'H1N1_boston.fasta' ), 'a' ) as fh:
+            fh.write( '>new_HA_ref\nACGT\n' )
+        os.unlink( self.path( 'pdmH1N1_California2.fasta' ) )
+        catalog = refcatalog.ReferenceCatalog( self.refdir )
+        eq_( [self.path( 'H1N1_boston.fasta' )], catalog.scanned )
+        eq_( (4, 'HA'), (catalog.length( 'new_HA_ref' ), catalog.lookup( 'new_HA_ref' ).gene) )
+        eq_( self.path( 'pdmH1N1_California.fasta' ), catalog.lookup( 'GQ377049_PB1_California04' ).file )
+        eq_( [], catalog.refresh() )
+
+    def test_not_persisted( self ):
+        refcatalog.ReferenceCatalog( self.refdir, persist=False )
+        ok_( not os.path.exists( self.path( '.refcatalog' ) ) )
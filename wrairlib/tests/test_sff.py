@@ -0,0 +1,121 @@
+import os
+import os.path
+import tempfile
+import shutil
+import itertools
+from StringIO import StringIO
+
+from nose.tools import eq_, ok_, raises
+
+from Bio import SeqIO
+
+from .. import sff
+
+import fixtures
+
+class TestSff( object ):
+    def setUp( self ):
+        self.tempdir = tempfile.mkdtemp()
+        self.sff = os.path.join( self.tempdir, 'reads.sff' )
+        self.records = [fixtures.sff_record( 'read%s' % i, 'TCAG' + 'ACGT' * i, 4 * i ) for i in range( 1, 8 )]
+        fixtures.make_sff( self.sff, self.records )
+        self.fh = open( self.sff, 'rb' )
+        self.header = sff.SffHeader.read( self.fh )
+
+    def tearDown( self ):
+        self.fh.close()
+        shutil.rmtree( self.tempdir )
+
+class TestSffHeader( TestSff ):
+    def test_read( self ):
+        eq_( 7, self.header.number_of_reads )
+        eq_( fixtures.KEY_SEQUENCE, self.header.key_sequence )
+        eq_( fixtures.FLOW_CHARS, self.header.flow_chars )
+        # Biopython writes an index after the reads
+        ok_( self.header.index_offset > self.header.header_length )
+
+    def test_pack( self ):
+        ''' Packed header is the same as the header in the file '''
+        self.fh.seek( 0 )
+        eq_( self.fh.read( self.header.header_length ), self.header.pack() )
+
+    @raises( ValueError )
+    def test_notsff( self ):
+        sff.SffHeader.read( StringIO( 'x' * 64 ) )
+
+class TestIterRawReads( TestSff ):
+    def test_same_as_biopython( self ):
+        ''' Names, bases and clips are the same as Bio.SeqIO gives '''
+        result = [(r.name, r.bases, r.clip_adapter_left) for r in sff.iter_raw_reads( self.fh, self.header )]
+        expect = [(r.id, str( r.seq ).upper(), r.annotations['clip_adapter_left']) for r in SeqIO.parse( self.sff, 'sff' )]
+        eq_( expect, result )
+
+    def test_chunks( self ):
+        ''' Chunks cover every read once and in order '''
+        chunks = sff.chunk_reads( self.fh, self.header, 3 )
+        eq_( [3, 2, 2], [count for start, end, count in chunks] )
+        names = []
+        for start, end, count in chunks:
+            reads = [r.name for r in sff.iter_raw_reads( self.fh, self.header, start, end )]
+            eq_( count, len( reads ) )
+            names += reads
+        eq_( [r.id for r in self.records], names )
+
+    def test_chunks_max_num( self ):
+        chunks = sff.chunk_reads( self.fh, self.header, 2, 3 )
+        eq_( 3, sum( [count for start, end, count in chunks] ) )
+
+    @raises( ValueError )
+    def test_chunks_truncated( self ):
+        ''' File that ends in the middle of a read it says it has '''
+        last = list( sff.chunk_reads( self.fh, self.header, 7 ) )[-1][0]
+        truncated = os.path.join( self.tempdir, 'truncated.sff' )
+        with open( truncated, 'wb' ) as fh:
+            self.fh.seek( 0 )
+            fh.write( self.fh.read( last + 4 ) )
+        with open( truncated, 'rb' ) as fh:
+            sff.chunk_reads( fh, sff.SffHeader.read( fh ), 2 )
+
+class TestSffRecord( TestSff ):
+    def test_same_as_biopython( self ):
+        ''' Lazily decoded fields are the same as Bio.SeqIO gives '''
+        result = [(r.name, r.seq, r.quality, r.flowgram, r.flow_index) for r in sff.iter_records( self.sff )]
+        expect = [(r.id, str( r.seq ), r.letter_annotations['phred_quality'], r.annotations['flow_values'], r.annotations['flow_index']) for r in SeqIO.parse( self.sff, 'sff' )]
+        eq_( expect, result )
+
+    def test_subsequence( self ):
+        for record in itertools.islice( sff.iter_records( self.sff ), 1, 2 ):
+            eq_( 'AC', record.subsequence( 4, 6 ) )
+            eq_( 'ACGTACGT', record.subsequence( 4, 100 ) )
+            eq_( '', record.subsequence( 6, 4 ) )
+
+    @raises( ValueError )
+    def test_closed_after_loop( self ):
+        ''' Memory map is closed once the reads have all been read '''
+        records = list( sff.iter_records( self.sff ) )
+        records[0].data
+
+    def test_max_num( self ):
+        eq_( 3, len( list( sff.iter_records( self.sff, 3 ) ) ) )
+
+    def test_write_fastq( self ):
+        ''' Same fastq as Bio.SeqIO writes '''
+        result = StringIO()
+        eq_( 7, sff.write_fastq( sff.iter_records( self.sff ), result ) )
+        expect = StringIO()
+        SeqIO.write( SeqIO.parse( self.sff, 'sff' ), expect, 'fastq' )
+        eq_( expect.getvalue(), result.getvalue() )
+
+class TestSffRawWriter( TestSff ):
+    def test_copy( self ):
+        ''' Raw copied reads can be read back by Biopython '''
+        outpath = os.path.join( self.tempdir, 'out.sff' )
+        with open( outpath, 'wb' ) as fh:
+            writer = sff.SffRawWriter( fh, self.header )
+            for read in sff.iter_raw_reads( self.fh, self.header ):
+                if read.name != 'read3':
+                    writer.write( read.data )
+            eq_( 6, writer.close() )
+        result = [(r.id, str( r.seq )) for r in SeqIO.parse( outpath, 'sff' )]
+        expect = [(r.id, str( r.seq )) for r in SeqIO.parse( self.sff, 'sff' ) if r.id != 'read3']
+        eq_( expect, result )
@@ -0,0 +1,64 @@
+import random
+import cStringIO
+
+from nose.tools import eq_, raises
+from Bio import SeqIO
+
+from .. import util
+
+def fasta_qual( entries ):
+    ''' Fasta and qual file contents for (title, seq, quals) entries '''
+    fasta = ''.join( ['>%s\n%s\n%s\n' % (t, s[:30], s[30:]) for t, s, q in entries] )
+    qual = ''.join( ['>%s\n%s\n%s\n' % (t, ' '.join( map( str, q[:7] ) ), ' '.join( map( str, q[7:] ) )) for t, s, q in entries] )
+    return fasta, qual
+
+def rename( title ):
+    ''' title2ids like allcontig_to_allsample.rename_seqid '''
+    ident, desc = title.split( None, 1 )
+    return 'sample.' + ident, ' ', desc
+
+class TestWriteFastaQualToFastq( object ):
+    def setUp( self ):
+        rand = random.Random( 5 )
+        self.entries = []
+        for i in range( 50 ):
+            seq = ''.join( [rand.choice( 'ACGTN' ) for j in range( rand.randint( 1, 80 ) )] )
+            quals = [rand.randint( 0, 64 ) for b in seq]
+            self.entries.append( ('contig%05d  length=%s' % (i, len( seq )), seq, quals) )
+
+    def convert( self, fasta, qual, **kwargs ):
+        out = cStringIO.StringIO()
+        count = util.write_fastaqual_to_fastq( cStringIO.StringIO( fasta ), cStringIO.StringIO( qual ), out, **kwargs )
+        return count, out.getvalue()
+
+    def seqio( self, fasta, qual, **kwargs ):
+        out = cStringIO.StringIO()
+        records = util.fastaqual_to_fastq( cStringIO.StringIO( fasta ), cStringIO.StringIO( qual ), **kwargs )
+        count = SeqIO.write( records, out, 'fastq' )
+        return count, out.getvalue()
+
+    def test_same_as_seqio( self ):
+        fasta, qual = fasta_qual( self.entries )
+        eq_( self.seqio( fasta, qual ), self.convert( fasta, qual ) )
+
+    def test_title2ids( self ):
+        fasta, qual = fasta_qual( self.entries )
+        eq_( self.seqio( fasta, qual, title2ids=rename ), self.convert( fasta, qual, title2ids=rename ) )
+
+    def test_small_buffer( self ):
+        fasta, qual = fasta_qual( self.entries )
+        eq_( self.convert( fasta, qual ), self.convert( fasta, qual, buffer_size=10 ) )
+
+    def test_capped_qualities( self ):
+        fasta, qual = fasta_qual( [('c1', 'ACGT', [-1, 0, 93, 120])] )
+        eq_( (1, '@c1\nACGT\n+\n!!~~\n'), self.convert( fasta, qual ) )
+
+    @raises( ValueError )
+    def test_mismatched_entries( self ):
+        fasta, qual = fasta_qual( self.entries[:2] )
+        self.convert( fasta, qual.replace( 'contig00001', 'contig00009' ) )
+
+    @raises( ValueError )
+    def test_missing_qual( self ):
+        fasta, qual = fasta_qual( self.entries[:2] )
+        self.convert( fasta, fasta_qual( self.entries[:1] )[1] )
@@ -4,6 +4,10 @@ import sys
 import fnmatch
 import os.path
 import logging
+import cPickle
+from collections import OrderedDict
+from itertools import izip_longest
+from multiprocessing.pool import ThreadPool
 
 from exceptions1 import *
 
@@ -23,6 +27,17 @@ except ImportError:
 # WRAIR common fasta extensions
 FASTA_EXTENSIONS = ['fasta','fna','fas']
 
+# Identifier at the start of a fasta identifier line
+IDENT_PATTERN = re.compile( '>(\S+)' )
+
+# Amount of search terms from which search_refs_many uses a TermAutomaton instead of
+# looking for every term in each line
+AUTOMATON_MIN_TERMS = 80
+
+# Quality score as it is written in a qual file -> phred+33 character
+# Scores are capped to 0-93 like Biopython does and anything not in here goes through _phred33
+PHRED33 = dict( [(str( q ), chr( min( max( q, 0 ), 93 ) + 33 )) for q in range( -20, 256 )] )
+
 def search_refs( refs, search_term, ext_only = None ):
     """
         Provides similar functionality as grep "<search_term>" <dir_path>/*
@@ -55,6 +70,113 @@ def search_refs( refs, search_term, ext_only = None ):
             line_count += 1
     return found
 
+class TermAutomaton( object ):
+    """
+        Aho-Corasick automaton that finds every one of many terms in a string with a
+        single pass over the string no matter how many terms there are
+
+        >>> a = TermAutomaton( ['he', 'she', 'his', 'hers'] )
+        >>> sorted( a.find( 'ushers' ) )
+        ['he', 'hers', 'she']
+        >>> a.find( 'nothing' )
+        set([])
+    """
+    def __init__( self, terms ):
+        """
+            terms -- Iterable of non empty strings to search for
+        """
+        # State -> {character: next state}
+        self.goto = [{}]
+        # State -> state of the longest suffix that is also a prefix of a term
+        self.fail = [0]
+        # State -> terms that end at that state
+        self.out = [()]
+        for term in terms:
+            self._add( term )
+        self._link()
+
+    def _add( self, term ):
+        state = 0
+        for ch in term:
+            nxt = self.goto[state].get( ch )
+            if nxt is None:
+                nxt = len( self.goto )
+                self.goto[state][ch] = nxt
+                self.goto.append( {} )
+                self.fail.append( 0 )
+                self.out.append( () )
+            state = nxt
+        if term not in self.out[state]:
+            self.out[state] += (term,)
+
+    def _link( self ):
+        """ Breadth first fill in of the fail links and what every state outputs """
+        queue = list( self.goto[0].values() )
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                queue.append( nxt )
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                f = self.goto[f].get( ch, 0 )
+                self.fail[nxt] = f
+                self.out[nxt] += self.out[f]
+
+    def find( self, text ):
+        """ Set of the terms found in text """
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get( ch, 0 )
+            if out[state]:
+                found.update( out[state] )
+        return found
+
+def search_refs_many( refs, search_terms ):
+    """
+        search_refs for many identifier terms at the same time
+        Every reference file is only read once no matter how many terms there are and
+        only identifier lines(lines starting with >) are searched
+
+        With fewer than AUTOMATON_MIN_TERMS terms each term is looked for in every
+        identifier line, otherwise a TermAutomaton finds all of them in a single pass
+        over the line
+
+        Arguments:
+            refs -- List of reference files to search through
+            search_terms -- The terms to search for
+
+        Return:
+            Dictionary keyed by every search term of the list of (file, line) tuples it was found on
+            in the same order search_refs gives them
+
+        Tests:
+        >>> files = ['Examples/Ref/infB_Victoria.fasta', 'Examples/Ref/pdmH1N1_California.fasta', 'Examples/Ref/H3N2_Managua.fasta', 'Examples/Ref/H5N1_Thailand.fasta', 'Examples/Ref/H1N1_boston.fasta']
+        >>> hits = search_refs_many( files, ['>GQ377049_PB1_California04', '>CY081003_NA_Boston09', 'CANTFINDME&@^&'] )
+        >>> print hits['>GQ377049_PB1_California04'], hits['>CY081003_NA_Boston09'], hits['CANTFINDME&@^&']
+        [('Examples/Ref/pdmH1N1_California.fasta', 35)] [('Examples/Ref/H1N1_boston.fasta', 153)] []
+        >>> hits = search_refs_many( files, ['>CY081003_NA_Boston09'] + ['>NOTHERE%s' % i for i in range( AUTOMATON_MIN_TERMS )] )
+        >>> print hits['>CY081003_NA_Boston09'], hits['>NOTHERE0']
+        [('Examples/Ref/H1N1_boston.fasta', 153)] []
+    """
+    found = dict( [(term, []) for term in search_terms] )
+    if len( found ) >= AUTOMATON_MIN_TERMS:
+        find = TermAutomaton( found.keys() ).find
+    else:
+        terms = found.keys()
+        find = lambda line: [term for term in terms if term in line]
+    for f in refs:
+        with open( f ) as fh:
+            for line_count, line in enumerate( fh, 1 ):
+                if line[0] != '>':
+                    continue
+                for term in find( line ):
+                    found[term].append( (f, line_count) )
+    return found
+
 def list_dir( dir_path, ext_only = None ):
     """
         Lists contens of a directory
@@ -142,6 +264,35 @@ def find_reference_file_for( reference, refs, ext = FASTA_EXTENSIONS ):
         raise NoReferenceFileException( reference, refs )
     return files[0]
 
+def find_reference_files_for( references, refs, ext = FASTA_EXTENSIONS ):
+    """
+        find_reference_file_for many identifiers with a single pass over the reference files
+        Only identifier lines are searched(see search_refs_many) so the references have to be
+        identifiers including the >
+
+        Return:
+            Dictionary keyed by each reference of the file it is in and what line it is on
+            Raises the same exceptions find_reference_file_for does for the first reference
+            that is not in exactly one file
+
+        Tests:
+        >>> refs = find_reference_files_for( ['>CY081008_PB2_Boston09', '>CY074915_HA_Managua09'], 'Examples/Ref' )
+        >>> print refs['>CY081008_PB2_Boston09'], refs['>CY074915_HA_Managua09']
+        ('Examples/Ref/H1N1_boston.fasta', 1) ('Examples/Ref/H3N2_Managua.fasta', 103)
+    """
+    file_list = refs
+    if type( refs ) != list:
+        file_list = list_dir( refs, ext )
+    found = search_refs_many( file_list, references )
+    for reference in references:
+        files = found[reference]
+        if len( files ) > 1:
+            raise TooManyReferenceFilesException( reference, [f[0] for f in files] )
+        elif len( files ) == 0:
+            raise NoReferenceFileException( reference, refs )
+        found[reference] = files[0]
+    return found
+
 def get_gap_sequence_length( reference, ref_path, ext = FASTA_EXTENSIONS ):
     """
         Fetches the total sequence length of a reference sequence
@@ -197,16 +348,43 @@ def get_idents_from_reference( ref_path ):
         ['FJ969516_PB2_California04', 'GQ377049_PB1_California04', 'FJ969515_PA_California04', 'GQ117044_HA_California04', 'FJ969512_NP_California04', 'FJ969517_NA_California04', 'FJ969513_MP_California04', 'FJ969514_NS_California04']
         ['FJ969516_PB2_California04', 'GQ377049_PB1_California04', 'FJ969515_PA_California04', 'GQ117044_HA_California04', 'FJ969512_NP_California04', 'FJ969517_NA_California04', 'FJ969513_MP_California04', 'FJ969514_NS_California04']
     """
-    # Pattern to match genes
-    cp = '>(\S+)'
+    genes = []
+    # Only identifier lines are looked at
+    with open( ref_path ) as fh:
+        for line in fh:
+            if line[0] == '>':
+                m = IDENT_PATTERN.match( line )
+                if m:
+                    genes.append( m.group( 1 ) )
+    return genes
 
-    # Open the file and find all matches from the pattern
-    fh = open( ref_path )
-    genes = re.findall( cp, fh.read() )
-    fh.close()
+def get_idents_from_references( ref_paths, threads = 4 ):
+    """
+        get_idents_from_reference for many reference files read at the same time
 
-    # Return the finds
-    return genes
+        Arguments:
+            ref_paths -- List of reference file paths
+            threads -- How many files to read at the same time
+
+        Return:
+            OrderedDict keyed by each path in ref_paths of its identifiers
+
+        Tests:
+        >>> refs = [os.path.join( "Examples", "Ref", r ) for r in ("H1N1_boston.fasta", "H3N2_Managua.fasta")]
+        >>> idents = get_idents_from_references( refs )
+        >>> idents.keys() == refs, idents[refs[1]] == get_idents_from_reference( refs[1] )
+        (True, True)
+    """
+    if threads > 1 and len( ref_paths ) > 1:
+        pool = ThreadPool( min( threads, len( ref_paths ) ) )
+        try:
+            idents = pool.map( get_idents_from_reference, ref_paths )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        idents = [get_idents_from_reference( path ) for path in ref_paths]
+    return OrderedDict( zip( ref_paths, idents ) )
 
 def pretty_print( d, indent = 0 ):
     for key, value in d.iteritems():
@@ -216,9 +394,105 @@ def pretty_print( d, indent = 0 ):
         else:
             print '\t' * (indent+1) + str( value )
 
-def write_fastaqual_to_fastq( fastafile, qualfile, outputfile, title2ids=None ):
-    records = fastaqual_to_fastq( fastafile, qualfile, title2ids=title2ids )
-    count = SeqIO.write( records, outputfile, "fastq" )
+def _phred33( qual ):
+    """ phred+33 character of a quality score capped to 0-93 the way Biopython does """
+    return chr( min( max( int( qual ), 0 ), 93 ) + 33 )
+
+def _clean_title( text ):
+    """ Whitespace clean up SeqIO writers do on ids and descriptions """
+    return text.replace( "\n", " " ).replace( "\r", " " ).replace( "  ", " " )
+
+def _fasta_entries( handle ):
+    """
+        Generator yielding (title, [lines]) for every entry of a fasta or qual file
+        Anything before the first identifier line is skipped
+    """
+    title = None
+    lines = []
+    for line in handle:
+        if line[0] == '>':
+            if title is not None:
+                yield title, lines
+            title = line[1:].rstrip()
+            lines = []
+        elif title is not None:
+            lines.append( line )
+    if title is not None:
+        yield title, lines
+
+def write_fastaqual_to_fastq( fastafile, qualfile, outputfile, title2ids=None, buffer_size=1 << 20 ):
+    """
+        Writes the entries of a fasta file and its qual file as a fastq file
+        The files are read in lockstep and written the same way SeqIO.write would write
+        the records of fastaqual_to_fastq without making a SeqRecord for each of them
+
+        Arguments:
+            fastafile -- Path or handle of the fasta file
+            qualfile -- Path or handle of the qual file
+            outputfile -- Path or handle to write to
+            title2ids -- Function that turns a title into (id, name, description) like
+                PairedFastaQualIterator uses
+            buffer_size -- About how many bytes are written at a time
+
+        Return:
+            Amount of records written
+    """
+    handles = []
+    def _open( f, mode ):
+        if isinstance( f, basestring ):
+            f = open( f, mode )
+            handles.append( f )
+        return f
+
+    try:
+        fastah = _open( fastafile, 'r' )
+        qualh = _open( qualfile, 'r' )
+        outh = _open( outputfile, 'w' )
+        count = 0
+        out = []
+        outsize = 0
+        for fasta, qual in izip_longest( _fasta_entries( fastah ), _fasta_entries( qualh ) ):
+            if qual is None:
+                raise ValueError( "FASTA file has more entries than the QUAL file." )
+            if fasta is None:
+                raise ValueError( "QUAL file has more entries than the FASTA file." )
+            title, seqlines = fasta
+            qtitle, quallines = qual
+            if title.split( None, 1 )[:1] != qtitle.split( None, 1 )[:1]:
+                raise ValueError( "FASTA and QUAL entries do not match (%s vs %s)." % (title, qtitle) )
+            seq = ''.join( [line.rstrip() for line in seqlines] ).replace( ' ', '' ).replace( '\r', '' )
+            tokens = ' '.join( quallines ).split()
+            try:
+                quals = ''.join( [PHRED33[q] for q in tokens] )
+            except KeyError:
+                quals = ''.join( [PHRED33.get( q ) or _phred33( q ) for q in tokens] )
+            if len( seq ) != len( quals ):
+                raise ValueError( "Sequence length and number of quality scores disagree for %s" % title )
+            if title2ids:
+                id, name, descr = title2ids( title )
+            else:
+                id, descr = (title.split( None, 1 ) or [''])[0], title
+            # Same title SeqIO's fastq writer makes
+            id = _clean_title( id )
+            descr = _clean_title( descr )
+            if descr and descr.split( None, 1 )[0] == id:
+                title = descr
+            elif descr:
+                title = "%s %s" % (id, descr)
+            else:
+                title = id
+            record = "@%s\n%s\n+\n%s\n" % (title, seq, quals)
+            out.append( record )
+            outsize += len( record )
+            count += 1
+            if outsize >= buffer_size:
+                outh.write( ''.join( out ) )
+                out = []
+                outsize = 0
+        outh.write( ''.join( out ) )
+    finally:
+        for h in handles:
+            h.close()
     return count
 
 def fastaqual_to_fastq( fastafile, qualfile, title2ids=None ):
@@ -273,6 +547,58 @@ def genenum_to_geneabbr( num, virus ):
     else:
         raise ValueError( "%s has no associated genes" % virus )
 
+def file_stamp( path ):
+    """
+        (size, modification time) of path
+        Anything saved that was built from path is out of date once this changes
+    """
+    st = os.stat( path )
+    return (st.st_size, st.st_mtime)
+
+def load_saved( saved_file, stamp ):
+    """
+        Returns what save_saved pickled to saved_file or None if it is missing, unreadable
+        or was saved with a different stamp
+
+        >>> import tempfile, shutil
+        >>> tdir = tempfile.mkdtemp()
+        >>> path = os.path.join( tdir, 'index' )
+        >>> print load_saved( path, 1 )
+        None
+        >>> save_saved( path, 1, {'a': (0, 10)} )
+        >>> load_saved( path, 1 )
+        {'a': (0, 10)}
+        >>> print load_saved( path, 2 )
+        None
+        >>> os.listdir( tdir )
+        ['index']
+        >>> shutil.rmtree( tdir )
+    """
+    try:
+        with open( saved_file, 'rb' ) as fh:
+            saved_stamp, data = cPickle.load( fh )
+    except (IOError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+        return None
+    if saved_stamp != stamp:
+        return None
+    return data
+
+def save_saved( saved_file, stamp, data ):
+    """
+        Pickle (stamp, data) to saved_file for load_saved
+        The pickle is written to a temporary file next to saved_file that is then renamed
+        over it so readers never see a partial file. Not being able to save is ignored
+        since it only means the data has to be built again next time
+    """
+    tmp = '%s.%s.tmp' % (saved_file, os.getpid())
+    try:
+        with open( tmp, 'wb' ) as fh:
+            cPickle.dump( (stamp, data), fh, cPickle.HIGHEST_PROTOCOL )
+        os.rename( tmp, saved_file )
+    except (IOError, OSError):
+        if os.path.exists( tmp ):
+            os.unlink( tmp )
+
 def _test():
     import doctest
     doctest.testmod()